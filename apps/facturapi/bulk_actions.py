@@ -0,0 +1,277 @@
+# apps/facturapi/bulk_actions.py
+import datetime
+import re
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Count
+
+from core.system.services import chunked, create_job, iter_sheet_rows
+
+CANCEL_JOB_KIND = "facturapi_cancel"
+PAYMENT_JOB_KIND = "facturapi_payment_complement"
+
+# CM cancela sin relación (02: comprobante con errores sin relación); CMR exige el UUID que sustituye (01)
+DEFAULT_MOTIVES = {"CM": "02", "CMR": "01"}
+CANCELLATION_MOTIVES = ("01", "02", "03", "04")
+SUBSTITUTION_MOTIVE = "01"
+UUID_RE = re.compile(r"^[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}$")
+
+# Encabezados aceptados para cada columna del Excel
+UUID_COLUMNS = ("UUID", "FOLIO FISCAL", "UUID FACTURA")
+MOTIVE_COLUMNS = ("MOTIVO", "MOTIVO CANCELACION", "MOTIVO CANCELACIÓN")
+SUBSTITUTION_COLUMNS = ("SUSTITUCION", "SUSTITUCIÓN", "UUID SUSTITUCION", "UUID SUSTITUCIÓN", "UUID RELACIONADO")
+AMOUNT_COLUMNS = ("MONTO", "IMPORTE", "MONTO PAGADO", "IMPORTE PAGADO")
+DATE_COLUMNS = ("FECHA PAGO", "FECHA DE PAGO", "FECHA")
+PAYMENT_FORM_COLUMNS = ("FORMA PAGO", "FORMA DE PAGO")
+INSTALLMENT_COLUMNS = ("PARCIALIDAD", "NUMERO PARCIALIDAD", "NÚMERO PARCIALIDAD")
+LAST_BALANCE_COLUMNS = ("SALDO ANTERIOR", "SALDO")
+PAYMENT_REFERENCE_COLUMNS = ("REFERENCIA", "REFERENCIA PAGO", "ID PAGO")
+
+DEFAULT_PAYMENT_FORM = "03"  # transferencia electrónica
+# Documentos relacionados por complemento; un pago con más facturas se parte en varios complementos
+MAX_DOCUMENTS_PER_COMPLEMENT = 100
+
+
+def _cell(row, columns):
+    for column in columns:
+        value = row.get(column)
+        if value not in (None, ""):
+            return str(value).strip()
+    return ""
+
+
+def _raw_cell(row, columns):
+    for column in columns:
+        value = row.get(column)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _decimal(value):
+    if value in (None, ""):
+        return None
+    try:
+        return Decimal(str(value).replace("$", "").replace(",", "").strip()).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+
+def _date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    for date_format in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            return datetime.datetime.strptime(str(value or "").strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _motive(value, default):
+    value = (value or default).split("-")[0].strip()  # acepta "02 - Comprobante emitido con errores..."
+    return value.zfill(2) if value.isdigit() else value
+
+
+def read_cancellation_sheet(uploaded_file, action):
+    """
+    Lee el Excel de cancelación masiva en una sola pasada. Regresa (referencias, payloads) con un elemento
+    por fila: las filas inválidas llevan "error" y las repetidas "duplicate_of" para reportarlas por fila.
+    """
+    references, payloads = [], []
+    first_row = {}
+    for number, row in iter_sheet_rows(uploaded_file):
+        uuid = _cell(row, UUID_COLUMNS).upper()
+        motive = _motive(_cell(row, MOTIVE_COLUMNS), DEFAULT_MOTIVES[action])
+        # El motivo 01 (con relación) exige el UUID que sustituye, venga de CM o de CMR; los demás no lo llevan
+        with_substitution = motive == SUBSTITUTION_MOTIVE
+        substitution = _cell(row, SUBSTITUTION_COLUMNS).upper() if with_substitution else ""
+        payload = {"row": number, "motive": motive, "substitution": substitution or None}
+
+        if not UUID_RE.match(uuid):
+            payload["error"] = f"UUID inválido ({uuid or 'vacío'})"
+        elif motive not in CANCELLATION_MOTIVES:
+            payload["error"] = f"Motivo de cancelación inválido ({motive})"
+        elif with_substitution and not UUID_RE.match(substitution):
+            payload["error"] = f"El motivo {motive} requiere el UUID que sustituye a la factura"
+        elif uuid in first_row:
+            payload["duplicate_of"] = first_row[uuid]
+        else:
+            first_row[uuid] = number
+
+        references.append(uuid or f"FILA {number}")
+        payloads.append(payload)
+    if not references:
+        raise Exception("El archivo no tiene filas para procesar")
+    return references, payloads
+
+
+def create_cancellation_job(uploaded_file, action, user=None):
+    """
+    Crea el trabajo de cancelación masiva (CM/CMR) y lo encola al confirmar la transacción.
+    """
+    from apps.facturapi.tasks import cancel_invoices_job
+
+    references, payloads = read_cancellation_sheet(uploaded_file, action)
+    job = create_job(CANCEL_JOB_KIND, references, user, payloads)
+    transaction.on_commit(lambda: cancel_invoices_job.delay(str(job.id)))
+    return job
+
+
+def _invoice_taxes(invoices):
+    """
+    Impuestos de cada factura relacionada {invoice_id: [tax_id]}: de sus conceptos locales en un query y,
+    para las importadas de FacturAPI (sin conceptos locales), de los impuestos de su respuesta guardada.
+    """
+    from apps.facturapi.models import FacturapiInvoiceItem, FacturapiTax
+
+    taxes = defaultdict(set)
+    pairs = FacturapiInvoiceItem.objects.filter(invoice__in=invoices).values_list("invoice_id", "product__taxes")
+    for invoice_id, tax_id in pairs.distinct():
+        if tax_id:
+            taxes[invoice_id].add(tax_id)
+
+    local_taxes = {
+        (tax.type, tax.rate.quantize(Decimal("0.0001")), tax.withholding): tax.pk
+        for tax in FacturapiTax.objects.all()
+    }
+    for invoice in invoices:
+        if invoice.pk in taxes:
+            continue
+        for item in (invoice.facturapi_response or {}).get("items") or []:
+            for tax in (item.get("product") or {}).get("taxes") or []:
+                key = (tax.get("type"), Decimal(str(tax.get("rate") or 0)).quantize(Decimal("0.0001")),
+                       bool(tax.get("withholding")))
+                if key in local_taxes:
+                    taxes[invoice.pk].add(local_taxes[key])
+    return {invoice_id: sorted(str(tax_id) for tax_id in tax_ids) for invoice_id, tax_ids in taxes.items()}
+
+
+def read_payment_sheet(uploaded_file):
+    """
+    Lee el Excel de complementos de pago (CP) y agrupa las filas por cliente y pago (fecha, forma de pago,
+    moneda y referencia). Todas las facturas relacionadas se resuelven en un solo query.
+    Regresa (referencias, payloads): un elemento por complemento y uno por cada fila inválida u omitida.
+    """
+    from apps.facturapi.models import FacturapiInvoice, FacturapiInvoicePayment
+
+    rows = []
+    for number, row in iter_sheet_rows(uploaded_file):
+        rows.append({
+            "row": number,
+            "uuid": _cell(row, UUID_COLUMNS).upper(),
+            "amount": _decimal(_raw_cell(row, AMOUNT_COLUMNS)),
+            "date": _date(_raw_cell(row, DATE_COLUMNS)),
+            "payment_form": _motive(_cell(row, PAYMENT_FORM_COLUMNS), DEFAULT_PAYMENT_FORM),
+            "installment": _decimal(_raw_cell(row, INSTALLMENT_COLUMNS)),
+            "last_balance": _decimal(_raw_cell(row, LAST_BALANCE_COLUMNS)),
+            "reference": _cell(row, PAYMENT_REFERENCE_COLUMNS),
+        })
+    if not rows:
+        raise Exception("El archivo no tiene filas para procesar")
+
+    uuids = {row["uuid"] for row in rows if UUID_RE.match(row["uuid"])}
+    invoices = {}
+    queryset = FacturapiInvoice.objects.filter(
+        uuid__in=list(uuids) + [uuid.lower() for uuid in uuids]
+    ).select_related("customer").order_by("created_at")
+    for invoice in queryset:
+        invoices[invoice.uuid.upper()] = invoice
+    taxes = _invoice_taxes(list(invoices.values()))
+
+    # Parcialidades ya timbradas y pagos ya registrados (para no duplicar al repetir el archivo), en un query
+    previous = FacturapiInvoicePayment.objects.filter(
+        uuid__in=[invoice.uuid for invoice in invoices.values()], invoice__status="valid",
+        invoice__facturapi_id__isnull=False,
+    )
+    installments = defaultdict(int)
+    registered = set()
+    for uuid, amount, payment_day, total in (previous.values_list("uuid", "amount", "payment_day")
+                                             .annotate(total=Count("id")).order_by()):
+        installments[uuid.upper()] += total
+        registered.add((uuid.upper(), amount, payment_day))
+
+    references, payloads = [], []
+    groups = defaultdict(list)
+    balances = {}
+    for row in sorted(rows, key=lambda r: (r["date"] or datetime.date.min, r["row"])):
+        invoice = invoices.get(row["uuid"])
+        error = None
+        if not UUID_RE.match(row["uuid"]):
+            error = f"UUID inválido ({row['uuid'] or 'vacío'})"
+        elif invoice is None:
+            error = "La factura relacionada no existe en el sistema"
+        elif invoice.status != "valid" or not invoice.facturapi_id:
+            error = "La factura relacionada no está vigente"
+        elif invoice.type != "I" or invoice.payment_form != "PPD":
+            error = "Solo las facturas de ingreso PPD llevan complemento de pago"
+        elif not row["amount"] or row["amount"] <= 0:
+            error = "Monto inválido"
+        elif row["date"] is None:
+            error = "Fecha de pago inválida"
+        if error:
+            references.append(row["uuid"] or f"FILA {row['row']}")
+            payloads.append({"row": row["row"], "error": error})
+            continue
+        if (row["uuid"], row["amount"], row["date"]) in registered:
+            references.append(row["uuid"])
+            payloads.append({"row": row["row"], "skip": "El pago ya tiene un complemento timbrado"})
+            continue
+
+        # Parcialidad y saldo anterior: los del archivo o, si no vienen, los que siguen a los pagos previos
+        last_balance = row["last_balance"] or balances.get(row["uuid"])
+        if last_balance is None:
+            if invoice.amount_due > 0:
+                last_balance = invoice.amount_due
+            elif not installments[row["uuid"]]:
+                last_balance = invoice.total  # primer pago de la factura
+            else:
+                references.append(row["uuid"])
+                payloads.append({"row": row["row"], "error": "Indica el saldo anterior de la factura en el archivo"})
+                continue
+        if row["amount"] > last_balance:
+            references.append(row["uuid"])
+            payloads.append({"row": row["row"], "error": f"El monto excede el saldo pendiente ({last_balance})"})
+            continue
+        balances[row["uuid"]] = last_balance - row["amount"]
+        installments[row["uuid"]] += 1
+        key = (invoice.customer_id, row["date"], row["payment_form"], invoice.currency, row["reference"])
+        groups[key].append({
+            "row": row["row"],
+            "uuid": invoice.uuid,
+            "invoice": str(invoice.pk),
+            "amount": str(row["amount"]),
+            "installment": int(row["installment"] or installments[row["uuid"]]),
+            "last_balance": str(last_balance),
+            "taxes": taxes.get(invoice.pk, []),
+        })
+
+    for (customer_id, date, payment_form, currency, reference), documents in groups.items():
+        rfc = invoices[documents[0]["uuid"].upper()].customer.rfc
+        for part in chunked(documents, MAX_DOCUMENTS_PER_COMPLEMENT):
+            references.append(f"{rfc} {date.isoformat()} ({len(part)} documentos)")
+            payloads.append({
+                "rows": part,
+                "customer": str(customer_id),
+                "date": date.isoformat(),
+                "payment_form": payment_form,
+                "currency": currency,
+                "reference": reference,
+            })
+    return references, payloads
+
+
+def create_payment_complement_job(uploaded_file, user=None):
+    """
+    Crea el trabajo de complementos de pago (CP) y lo encola al confirmar la transacción.
+    """
+    from apps.facturapi.tasks import payment_complements_job
+
+    references, payloads = read_payment_sheet(uploaded_file)
+    job = create_job(PAYMENT_JOB_KIND, references, user, payloads)
+    transaction.on_commit(lambda: payment_complements_job.delay(str(job.id)))
+    return job
@@ -190,4 +190,12 @@ class CancelIssue(models.TextChoices):
     M01 = '01', _('01 - Comprobante emitido con errores con relación')
     M02 = '02', _('02 - Comprobante emitido con errores sin relación')
     M03 = '03', _('03 - No se llevó a cabo la operación')
-    M04 = '04', _('04 - Operación nominativa relacionada en la factura global')
\ No newline at end of file
+    M04 = '04', _('04 - Operación nominativa relacionada en la factura global')
+
+
+class SatCatalog(models.TextChoices):
+    PRODUCTS = 'c_ClaveProdServ', _('Productos y servicios')
+    UNITS = 'c_ClaveUnidad', _('Unidades de medida')
+    PAYMENT_FORMS = 'c_FormaPago', _('Formas de pago')
+    CFDI_USES = 'c_UsoCFDI', _('Usos del CFDI')
+    TAX_REGIMES = 'c_RegimenFiscal', _('Regímenes fiscales')
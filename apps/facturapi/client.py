@@ -1,35 +1,125 @@
 # apps/facturapi/client.py
-import os
-import requests
+import random
+import threading
 from typing import Dict, Any
-from django.conf import settings
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from ikigai2025.settings import FACTURAPI_API_KEY
-from .mappers import (
-    client_to_facturapi_payload,
-    product_to_facturapi_payload,
-    invoice_to_facturapi_payload,
-)
 
 
 FACTURAPI_BASE_URL = "https://www.facturapi.io/v2"
-DEFAULT_TIMEOUT = 25
+CONNECT_TIMEOUT = 5  # segundos para abrir la conexión
+READ_TIMEOUT = 30  # segundos esperando la respuesta (timbrar puede tardar)
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+POOL_MAXSIZE = 20  # conexiones abiertas por proceso (hilos de los trabajos masivos + vistas)
+
+# Respuestas de FacturAPI que vale la pena reintentar (límite de peticiones o falla temporal del servicio)
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+# Solo métodos idempotentes: un POST que ya llegó a FacturAPI podría timbrar dos veces
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class FacturapiError(Exception):
+    """
+    Respuesta de error de FacturAPI. Conserva el status HTTP para decidir si se reintenta.
+    """
+
+    def __init__(self, content, status_code=None):
+        super().__init__(content)
+        self.status_code = status_code
+
+
+def is_transient_error(e):
+    """
+    True si el error es temporal (red, timeout, 429 o 5xx) y la llamada puede repetirse.
+    """
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(e, FacturapiError) and e.status_code in TRANSIENT_STATUS_CODES
+
+
+class JitteredRetry(Retry):
+    """
+    Retry de urllib3 con "full jitter": espera un tiempo aleatorio entre 0 y el backoff exponencial,
+    para que varios hilos que fallan al mismo tiempo no reintenten juntos.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
 
-def _get_key():
+def _retry_policy():
+    return JitteredRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,  # la conexión nunca se abrió, es seguro reintentar cualquier método
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=TRANSIENT_STATUS_CODES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,  # al agotar los reintentos se regresa la última respuesta
+    )
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Sesión compartida por todo el proceso (pool de conexiones keep-alive).
+    Se crea en el primer uso y no al importar, para que cada worker de Celery tenga la suya después del fork.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=_retry_policy())
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_api_key():
     key = FACTURAPI_API_KEY
     if not key:
-        raise RuntimeError("Llave de FacturAPI no configurada (FACTURAPI_TEST_KEY / FACTURAPI_LIVE_KEY)")
+        print("FACTURAPI_KEY not set in env")
+        raise ValueError("FACTURAPI_KEY not set in env")
     return key
 
-def _headers(extra=None):
+
+def get_headers(extra=None):
     h = {
-        "Authorization": f"Bearer {_get_key()}",
+        "Authorization": f"Bearer {get_api_key()}",
         "Content-Type": "application/json",
     }
     if extra:
         h.update(extra)
     return h
 
+
+def request(method, path, *, params=None, json=None, data=None, headers=None, stream=False,
+            timeout=DEFAULT_TIMEOUT):
+    """
+    Hace una llamada a FacturAPI con la sesión compartida. `path` es relativo a FACTURAPI_BASE_URL
+    (ej. "/invoices"). Los reintentos los resuelve el adaptador según el método.
+    """
+    url = path if path.startswith("http") else f"{FACTURAPI_BASE_URL}{path}"
+    return get_session().request(
+        method, url, params=params, json=json, data=data, headers=get_headers(headers), stream=stream,
+        timeout=timeout,
+    )
+
+
 def _log_http_error(what: str, e: requests.exceptions.RequestException):
     msg = f"Error al {what}: {e}"
     if getattr(e, "response", None) is not None:
@@ -40,67 +130,45 @@ def _log_http_error(what: str, e: requests.exceptions.RequestException):
     else:
         print(msg)
 
-# ----------------- Customers -----------------
 
-def create_customer(client_model) -> Dict[str, Any]:
-    url = f"{FACTURAPI_BASE_URL}/customers"
-    payload = client_to_facturapi_payload(client_model)
+def _json_or_raise(what, method, path, **kwargs):
     try:
-        r = requests.post(url, json=payload, headers=_headers(), timeout=DEFAULT_TIMEOUT)
+        r = request(method, path, **kwargs)
         r.raise_for_status()
         return r.json()
     except requests.exceptions.RequestException as e:
-        _log_http_error("crear cliente", e)
+        _log_http_error(what, e)
         raise
 
+# ----------------- Customers -----------------
+
+def create_customer(client_model) -> Dict[str, Any]:
+    from .mappers import client_to_facturapi_payload
+    return _json_or_raise("crear cliente", "POST", "/customers", json=client_to_facturapi_payload(client_model))
+
 def update_customer(customer_id: str, client_model) -> Dict[str, Any]:
-    url = f"{FACTURAPI_BASE_URL}/customers/{customer_id}"
-    payload = client_to_facturapi_payload(client_model)
-    try:
-        r = requests.put(url, json=payload, headers=_headers(), timeout=DEFAULT_TIMEOUT)
-        r.raise_for_status()
-        return r.json()
-    except requests.exceptions.RequestException as e:
-        _log_http_error("actualizar cliente", e)
-        raise
+    from .mappers import client_to_facturapi_payload
+    return _json_or_raise("actualizar cliente", "PUT", f"/customers/{customer_id}",
+                          json=client_to_facturapi_payload(client_model))
 
 # ----------------- Products -----------------
 
 def create_product(product_model) -> Dict[str, Any]:
-    url = f"{FACTURAPI_BASE_URL}/products"
-    payload = product_to_facturapi_payload(product_model)
-    try:
-        r = requests.post(url, json=payload, headers=_headers(), timeout=DEFAULT_TIMEOUT)
-        r.raise_for_status()
-        return r.json()
-    except requests.exceptions.RequestException as e:
-        _log_http_error("crear producto", e)
-        raise
+    from .mappers import product_to_facturapi_payload
+    return _json_or_raise("crear producto", "POST", "/products", json=product_to_facturapi_payload(product_model))
 
 def update_product(product_id: str, product_model) -> Dict[str, Any]:
-    url = f"{FACTURAPI_BASE_URL}/products/{product_id}"
-    payload = product_to_facturapi_payload(product_model)
-    try:
-        r = requests.put(url, json=payload, headers=_headers(), timeout=DEFAULT_TIMEOUT)
-        r.raise_for_status()
-        return r.json()
-    except requests.exceptions.RequestException as e:
-        _log_http_error("actualizar producto", e)
-        raise
+    from .mappers import product_to_facturapi_payload
+    return _json_or_raise("actualizar producto", "PUT", f"/products/{product_id}",
+                          json=product_to_facturapi_payload(product_model))
 
 # ----------------- Invoices -----------------
 
 def create_invoice(invoice_model, *, payment_method: str = None, force_inline_customer: bool = False) -> Dict[str, Any]:
-    url = f"{FACTURAPI_BASE_URL}/invoices"
+    from .mappers import invoice_to_facturapi_payload
     payload = invoice_to_facturapi_payload(
         invoice_model,
         payment_method=payment_method,
         force_inline_customer=force_inline_customer,
     )
-    try:
-        r = requests.post(url, json=payload, headers=_headers(), timeout=DEFAULT_TIMEOUT)
-        r.raise_for_status()
-        return r.json()
-    except requests.exceptions.RequestException as e:
-        _log_http_error("crear factura", e)
-        raise
+    return _json_or_raise("crear factura", "POST", "/invoices", json=payload)
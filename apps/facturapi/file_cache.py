@@ -0,0 +1,291 @@
+# apps/facturapi/file_cache.py
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+
+from apps.facturapi.client import FacturapiError, request
+
+CHUNK_SIZE = 64 * 1024
+# Un archivo en caché nunca cambia de contenido (el nombre lleva su sha256), así que el navegador puede guardarlo
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+EVICTION_TARGET = 0.9  # al rebasar el límite se borra hasta quedar en el 90%
+# Cada cuántas escrituras se vuelve a medir la carpeta aunque no se rebase el límite (otros procesos también escriben)
+EVICTION_RESCAN_WRITES = 500
+
+# Tamaño de la caché que lleva este proceso: se mide con os.walk la primera vez y después se suma cada escritura,
+# así que el recorrido completo solo ocurre al rebasar el límite o cada EVICTION_RESCAN_WRITES escrituras
+_size_lock = threading.Lock()
+_scan_lock = threading.Lock()
+_cache_size = None
+_writes_since_scan = 0
+
+# formato -> (ruta en FacturAPI, content type, extensión)
+INVOICE_FILE_FORMATS = {
+    "pdf": ("/pdf", "application/pdf", "pdf"),
+    "xml": ("/xml", "application/xml", "xml"),
+    "zip": ("/zip", "application/zip", "zip"),
+    "acuse": ("/cancellation_receipt/pdf", "application/pdf", "pdf"),
+}
+
+
+def _cache_root():
+    return settings.FACTURAPI_FILE_CACHE_DIR
+
+
+def _invoice_dir(facturapi_id):
+    return os.path.join(_cache_root(), os.path.basename(str(facturapi_id)))
+
+
+def cached_file(facturapi_id, file_format):
+    """
+    Busca el archivo en caché. Cada factura tiene su carpeta con archivos <formato>-<sha256>.<ext>;
+    regresa (ruta, sha256) o (None, None).
+    """
+    prefix = f"{file_format}-"
+    try:
+        names = os.listdir(_invoice_dir(facturapi_id))
+    except FileNotFoundError:
+        return None, None
+    for name in names:
+        if name.startswith(prefix) and not name.endswith(".part"):
+            return os.path.join(_invoice_dir(facturapi_id), name), name[len(prefix):].split(".")[0]
+    return None, None
+
+
+def _touch(path):
+    # La antigüedad para el desalojo se mide con mtime (atime no es confiable con noatime)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _open_upstream(facturapi_id, file_format):
+    path, content_type, _ = INVOICE_FILE_FORMATS[file_format]
+    resp = request("GET", f"/invoices/{facturapi_id}{path}", headers={"Accept": content_type}, stream=True)
+    if resp.status_code != 200:
+        content = resp.content
+        resp.close()
+        raise FacturapiError(content, status_code=resp.status_code)
+    return resp
+
+
+def _store_chunks(facturapi_id, file_format, chunks):
+    """
+    Regresa los chunks tal como llegan y al mismo tiempo los escribe a un archivo temporal; al terminar
+    lo renombra a su nombre definitivo. Si la descarga se interrumpe el temporal se borra.
+    """
+    directory = _invoice_dir(facturapi_id)
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{file_format}-", suffix=".part")
+    completed = False
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                tmp.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                yield chunk
+        extension = INVOICE_FILE_FORMATS[file_format][2]
+        os.replace(tmp_path, os.path.join(directory, f"{file_format}-{digest.hexdigest()}.{extension}"))
+        completed = True
+        _record_write(size)
+    finally:
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def fetch_invoice_file(facturapi_id, file_format):
+    """
+    Ruta local del archivo; si no está en caché se descarga (en streaming, directo a disco).
+    """
+    path, _ = cached_file(facturapi_id, file_format)
+    if path:
+        _touch(path)
+        return path
+    upstream = _open_upstream(facturapi_id, file_format)
+    try:
+        for _ in _store_chunks(facturapi_id, file_format, upstream.iter_content(CHUNK_SIZE)):
+            pass
+    finally:
+        upstream.close()
+    return cached_file(facturapi_id, file_format)[0]
+
+
+def invoice_file_response(request, facturapi_id, file_format, filename, cacheable=True):
+    """
+    Respuesta de descarga de un archivo de factura.
+    - En caché: FileResponse con ETag (sha256) y Cache-Control; si el navegador ya lo tiene responde 304.
+    - Sin caché: se retransmite desde FacturAPI con StreamingHttpResponse mientras se guarda en la caché
+      (solo si `cacheable`, es decir, si el archivo ya no puede cambiar).
+    """
+    content_type = INVOICE_FILE_FORMATS[file_format][1]
+    path, digest = cached_file(facturapi_id, file_format) if cacheable else (None, None)
+    if path:
+        etag = f'"{digest}"'
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponseNotModified()
+        else:
+            _touch(path)
+            response = FileResponse(open(path, "rb"), as_attachment=True, filename=filename,
+                                    content_type=content_type)
+        response["ETag"] = etag
+        response["Cache-Control"] = CACHE_CONTROL
+        return response
+
+    upstream = _open_upstream(facturapi_id, file_format)
+    chunks = upstream.iter_content(CHUNK_SIZE)
+    if cacheable:
+        chunks = _store_chunks(facturapi_id, file_format, chunks)
+
+    def stream():
+        try:
+            yield from chunks
+        finally:
+            upstream.close()
+
+    response = StreamingHttpResponse(stream(), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _read_chunks(handle):
+    with handle:
+        while chunk := handle.read(CHUNK_SIZE):
+            yield chunk
+
+
+def _open_invoice_file(facturapi_id, file_format):
+    # Se abre en el hilo de descarga: aunque el desalojo borre el archivo, el descriptor abierto sigue siendo válido
+    return open(fetch_invoice_file(facturapi_id, file_format), "rb")
+
+
+def invoice_archive_entries(invoices, formats=("pdf", "xml"), max_workers=None):
+    """
+    Entradas (nombre, chunks) para stream_zip_response con los archivos de cada factura.
+    `invoices` es un iterable de dicts con facturapi_id, uuid, series y folio_number (se consume en orden).
+    Las descargas corren en un pool acotado y solo hay `max_workers * 2` archivos en vuelo, así que la memoria
+    no crece con el número de facturas; los que ya están en la caché local no llaman a FacturAPI.
+    Las facturas que fallan se listan al final en ERRORES.txt.
+    """
+    max_workers = max(1, max_workers or settings.FACTURAPI_MAX_CONCURRENCY)
+    errors = []
+    pending = deque()
+
+    def entry(invoice, file_format, future):
+        extension = INVOICE_FILE_FORMATS[file_format][2]
+        suffix = "_acuse" if file_format == "acuse" else ""
+        name = f"{invoice['series'] or ''}-{invoice['folio_number'] or ''}_{invoice['uuid']}{suffix}.{extension}"
+        try:
+            handle = future.result()
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            return None
+        return name, _read_chunks(handle)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for invoice in invoices:
+                for file_format in formats:
+                    future = executor.submit(_open_invoice_file, invoice["facturapi_id"], file_format)
+                    pending.append((invoice, file_format, future))
+                while len(pending) >= max_workers * 2:
+                    result = entry(*pending.popleft())
+                    if result:
+                        yield result
+            while pending:
+                result = entry(*pending.popleft())
+                if result:
+                    yield result
+        finally:
+            # Si el cliente corta la descarga se cierran los archivos que ya estaban abiertos
+            for _, _, future in pending:
+                if not future.cancel() and future.exception() is None:
+                    future.result().close()
+
+    if errors:
+        yield "ERRORES.txt", ["\n".join(errors).encode("utf-8")]
+
+
+def invalidate_invoice_files(facturapi_id):
+    """
+    Borra los archivos en caché de una factura (por ejemplo, al cancelarla cambia su PDF).
+    """
+    if facturapi_id:
+        shutil.rmtree(_invoice_dir(facturapi_id), ignore_errors=True)
+
+
+def _record_write(size):
+    """
+    Suma el archivo recién guardado al tamaño estimado y desaloja solo si hace falta medir o se rebasó el límite.
+    """
+    global _cache_size, _writes_since_scan
+    with _size_lock:
+        _writes_since_scan += 1
+        if _cache_size is not None:
+            _cache_size += size
+        needs_scan = (_cache_size is None or _cache_size > settings.FACTURAPI_FILE_CACHE_MAX_BYTES
+                      or _writes_since_scan >= EVICTION_RESCAN_WRITES)
+    # Si otro hilo ya está recorriendo la carpeta, su medición incluye este archivo
+    if needs_scan and _scan_lock.acquire(blocking=False):
+        try:
+            evict_file_cache()
+        finally:
+            _scan_lock.release()
+
+
+def evict_file_cache(max_bytes=None):
+    """
+    Mantiene la caché bajo FACTURAPI_FILE_CACHE_MAX_BYTES borrando primero los archivos usados hace más tiempo.
+    Recorre toda la carpeta y reinicia el tamaño estimado del proceso. Regresa cuántos archivos se borraron.
+    """
+    global _cache_size, _writes_since_scan
+    max_bytes = settings.FACTURAPI_FILE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    total = 0
+    for root, _, names in os.walk(_cache_root()):
+        for name in names:
+            if name.endswith(".part"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        with _size_lock:
+            _cache_size, _writes_since_scan = total, 0
+        return 0
+
+    removed = 0
+    target = max_bytes * EVICTION_TARGET
+    for _, size, path in sorted(files):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+        try:
+            os.rmdir(os.path.dirname(path))  # solo se borra si la carpeta de la factura quedó vacía
+        except OSError:
+            pass
+    with _size_lock:
+        _cache_size, _writes_since_scan = total, 0
+    return removed
@@ -1,165 +1,171 @@
-import requests
-import uuid
-from datetime import datetime
-from django.core.management.base import BaseCommand
-from django.utils.timezone import make_aware
-from django.conf import settings
-
-from apps.facturapi.models import FacturapiInvoice
+import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from apps.facturapi.client import CONNECT_TIMEOUT, request as facturapi_request
+from apps.facturapi.models import FacturapiInvoice, FacturapiSyncState
+from apps.facturapi.services import SYNCED_INVOICE_FIELDS, facturapi_invoice_fields, parse_facturapi_datetime
 from core.operations_panel.models import Client
 
-FACTURAPI_BASE_URL = "https://www.facturapi.io/v2"
-API_KEY = settings.FACTURAPI_API_KEY  # Define esto en tu settings.py
+SYNC_NAME = "import_invoices"
+PAGE_LIMIT = 100  # Máximo permitido por FacturAPI
 
 
 class Command(BaseCommand):
-    help = "DESCARGA TODAS LAS FACTURAS DE FACTURAPI Y LAS GUARDA EN FacturapiInvoice CON PAGINACIÓN."
+    help = ("DESCARGA LAS FACTURAS DE FACTURAPI EN PARALELO Y LAS GUARDA EN FacturapiInvoice (UPSERT POR PÁGINA). "
+            "POR DEFECTO SOLO TRAE LAS POSTERIORES A LA ÚLTIMA IMPORTACIÓN.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Páginas descargadas en paralelo')
+        parser.add_argument('--full', action='store_true', help='Ignora la marca de agua y descarga todo')
+        parser.add_argument('--since', type=str, default=None,
+                            help='Fecha (AAAA-MM-DD) o fecha y hora ISO desde la cual importar (date[gt])')
+
+    @staticmethod
+    def parse_since(value):
+        """
+        Acepta fecha o fecha y hora ISO; una fecha sola es la medianoche local. Sin zona se usa la local.
+        """
+        value = value.strip()
+        try:
+            since = parse_datetime(value)
+            if since is None:
+                day = parse_date(value)
+                since = datetime.datetime.combine(day, datetime.time.min) if day else None
+        except ValueError:
+            since = None
+        if since is None:
+            raise CommandError(f"❌ --since NO ES UNA FECHA VÁLIDA: {value}")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
 
     def handle(self, *args, **options):
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json",
-        }
-
-        page = 1
-        limit = 100  # Máximo permitido por FacturAPI
-        total_processed = 0
-        total_created = 0
-
-        while True:
-            self.stdout.write(self.style.NOTICE(f"📦 DESCARGANDO PÁGINA {page}..."))
-            response = requests.get(
-                f"{FACTURAPI_BASE_URL}/invoices",
-                headers=headers,
-                params={"page": page, "limit": limit},
-                timeout=60,
-            )
-
-            if response.status_code != 200:
-                self.stdout.write(self.style.ERROR(f"❌ ERROR HTTP {response.status_code}: {response.text}"))
-                break
-
-            data = response.json()
-            invoices = data.get("data", [])
-            if not invoices:
-                self.stdout.write(self.style.WARNING("⚠ NO SE ENCONTRARON MÁS FACTURAS."))
-                break
-
-            for inv in invoices:
-                total_processed += 1
+        state, _ = FacturapiSyncState.objects.get_or_create(name=SYNC_NAME)
+        window_end = timezone.now()
+
+        # La ventana se cierra en window_end para que las facturas nuevas no recorran las páginas mientras se leen
+        filters = {"date[lte]": window_end.isoformat()}
+        since = state.high_water_mark
+        if options['since']:
+            since = self.parse_since(options['since'])
+        elif options['full']:
+            since = None
+        if since:
+            filters["date[gt]"] = since.isoformat()
+            self.stdout.write(self.style.NOTICE(f"🔁 IMPORTACIÓN INCREMENTAL DESDE {since.isoformat()}"))
+        else:
+            self.stdout.write(self.style.NOTICE("📦 IMPORTACIÓN COMPLETA"))
+
+        # Un solo query para resolver todos los clientes por RFC
+        clients = {}
+        for client_id, rfc in Client.objects.exclude(rfc__isnull=True).exclude(rfc="").values_list("id", "rfc"):
+            clients.setdefault(rfc.strip().upper(), client_id)
+
+        stats = Counter()
+        failed_pages = []
+        latest = [since]
+
+        first = self.fetch_page(1, filters)
+        total_pages = first.get("total_pages") or 1
+        self.stdout.write(self.style.NOTICE(f"📄 {total_pages} PÁGINAS, {first.get('total_results', '?')} FACTURAS"))
+        self.upsert(first.get("data", []), clients, stats, latest)
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = {executor.submit(self.fetch_page, page, filters): page for page in range(2, total_pages + 1)}
+            for future in as_completed(futures):
+                page = futures[future]
                 try:
-                    facturapi_id = inv.get("id")
-                    amount_due = inv.get("amount_due", 0)
-                    status = inv.get("status", "valid")
-                    is_live = inv.get("livemode", False)
-                    uuid_folio = inv.get("uuid")
-                    series = inv.get("series")
-                    folio_number = inv.get("folio_number")
-                    total_amount = inv.get("total", 0)
-
-                    # Fecha de timbrado (tomamos primero la del SAT si existe)
-                    stamp_dt = None
-                    stamp_info = inv.get("stamp") or {}
-                    stamp_date_str = stamp_info.get("date") or inv.get("date") or inv.get("created_at")
-
-                    if stamp_date_str:
-                        try:
-                            # Normalizamos formato
-                            stamp_date_str = stamp_date_str.replace("Z", "+00:00")
-                            # Intentamos parsear distintos formatos válidos
-                            for fmt in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S"):
-                                try:
-                                    parsed_date = datetime.strptime(stamp_date_str, fmt)
-                                    stamp_dt = make_aware(parsed_date) if parsed_date.tzinfo is None else parsed_date
-                                    break
-                                except ValueError:
-                                    continue
-                        except Exception as e:
-                            self.stdout.write(
-                                self.style.WARNING(f"⚠ No se pudo convertir fecha de timbrado: {stamp_date_str} ({e})"))
-
-                    verification_url = inv.get("verification_url")
-                    stamp_info = inv.get("stamp", {}) or {}
-
-                    sat_cert_number = stamp_info.get("sat_cert_number")
-                    sat_signature = stamp_info.get("sat_signature")
-                    signature = stamp_info.get("signature")
-
-                    # Cliente (por id de FacturAPI)
-                    customer_data = inv.get("customer") or {}
-                    customer_rfc = customer_data.get("tax_id")
-                    client = None
-
-                    # Puedes cambiar este filtro si tus clientes tienen guardado facturapi_id
-                    if customer_rfc:
-                        client = Client.objects.filter(rfc=customer_rfc).first()
-                        if not client:
-                            self.stdout.write(
-                                self.style.WARNING(
-                                    f"⚠ CLIENTE FACTURAPI ID {customer_rfc} NO ENCONTRADO PARA FACTURA {facturapi_id}"
-                                )
-                            )
-
-                    cancel_data = inv.get("cancellation") or {}
-                    cancellation_status = cancel_data.get("status")
-                    canceled_at = cancel_data.get("last_checked")
-                    if canceled_at:
-                        try:
-                            canceled_at = make_aware(datetime.fromisoformat(canceled_at.replace("Z", "+00:00")))
-                        except Exception:
-                            canceled_at = None
-
-                    obj, created = FacturapiInvoice.objects.get_or_create(
-                        facturapi_id=facturapi_id,
-                        defaults={
-                            "customer": client,
-                            "type": inv.get("type"),
-                            "use": inv.get("use"),
-                            "amount_due": amount_due,
-                            "payment_method": inv.get("payment_form"),
-                            "payment_form": inv.get("payment_method"),
-                            "currency": inv.get("currency", "MXN"),
-                            "pdf_custom_section": inv.get("pdf_custom_section"),
-                            "relation_type": inv.get("relation_type"),
-                            "related_uuids": inv.get("related_uuids"),
-                            "idempotency_key": inv.get("idempotency_key"),
-                            "status": status,
-                            "is_ready_to_stamp": inv.get("is_ready_to_stamp", True),
-                            "uuid": uuid_folio,
-                            "series": series,
-                            "folio_number": folio_number,
-                            "total": total_amount,
-                            "stamp_date": stamp_dt,
-                            "sat_cert_number": sat_cert_number,
-                            "verification_url": verification_url,
-                            "sat_signature": sat_signature,
-                            "signature": signature,
-                            "cancellation_status": cancellation_status,
-                            "related_documents": inv.get("related_documents"),
-                            "target_invoice_ids": inv.get("target_invoice_ids"),
-                            "received_payment_ids": inv.get("received_payment_ids"),
-                            "complements": inv.get("complements"),
-                            "facturapi_response": inv,
-                            "is_live": is_live,
-                            "canceled_at": canceled_at,
-                        },
-                    )
-                    print(f"FacturapiInvoice {facturapi_id} created: {created} | Total created: {total_created} | Total processed: {total_processed}")
-                    if created:
-                        total_created += 1
-
-                    if total_processed % 100 == 0:
-                        self.stdout.write(
-                            self.style.NOTICE(f"➡ {total_processed} facturas procesadas, {total_created} creadas...")
-                        )
-
+                    data = future.result()
                 except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(f"❌ ERROR EN FACTURA {inv.get('id')} ({type(e).__name__}): {e}")
-                    )
-
-            page += 1  # Avanzar a la siguiente página
+                    failed_pages.append(page)
+                    self.stdout.write(self.style.ERROR(f"❌ ERROR EN PÁGINA {page} ({type(e).__name__}): {e}"))
+                    continue
+                # Las escrituras se hacen en este hilo; los hilos del pool solo descargan
+                self.upsert(data.get("data", []), clients, stats, latest)
+                stats["pages"] += 1
+                if stats["pages"] % 10 == 0:
+                    self.stdout.write(self.style.NOTICE(
+                        f"➡ {stats['processed']} facturas procesadas, {stats['created']} creadas..."
+                    ))
+
+        state.last_run_at = window_end
+        if not failed_pages and not stats["without_client"] and latest[0]:
+            # Solo se avanza la marca si no faltó ninguna página ni se saltó ninguna factura: lo que quede atrás
+            # de la marca ya no se vuelve a pedir (p. ej. cuando después se registra el cliente)
+            state.high_water_mark = latest[0]
+        state.save()
+
+        if stats["without_client"]:
+            self.stdout.write(self.style.WARNING(
+                f"⚠ {stats['without_client']} FACTURAS SIN CLIENTE REGISTRADO. LA MARCA DE AGUA NO SE ACTUALIZÓ."
+            ))
+        if failed_pages:
+            self.stdout.write(self.style.WARNING(
+                f"⚠ PÁGINAS CON ERROR: {sorted(failed_pages)}. LA MARCA DE AGUA NO SE ACTUALIZÓ."
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ IMPORTACIÓN FINALIZADA: {stats['created']} CREADAS, {stats['updated']} ACTUALIZADAS, "
+            f"{stats['processed']} PROCESADAS."
+        ))
+
+    @staticmethod
+    def fetch_page(page, filters):
+        response = facturapi_request(
+            "GET",
+            "/invoices",
+            params={"page": page, "limit": PAGE_LIMIT, **filters},
+            timeout=(CONNECT_TIMEOUT, 60),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def upsert(self, invoices, clients, stats, latest):
+        """
+        Inserta o actualiza una página completa con un solo INSERT ... ON CONFLICT (facturapi_id).
+        """
+        rows = {}
+        for inv in invoices:
+            stats["processed"] += 1
+            facturapi_id = inv.get("id")
+            if not facturapi_id:
+                continue
+            customer_id = clients.get(((inv.get("customer") or {}).get("tax_id") or "").strip().upper())
+            if not customer_id:
+                stats["without_client"] += 1
+                continue
+
+            issued_at = parse_facturapi_datetime(inv.get("date"))
+            if issued_at and (latest[0] is None or issued_at > latest[0]):
+                latest[0] = issued_at
+
+            rows[facturapi_id] = FacturapiInvoice(
+                facturapi_id=facturapi_id,
+                customer_id=customer_id,
+                type=inv.get("type") or "I",
+                use=inv.get("use"),
+                payment_method=inv.get("payment_form"),
+                payment_form=inv.get("payment_method"),
+                currency=inv.get("currency") or "MXN",
+                pdf_custom_section=inv.get("pdf_custom_section"),
+                idempotency_key=inv.get("idempotency_key"),
+                **facturapi_invoice_fields(inv),
+            )
+        if not rows:
+            return
 
-        self.stdout.write(
-            self.style.SUCCESS(f"✅ IMPORTACIÓN FINALIZADA: {total_created}/{total_processed} FACTURAS CREADAS.")
+        existing = set(
+            FacturapiInvoice.objects.filter(facturapi_id__in=rows.keys()).values_list("facturapi_id", flat=True)
+        )
+        FacturapiInvoice.objects.bulk_create(
+            rows.values(),
+            update_conflicts=True,
+            unique_fields=["facturapi_id"],
+            update_fields=SYNCED_INVOICE_FIELDS,
         )
+        stats["updated"] += len(existing)
+        stats["created"] += len(rows) - len(existing)
@@ -0,0 +1,168 @@
+import csv
+import datetime
+import itertools
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.facturapi.choices import SatCatalog
+from apps.facturapi.models import SatCatalogEntry
+from core.system.services import chunked
+
+BATCH_SIZE = 2000
+HEADER_SCAN_ROWS = 15  # el archivo del SAT trae varias filas de títulos antes de los encabezados
+
+# catálogo -> columna con la descripción que se muestra (en unidades la "Descripción" es un texto largo)
+DESCRIPTION_COLUMNS = {
+    SatCatalog.PRODUCTS: "descripcion",
+    SatCatalog.UNITS: "nombre",
+    SatCatalog.PAYMENT_FORMS: "descripcion",
+    SatCatalog.CFDI_USES: "descripcion",
+    SatCatalog.TAX_REGIMES: "descripcion",
+}
+
+
+def _header(value):
+    return SatCatalogEntry.normalize(value).replace(" ", "")
+
+
+def _end_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    for date_format in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(str(value or "").strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+class Command(BaseCommand):
+    help = ("CARGA LOS CATÁLOGOS DEL SAT (c_ClaveProdServ, c_ClaveUnidad, c_FormaPago, c_UsoCFDI, c_RegimenFiscal) "
+            "DESDE ARCHIVOS LOCALES A SatCatalogEntry. ACEPTA EL catCFDI DEL SAT EN XLSX (UNA HOJA POR CATÁLOGO) "
+            "O UN CSV POR CATÁLOGO CON EL NOMBRE DEL CATÁLOGO EN EL NOMBRE DEL ARCHIVO.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Archivos .xlsx o .csv')
+        parser.add_argument('--catalog', choices=SatCatalog.values, default=None,
+                            help='Catálogo del CSV si no se puede deducir del nombre del archivo')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Codificación de los CSV (el SAT usa latin-1)')
+
+    def handle(self, *args, **options):
+        started, totals, columns = {}, {}, {}
+        for path in options['files']:
+            if not os.path.exists(path):
+                raise CommandError(f"❌ NO EXISTE EL ARCHIVO {path}")
+            if path.lower().endswith(".xlsx"):
+                sources = self.xlsx_sheets(path)
+            elif path.lower().endswith(".csv"):
+                sources = self.csv_file(path, options['catalog'], options['encoding'])
+            else:
+                raise CommandError(f"❌ FORMATO NO SOPORTADO: {path} (convierte el .xls del SAT a .xlsx)")
+            for catalog, rows in sources:
+                # Un catálogo puede venir en varias hojas o archivos: la fecha de corte es la de su primera parte
+                started.setdefault(catalog, timezone.now())
+                totals[catalog] = totals.get(catalog, 0) + self.load(catalog, self.catalog_rows(catalog, rows, columns))
+        loaded = sum(totals.values())
+        if not loaded:
+            raise CommandError("❌ NO SE ENCONTRÓ NINGÚN CATÁLOGO EN LOS ARCHIVOS")
+        for catalog, total in totals.items():
+            if total:
+                self.remove_stale(catalog, total, started[catalog])
+        self.stdout.write(self.style.SUCCESS(f"✅ {loaded} CLAVES CARGADAS"))
+
+    @staticmethod
+    def xlsx_sheets(path):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                # El SAT parte c_ClaveProdServ en varias hojas (c_ClaveProdServ, c_ClaveProdServ_Parte_2, ...)
+                catalog = next((value for value in SatCatalog.values if sheet.title.startswith(value)), None)
+                if catalog:
+                    yield catalog, sheet.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def csv_file(path, catalog, encoding):
+        name = os.path.basename(path)
+        catalog = catalog or next((value for value in SatCatalog.values if value.lower() in name.lower()), None)
+        if catalog is None:
+            raise CommandError(f"❌ NO SE PUDO DEDUCIR EL CATÁLOGO DE {name}; USA --catalog")
+        with open(path, newline="", encoding=encoding) as handle:
+            yield catalog, csv.reader(handle)
+
+    def catalog_rows(self, catalog, rows, columns):
+        """
+        Encuentra la fila de encabezados y regresa (clave, descripción) de las claves vigentes.
+        `columns` guarda las columnas de cada catálogo: las hojas de continuación (c_ClaveProdServ_Parte_2, ...)
+        pueden no repetir el encabezado y se leen con las columnas de la parte anterior.
+        """
+        rows = iter(rows)
+        scanned = []
+        for values in rows:
+            headers = [_header(value) for value in values]
+            if _header(catalog) in headers:
+                key_index = headers.index(_header(catalog))
+                description_index = headers.index(DESCRIPTION_COLUMNS[catalog]) \
+                    if DESCRIPTION_COLUMNS[catalog] in headers else key_index + 1
+                end_index = next((i for i, header in enumerate(headers) if header.startswith("fechafin")), None)
+                columns[catalog] = (key_index, description_index, end_index)
+                break
+            scanned.append(values)
+            if len(scanned) > HEADER_SCAN_ROWS:
+                if catalog not in columns:
+                    raise CommandError(f"❌ NO SE ENCONTRÓ EL ENCABEZADO {catalog}")
+                rows = itertools.chain(scanned, rows)
+                break
+        else:
+            if catalog not in columns:
+                return
+            rows = iter(scanned)
+
+        key_index, description_index, end_index = columns[catalog]
+        for values in rows:
+            key = str(values[key_index] or "").strip() if len(values) > key_index else ""
+            if not key:
+                continue
+            if end_index is not None and len(values) > end_index:
+                end_date = _end_date(values[end_index])
+                if end_date and end_date < timezone.localdate():
+                    continue  # clave fuera de vigencia
+            description = str(values[description_index] or "").strip() if len(values) > description_index else ""
+            yield key, description
+
+    @staticmethod
+    def load(catalog, rows):
+        """
+        Inserta o actualiza por lotes las (clave, descripción) de una hoja o archivo; regresa cuántas se cargaron.
+        """
+        total = 0
+        entries = (
+            SatCatalogEntry(
+                catalog=catalog, key=key, description=description,
+                search_text=SatCatalogEntry.normalize(f"{key} {description}"),
+            )
+            for key, description in rows
+        )
+        for batch in chunked(entries, BATCH_SIZE):
+            SatCatalogEntry.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["catalog", "key"],
+                update_fields=["description", "search_text", "updated_at"],
+            )
+            total += len(batch)
+        return total
+
+    def remove_stale(self, catalog, total, started):
+        """
+        Borra las claves que no se tocaron desde `started` (ya no vienen en ninguna parte del catálogo).
+        """
+        removed, _ = SatCatalogEntry.objects.filter(catalog=catalog, updated_at__lt=started).delete()
+        self.stdout.write(self.style.NOTICE(f"📚 {catalog}: {total} CLAVES, {removed} BORRADAS"))
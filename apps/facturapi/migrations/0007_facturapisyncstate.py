@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:00
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturapi', '0006_facturapiinvoice_amount_due'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacturapiSyncState',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Sincronización')),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True, verbose_name='Última fecha importada')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Última ejecución')),
+            ],
+            options={
+                'verbose_name': 'FacturAPI Sync State',
+                'verbose_name_plural': 'FacturAPI Sync States',
+                'ordering': ['name'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturapi', '0007_facturapisyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facturapiinvoicepayment',
+            name='sheet_row',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Fila del archivo'),
+        ),
+        migrations.AddField(
+            model_name='facturapiinvoicepayment',
+            name='status',
+            field=models.CharField(blank=True, choices=[('PENDING', 'Pendiente'), ('RUNNING', 'En proceso'), ('RETRYING', 'Reintentando'), ('SUCCESS', 'Correcto'), ('SKIPPED', 'Omitido'), ('FAILED', 'Fallido')], max_length=10, null=True, verbose_name='Estatus'),
+        ),
+        migrations.AddField(
+            model_name='facturapiinvoicepayment',
+            name='message',
+            field=models.TextField(blank=True, default='', verbose_name='Mensaje'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:00
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturapi', '0008_facturapiinvoicepayment_sheet_row_status_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacturapiWebhookEvent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('event_id', models.CharField(max_length=100, unique=True, verbose_name='ID del evento')),
+                ('type', models.CharField(max_length=100, verbose_name='Tipo de evento')),
+                ('object_id', models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='ID del objeto')),
+                ('event_created_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha del evento')),
+                ('payload', models.JSONField(verbose_name='Payload')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Procesado el')),
+                ('result', models.CharField(blank=True, default='', max_length=255, verbose_name='Resultado')),
+            ],
+            options={
+                'verbose_name': 'FacturAPI Webhook Event',
+                'verbose_name_plural': 'FacturAPI Webhook Events',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
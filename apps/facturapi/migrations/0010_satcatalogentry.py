@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 20:00
+
+import uuid
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturapi', '0009_facturapiwebhookevent'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='SatCatalogEntry',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('catalog', models.CharField(choices=[('c_ClaveProdServ', 'Productos y servicios'), ('c_ClaveUnidad', 'Unidades de medida'), ('c_FormaPago', 'Formas de pago'), ('c_UsoCFDI', 'Usos del CFDI'), ('c_RegimenFiscal', 'Regímenes fiscales')], max_length=30, verbose_name='Catálogo')),
+                ('key', models.CharField(max_length=20, verbose_name='Clave')),
+                ('description', models.TextField(verbose_name='Descripción')),
+                ('search_text', models.TextField(editable=False, verbose_name='Texto de búsqueda')),
+            ],
+            options={
+                'verbose_name': 'SAT Catalog Entry',
+                'verbose_name_plural': 'SAT Catalog Entries',
+                'ordering': ['catalog', 'key'],
+                'indexes': [models.Index(fields=['catalog', 'key'], name='sat_catalog_key_prefix_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']), django.contrib.postgres.indexes.GinIndex(fields=['search_text'], name='sat_catalog_search_trgm_idx', opclasses=['gin_trgm_ops'])],
+                'constraints': [models.UniqueConstraint(fields=('catalog', 'key'), name='sat_catalog_entry_key_uniq')],
+            },
+        ),
+    ]
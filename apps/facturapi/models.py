@@ -1,11 +1,16 @@
 from datetime import datetime
 
+import unicodedata
+
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import TrigramSimilarity
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 from apps.facturapi.choices import TaxRegime, PAYMENT_METHOD_CHOICES, TaxType, TaxFactorType, CFDI_TYPES, CFDI_USE, \
-    CFDIRelationType, PAYMENT_FORMS
+    CFDIRelationType, PAYMENT_FORMS, SatCatalog
+from core.system.enums import JobItemStatus
 from core.system.models import BaseModel
 
 
@@ -206,3 +211,107 @@ class FacturapiInvoicePayment(BaseModel):
     last_balance = models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Pendiente por pagar anteriormente')
     payment_day = models.DateField(default=datetime.now, verbose_name='Fecha de pago (dd/mm/yyyy)')
     taxes = models.ManyToManyField(FacturapiTax, verbose_name='Impuestos')
+    # Solo para pagos cargados desde el motor de acciones (CP): fila del Excel y resultado del timbrado
+    sheet_row = models.PositiveIntegerField(null=True, blank=True, verbose_name='Fila del archivo')
+    status = models.CharField(max_length=10, choices=JobItemStatus.choices, null=True, blank=True,
+                              verbose_name='Estatus')
+    message = models.TextField(blank=True, default='', verbose_name='Mensaje')
+
+
+class FacturapiSyncState(BaseModel):
+    """
+    Marca de agua de una sincronización con FacturAPI: fecha (campo `date`) de la factura más reciente importada.
+    La importación incremental solo pide facturas posteriores a esta fecha.
+    """
+    name = models.CharField(_('Sincronización'), max_length=50, unique=True)
+    high_water_mark = models.DateTimeField(_('Última fecha importada'), blank=True, null=True)
+    last_run_at = models.DateTimeField(_('Última ejecución'), blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.high_water_mark}"
+
+    class Meta:
+        verbose_name = _("FacturAPI Sync State")
+        verbose_name_plural = _("FacturAPI Sync States")
+        ordering = ["name"]
+
+
+class FacturapiWebhookEvent(BaseModel):
+    """
+    Evento recibido por el webhook de FacturAPI. `event_id` es único: un evento que llega dos veces
+    se guarda y se aplica una sola vez.
+    """
+    event_id = models.CharField(_('ID del evento'), max_length=100, unique=True)
+    type = models.CharField(_('Tipo de evento'), max_length=100)
+    object_id = models.CharField(_('ID del objeto'), max_length=255, blank=True, default='', db_index=True)
+    event_created_at = models.DateTimeField(_('Fecha del evento'), blank=True, null=True)
+    payload = models.JSONField(_('Payload'))
+    processed_at = models.DateTimeField(_('Procesado el'), blank=True, null=True)
+    result = models.CharField(_('Resultado'), max_length=255, blank=True, default='')
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+    class Meta:
+        verbose_name = _("FacturAPI Webhook Event")
+        verbose_name_plural = _("FacturAPI Webhook Events")
+        ordering = ["-created_at"]
+
+
+class SatCatalogEntry(BaseModel):
+    """
+    Copia local de los catálogos del SAT (se carga con el comando load_sat_catalogs).
+    Las búsquedas usan `search_text` (clave y descripción en minúsculas y sin acentos) con índice de trigramas.
+    """
+    SEARCH_PAGE_SIZE = 20
+
+    catalog = models.CharField(_('Catálogo'), max_length=30, choices=SatCatalog.choices)
+    key = models.CharField(_('Clave'), max_length=20)
+    description = models.TextField(_('Descripción'))
+    search_text = models.TextField(_('Texto de búsqueda'), editable=False)
+
+    def __str__(self):
+        return f"{self.key}: {self.description}"
+
+    class Meta:
+        verbose_name = _("SAT Catalog Entry")
+        verbose_name_plural = _("SAT Catalog Entries")
+        ordering = ["catalog", "key"]
+        constraints = [
+            models.UniqueConstraint(fields=["catalog", "key"], name="sat_catalog_entry_key_uniq"),
+        ]
+        indexes = [
+            # LIKE 'texto%' por clave y LIKE '%texto%' (pg_trgm) por descripción
+            models.Index(fields=["catalog", "key"], name="sat_catalog_key_prefix_idx",
+                         opclasses=["varchar_pattern_ops", "varchar_pattern_ops"]),
+            GinIndex(fields=["search_text"], name="sat_catalog_search_trgm_idx", opclasses=["gin_trgm_ops"]),
+        ]
+
+    @staticmethod
+    def normalize(value):
+        """
+        Minúsculas y sin acentos, igual que `search_text`.
+        """
+        value = unicodedata.normalize("NFKD", str(value or ""))
+        return "".join(char for char in value if not unicodedata.combining(char)).lower().strip()
+
+    @staticmethod
+    def search(catalog, term, page=1, page_size=SEARCH_PAGE_SIZE):
+        """
+        Busca en el catálogo local. Un término numérico se busca como prefijo de la clave; un texto, por palabras
+        (todas deben aparecer) ordenado por similitud. Regresa ([(clave, descripción)], hay_más).
+        """
+        term = SatCatalogEntry.normalize(term)
+        queryset = SatCatalogEntry.objects.filter(catalog=catalog)
+        if not term:
+            queryset = queryset.order_by("key")
+        elif term.isdigit():
+            queryset = queryset.filter(key__startswith=term).order_by("key")
+        else:
+            for word in term.split():
+                queryset = queryset.filter(search_text__contains=word)
+            queryset = queryset.annotate(similarity=TrigramSimilarity("search_text", term)).order_by("-similarity",
+                                                                                                     "key")
+        start = (max(int(page or 1), 1) - 1) * page_size
+        rows = list(queryset.values_list("key", "description")[start:start + page_size + 1])
+        return rows[:page_size], len(rows) > page_size
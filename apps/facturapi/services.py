@@ -1,16 +1,16 @@
-import os
 import json
+import re
 from decimal import Decimal, ROUND_HALF_UP
 
 import requests
-from django.conf import settings
+from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
-from apps.facturapi.models import FacturapiInvoice, FacturapiInvoiceItem, FacturapiProduct, FacturapiInvoicePayment
-from ikigai2025.settings import FACTURAPI_API_KEY
+from apps.facturapi.client import FacturapiError, is_transient_error, request, _log_http_error  # noqa: F401
+from apps.facturapi.file_cache import invalidate_invoice_files
+from apps.facturapi.models import FacturapiInvoice, FacturapiInvoiceItem, FacturapiInvoicePayment
+from core.operations_panel.models import Client
 
-FACTURAPI_BASE_URL = 'https://www.facturapi.io/v2'
-DEFAULT_TIMEOUT = 10  # segundos
 D2 = Decimal('0.01')
 D4 = Decimal('0.0001')
 ONE = Decimal('1')
@@ -24,30 +24,6 @@ def q4(v):  # 4 decimales (tasas)
     return Decimal(str(v or '0')).quantize(D4, rounding=ROUND_HALF_UP)
 
 
-def get_facturapi_key():
-    """
-    Get the FacturAPI key from settings.
-    """
-    api_key = FACTURAPI_API_KEY
-    if not api_key:
-        print("FACTURAPI_KEY not set in env")
-        raise ValueError("FACTURAPI_KEY not set in env")
-    return api_key
-
-
-def get_headers(extra=None):
-    """
-    Get the headers for FacturAPI requests.
-    """
-    headers = {
-        'Authorization': f'Bearer {get_facturapi_key()}',
-        'Content-Type': 'application/json',
-    }
-    if extra:
-        headers.update(extra)
-    return headers
-
-
 def _clean_payload(d):
     """Elimina claves con None o listas vacías/strings vacíos (opcional)."""
     return {k: v for k, v in d.items() if v not in (None, '', [], {})}
@@ -57,13 +33,14 @@ def cancel_invoice(invoice: FacturapiInvoice, motive=None, substitute_uuid=None)
     data = {}
     data["motive"] = motive
     data["substitution"] = substitute_uuid
-    url = FACTURAPI_BASE_URL + "/invoices/" + invoice.facturapi_id + '?motive=' + str(motive)
-    if motive == '01' or motive == '04':
-        url += "&substitution=" + str(substitute_uuid)
-    headers = get_headers()
-    resp = requests.delete(url, headers=headers, timeout=DEFAULT_TIMEOUT)
+    params = {"motive": str(motive)}
+    if motive == '01' and not substitute_uuid:
+        raise Exception("El motivo 01 requiere el UUID de la factura que sustituye")
+    if (motive == '01' or motive == '04') and substitute_uuid:
+        params["substitution"] = str(substitute_uuid)
+    resp = request("DELETE", f"/invoices/{invoice.facturapi_id}", params=params)
     if resp.status_code != 200:
-        raise Exception(resp.content)
+        raise FacturapiError(resp.content, status_code=resp.status_code)
     s = json.loads(resp.content)
 
     invoice.status = s.get('status') or invoice.status  # 'valid' | 'canceled' | 'pending' | 'draft'
@@ -72,6 +49,8 @@ def cancel_invoice(invoice: FacturapiInvoice, motive=None, substitute_uuid=None)
 
     invoice.facturapi_response = s
     invoice.save()
+    # El PDF de una factura cancelada cambia y ya existe el acuse: se descartan los archivos en caché
+    invalidate_invoice_files(invoice.facturapi_id)
 
 
 def bill_type_i(invoice: FacturapiInvoice):
@@ -80,10 +59,7 @@ def bill_type_i(invoice: FacturapiInvoice):
     data["payment_method"] = invoice.payment_form
     data["use"] = invoice.use
     data = _set_facturapi_invoice_cfdi_relation(invoice, data)
-    data["items"] = []
-    for invoice_item in invoice.items.all():
-        item = _set_facturapi_invoice_item(invoice_item)
-        data["items"].append(item)
+    data["items"] = _set_facturapi_invoice_items(invoice)
     data["pdf_custom_section"] = invoice.pdf_custom_section
     _send_invoice_to_facturapi(invoice, data)
 
@@ -94,10 +70,7 @@ def bill_type_e(invoice: FacturapiInvoice):
     data["payment_method"] = invoice.payment_form
     data["use"] = invoice.use
     data = _set_facturapi_invoice_cfdi_relation(invoice, data)
-    data["items"] = []
-    for invoice_item in invoice.items.all():
-        item = _set_facturapi_invoice_item(invoice_item)
-        data["items"].append(item)
+    data["items"] = _set_facturapi_invoice_items(invoice)
     data["pdf_custom_section"] = invoice.pdf_custom_section
     _send_invoice_to_facturapi(invoice, data)
 
@@ -112,16 +85,23 @@ def bill_type_p(invoice: FacturapiInvoice):
     # Prefetch para evitar N+1
     payments = invoice.payments.prefetch_related('taxes').all()
 
+    # Un nodo por fecha de pago: los documentos liquidados con el mismo pago van en el mismo nodo
+    # (el SAT permite varios documentos relacionados por pago, del mismo receptor)
+    nodes = {}
     for pay in payments:
-        pago_node = _set_facturapi_invoice_payment(pay)
-        # Asegura la moneda real del invoice
-        if pago_node["related_documents"]:
-            pago_node["related_documents"][0]["currency"] = invoice.currency
-
-        # Si manejas forma de pago a nivel factura:
-        if getattr(invoice, "payment_form", None):
+        pago_node = nodes.get(pay.payment_day)
+        if pago_node is not None:
+            pago_node["related_documents"].append(
+                _serialize_related_document_from_payment(pay, currency=invoice.currency)
+            )
+            continue
+
+        pago_node = _set_facturapi_invoice_payment(pay, currency=invoice.currency)
+        # Forma de pago SAT a nivel factura (en el modelo vive en payment_method; payment_form es PUE/PPD)
+        if invoice.payment_method:
             pago_node["payment_form"] = invoice.payment_method
 
+        nodes[pay.payment_day] = pago_node
         complement["data"].append(pago_node)
 
     if complement["data"]:
@@ -132,9 +112,8 @@ def bill_type_p(invoice: FacturapiInvoice):
 
 
 def get_invoice(invoice_id):
-    url = f"{FACTURAPI_BASE_URL}/invoices/{invoice_id}"
     try:
-        resp = requests.get(url, headers=get_headers(), timeout=DEFAULT_TIMEOUT)
+        resp = request("GET", f"/invoices/{invoice_id}")
         resp.raise_for_status()
         return resp.json()
     except requests.exceptions.RequestException as e:
@@ -147,7 +126,6 @@ def list_invoices(limit=50, page=1, **filters):
     Lista facturas con filtros (usa params para URL-encode correcto).
     Ejemplos de filters: status='valid', customer='cus_...', date={'gte': '2024-01-01', 'lte': '2024-12-31'}
     """
-    url = f"{FACTURAPI_BASE_URL}/invoices"
     params = {"limit": limit, "page": page}
     # aplanado básico de filtros anidados (p.ej. date[gte]=..., date[lte]=...)
     for k, v in (filters or {}).items():
@@ -158,7 +136,7 @@ def list_invoices(limit=50, page=1, **filters):
             params[k] = v
 
     try:
-        resp = requests.get(url, headers=get_headers(), params=params, timeout=DEFAULT_TIMEOUT)
+        resp = request("GET", "/invoices", params=params)
         resp.raise_for_status()
         return resp.json()
     except requests.exceptions.RequestException as e:
@@ -166,56 +144,6 @@ def list_invoices(limit=50, page=1, **filters):
         raise
 
 
-# Invoice download functions
-def download_invoice_cancellation_pdf(invoice_id):
-    url = f"{FACTURAPI_BASE_URL}/invoices/{invoice_id}/cancellation_receipt/pdf"
-    try:
-        resp = requests.get(url, headers=get_headers({"Accept": "application/pdf"}), stream=True,
-                            timeout=DEFAULT_TIMEOUT)
-        resp.raise_for_status()
-        return resp.content, _filename_from_disposition(resp.headers, fallback=f"{invoice_id}.pdf")
-    except requests.exceptions.RequestException as e:
-        _log_http_error("descargar PDF", e)
-        raise
-
-
-# Invoice download functions
-def download_invoice_pdf(invoice_id):
-    url = f"{FACTURAPI_BASE_URL}/invoices/{invoice_id}/pdf"
-    try:
-        resp = requests.get(url, headers=get_headers({"Accept": "application/pdf"}), stream=True,
-                            timeout=DEFAULT_TIMEOUT)
-        resp.raise_for_status()
-        return resp.content, _filename_from_disposition(resp.headers, fallback=f"{invoice_id}.pdf")
-    except requests.exceptions.RequestException as e:
-        _log_http_error("descargar PDF", e)
-        raise
-
-
-def download_invoice_xml(invoice_id):
-    url = f"{FACTURAPI_BASE_URL}/invoices/{invoice_id}/xml"
-    try:
-        resp = requests.get(url, headers=get_headers({"Accept": "application/xml"}), stream=True,
-                            timeout=DEFAULT_TIMEOUT)
-        resp.raise_for_status()
-        return resp.content, _filename_from_disposition(resp.headers, fallback=f"{invoice_id}.xml")
-    except requests.exceptions.RequestException as e:
-        _log_http_error("descargar XML", e)
-        raise
-
-
-def download_invoice_zip(invoice_id):
-    url = f"{FACTURAPI_BASE_URL}/invoices/{invoice_id}/zip"
-    try:
-        resp = requests.get(url, headers=get_headers({"Accept": "application/zip"}), stream=True,
-                            timeout=DEFAULT_TIMEOUT)
-        resp.raise_for_status()
-        return resp.content, _filename_from_disposition(resp.headers, fallback=f"{invoice_id}.zip")
-    except requests.exceptions.RequestException as e:
-        _log_http_error("descargar ZIP", e)
-        raise
-
-
 # ------------------------
 # Helpers
 # ------------------------
@@ -227,42 +155,131 @@ class DecimalEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
-def _filename_from_disposition(headers, fallback):
-    cd = headers.get("Content-Disposition", "")
-    # intento simple: attachment; filename="..."
-    if "filename=" in cd:
-        try:
-            return cd.split("filename=")[1].strip('"; ')
-        except Exception:
-            pass
-    return fallback
-
-
-def _log_http_error(what, e: requests.exceptions.RequestException):
-    msg = f"Error al {what}: {str(e)}"
-    if getattr(e, "response", None) is not None:
-        try:
-            payload = e.response.json()
-            print("%s | status=%s | detail=%s", msg, e.response.status_code, payload)
-        except Exception:
-            print("%s | status=%s | body=%s", msg, e.response.status_code, getattr(e.response, "text", ""))
-    else:
-        print(msg)
+# Campos que vienen de FacturAPI y se sobrescriben al sincronizar; lo capturado localmente (cliente, uso,
+# sección del PDF, etc.) solo se llena al crear la factura
+SYNCED_INVOICE_FIELDS = (
+    "status", "cancellation_status", "canceled_at", "amount_due", "total", "uuid", "series", "folio_number",
+    "stamp_date", "sat_cert_number", "verification_url", "sat_signature", "signature", "related_documents",
+    "target_invoice_ids", "received_payment_ids", "complements", "facturapi_response", "is_live", "updated_at",
+)
+
+# Campo sincronizado -> llaves de la factura de FacturAPI de las que sale. Los eventos del webhook pueden traer
+# solo parte de la factura: sin ninguna de sus llaves el campo se deja como está
+INVOICE_FIELD_SOURCES = {
+    "status": ("status",),
+    "cancellation_status": ("cancellation", "cancellation_status"),
+    "canceled_at": ("cancellation",),
+    "amount_due": ("amount_due",),
+    "total": ("total",),
+    "uuid": ("uuid",),
+    "series": ("series",),
+    "folio_number": ("folio_number",),
+    "stamp_date": ("stamp", "date", "created_at"),
+    "sat_cert_number": ("stamp",),
+    "verification_url": ("verification_url",),
+    "sat_signature": ("stamp",),
+    "signature": ("stamp",),
+    "related_documents": ("related_documents",),
+    "target_invoice_ids": ("target_invoice_ids",),
+    "received_payment_ids": ("received_payment_ids",),
+    "complements": ("complements",),
+    "is_live": ("livemode",),
+}
+
+
+def parse_facturapi_datetime(value):
+    """
+    Convierte las fechas ISO de FacturAPI ("2024-05-01T18:20:00.000Z") a datetime con zona horaria.
+    """
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
 
 
-def _set_facturapi_invoice_base_data(invoice: FacturapiInvoice):
-    if not invoice.customer:
+def present_invoice_fields(inv: dict):
+    """
+    Campos de SYNCED_INVOICE_FIELDS que sí vienen en `inv` (según INVOICE_FIELD_SOURCES), más updated_at.
+    """
+    fields = facturapi_invoice_fields(inv)
+    return {
+        name: value for name, value in fields.items()
+        if name == "updated_at" or any(key in inv for key in INVOICE_FIELD_SOURCES.get(name, ()))
+    }
+
+
+def facturapi_invoice_fields(inv: dict):
+    """
+    Traduce una factura de la API de FacturAPI a los valores de SYNCED_INVOICE_FIELDS.
+    """
+    stamp = inv.get("stamp") or {}
+    cancellation = inv.get("cancellation") or {}
+    return {
+        "status": inv.get("status", "valid"),
+        "cancellation_status": cancellation.get("status") or inv.get("cancellation_status"),
+        "canceled_at": parse_facturapi_datetime(cancellation.get("last_checked")),
+        "amount_due": inv.get("amount_due", 0) or 0,
+        "total": inv.get("total", 0) or 0,
+        "uuid": inv.get("uuid"),
+        "series": inv.get("series"),
+        "folio_number": inv.get("folio_number"),
+        # Fecha de timbrado (tomamos primero la del SAT si existe)
+        "stamp_date": parse_facturapi_datetime(stamp.get("date") or inv.get("date") or inv.get("created_at")),
+        "sat_cert_number": stamp.get("sat_cert_number"),
+        "verification_url": inv.get("verification_url"),
+        "sat_signature": stamp.get("sat_signature"),
+        "signature": stamp.get("signature"),
+        "related_documents": inv.get("related_documents"),
+        "target_invoice_ids": inv.get("target_invoice_ids"),
+        "received_payment_ids": inv.get("received_payment_ids"),
+        "complements": inv.get("complements"),
+        "facturapi_response": inv,
+        "is_live": inv.get("livemode", False),
+        "updated_at": timezone.now(),
+    }
+
+
+def _set_facturapi_invoice_base_data(invoice: FacturapiInvoice, customer_blocks=None):
+    """
+    Tipo y receptor. `customer_blocks` es un dict opcional {customer_id: bloque} para reutilizar el bloque
+    del cliente cuando se arman varias facturas seguidas (trabajos masivos).
+    """
+    if not invoice.customer_id:
         raise Exception("La factura no tiene cliente. Asignalo antes de enviar a FacturAPI.")
-    data = {"type": invoice.type, "customer": {}}
-    data["customer"]["legal_name"] = invoice.customer.business_name
-    data["customer"]["email"] = invoice.customer.email.split(',')[0]
-    data["customer"]["tax_id"] = invoice.customer.rfc
-    data["customer"]["tax_system"] = invoice.customer.tax_regime
-    data["customer"]["address"] = {}
-    data["customer"]["address"]["zip"] = invoice.customer.address.zip_code
+    if customer_blocks is not None and invoice.customer_id in customer_blocks:
+        customer = customer_blocks[invoice.customer_id]
+    else:
+        customer = _customer_block(invoice)
+        if customer_blocks is not None:
+            customer_blocks[invoice.customer_id] = customer
+    # Cada factura recibe su copia: el payload se modifica después (cartaporte, complementos)
+    data = {"type": invoice.type, "customer": {**customer, "address": dict(customer["address"])}}
+    # Con la llave de idempotencia FacturAPI no duplica la factura si un reintento repite el envío
+    if invoice.idempotency_key:
+        data["idempotency_key"] = str(invoice.idempotency_key)
     return data
 
 
+def _customer_block(invoice: FacturapiInvoice):
+    if "customer" in invoice._state.fields_cache:
+        customer = invoice.customer
+    else:
+        # Cliente y dirección en un solo query
+        customer = Client.objects.select_related("address").get(pk=invoice.customer_id)
+    return {
+        "legal_name": customer.business_name,
+        "email": customer.email.split(',')[0],
+        "tax_id": customer.rfc,
+        "tax_system": customer.tax_regime,
+        "address": {"zip": customer.address.zip_code if customer.address else None},
+    }
+
+
 def _set_facturapi_invoice_cfdi_relation(invoice: FacturapiInvoice, data: dict):
     if invoice.relation_type:
         data["related_documents"] = []
@@ -278,31 +295,55 @@ def _set_facturapi_invoice_cfdi_relation(invoice: FacturapiInvoice, data: dict):
     return data
 
 
-def _set_facturapi_invoice_item(invoice_item: FacturapiInvoiceItem):
-    item_data = {"quantity": invoice_item.quantity, "discount": str(invoice_item.discount), "product": {}}
-    product = FacturapiProduct.objects.get(pk=invoice_item.product.id)
-    item_data["product"]['description'] = product.description
-    item_data["product"]['product_key'] = product.product_key
-    item_data["product"]['price'] = float(invoice_item.unit_price)
-    item_data["product"]['sku'] = product.sku
-    item_data["product"]['unit_key'] = product.unit_key
-    # item_data["product"]['unit_name'] = product.unit_code.split(':')[1]
-    item_data["product"]['tax_included'] = False
-    item_data["product"]['taxes'] = []
-    for tax in product.taxes.all():
-        tax_data = {
-            'type': tax.type,
-            'factor': tax.factor,
-            'withholding': tax.withholding,
-            'rate': float(tax.rate),
-        }
-        item_data["product"]['taxes'].append(tax_data)
-    return item_data
+def _set_facturapi_invoice_items(invoice: FacturapiInvoice):
+    """
+    Conceptos de la factura. Productos e impuestos se cargan en dos queries para todos los conceptos
+    (ninguno si ya venían precargados con prefetch_related("items__product__taxes")).
+    """
+    items = invoice.items.all()
+    if "items" not in getattr(invoice, "_prefetched_objects_cache", {}):
+        items = items.select_related("product").prefetch_related("product__taxes")
+    tax_blocks = {}
+    return [_set_facturapi_invoice_item(invoice_item, tax_blocks) for invoice_item in items]
+
+
+def _set_facturapi_invoice_item(invoice_item: FacturapiInvoiceItem, tax_blocks=None):
+    """
+    Concepto de FacturAPI. `tax_blocks` memoiza los impuestos por producto: las partidas que repiten
+    producto no vuelven a armarlos.
+    """
+    product = invoice_item.product
+    if tax_blocks is None:
+        tax_blocks = {}
+    if product.pk not in tax_blocks:
+        tax_blocks[product.pk] = [
+            {
+                'type': tax.type,
+                'factor': tax.factor,
+                'withholding': tax.withholding,
+                'rate': float(tax.rate),
+            }
+            for tax in product.taxes.all()
+        ]
+    return {
+        "quantity": invoice_item.quantity,
+        "discount": str(invoice_item.discount),
+        "product": {
+            'description': product.description,
+            'product_key': product.product_key,
+            'price': float(invoice_item.unit_price),
+            'sku': product.sku,
+            'unit_key': product.unit_key,
+            # 'unit_name': product.unit_code.split(':')[1],
+            'tax_included': False,
+            # Copias: el bloque memoizado se comparte entre partidas
+            'taxes': [dict(tax) for tax in tax_blocks[product.pk]],
+        },
+    }
 
 
-def _set_facturapi_invoice_payment(invoice_payment: FacturapiInvoicePayment):
-    related_doc = _serialize_related_document_from_payment(invoice_payment,
-                                                           currency="MXN")  # ajusta si tu invoice tiene otra moneda
+def _set_facturapi_invoice_payment(invoice_payment: FacturapiInvoicePayment, currency="MXN"):
+    related_doc = _serialize_related_document_from_payment(invoice_payment, currency=currency)
     return {
         "date": invoice_payment.payment_day.isoformat(),
         "related_documents": [related_doc]
@@ -310,13 +351,83 @@ def _set_facturapi_invoice_payment(invoice_payment: FacturapiInvoicePayment):
     }
 
 
+class InvoicePayloadError(Exception):
+    """
+    El payload no pasó la validación local; no se envió a FacturAPI.
+    """
+
+    def __init__(self, errors):
+        super().__init__("Factura incompleta: " + "; ".join(errors))
+        self.errors = errors
+
+
+ZIP_CODE_RE = re.compile(r"^\d{5}$")
+PRODUCT_KEY_RE = re.compile(r"^\d{8}$")
+
+
+def validate_invoice_payload(data: dict):
+    """
+    Revisa el payload antes de enviarlo para no gastar una llamada (ni un folio) en una factura que FacturAPI
+    va a rechazar. Junta todos los errores y lanza InvoicePayloadError.
+    """
+    errors = []
+    invoice_type = data.get("type")
+    if invoice_type not in ("I", "E", "P", "T"):
+        errors.append(f"tipo de comprobante inválido ({invoice_type})")
+
+    customer = data.get("customer") or {}
+    for key, label in (("legal_name", "razón social"), ("tax_id", "RFC"), ("tax_system", "régimen fiscal")):
+        if not customer.get(key):
+            errors.append(f"el cliente no tiene {label}")
+    if not ZIP_CODE_RE.match(str((customer.get("address") or {}).get("zip") or "")):
+        errors.append("el cliente no tiene un código postal válido")
+
+    if invoice_type in ("I", "E"):
+        for key, label in (("payment_form", "forma de pago"), ("payment_method", "método de pago"),
+                           ("use", "uso del CFDI")):
+            if not data.get(key):
+                errors.append(f"falta {label}")
+    if invoice_type in ("I", "E", "T"):
+        if not data.get("items"):
+            errors.append("la factura no tiene conceptos")
+        for position, item in enumerate(data.get("items") or [], start=1):
+            product = item.get("product") or {}
+            if Decimal(str(item.get("quantity") or 0)) <= 0:
+                errors.append(f"concepto {position}: la cantidad debe ser mayor a cero")
+            if not product.get("description"):
+                errors.append(f"concepto {position}: falta la descripción")
+            if not PRODUCT_KEY_RE.match(str(product.get("product_key") or "")):
+                errors.append(f"concepto {position}: clave de producto SAT inválida ({product.get('product_key')})")
+            if not product.get("unit_key"):
+                errors.append(f"concepto {position}: falta la clave de unidad")
+            price = product.get("price")
+            if price is None or price < 0:
+                errors.append(f"concepto {position}: precio inválido ({price})")
+                continue
+            amount = q2(Decimal(str(price)) * Decimal(str(item.get("quantity") or 0)))
+            if Decimal(str(item.get("discount") or 0)) > amount:
+                errors.append(f"concepto {position}: el descuento es mayor al importe")
+    if invoice_type == "P":
+        if not data.get("complements"):
+            errors.append("el complemento de pago no tiene pagos")
+        for complement in data.get("complements") or []:
+            if complement.get("type") != "pago":
+                continue
+            for position, node in enumerate(complement.get("data") or [], start=1):
+                if not node.get("payment_form"):
+                    errors.append(f"pago {position}: falta la forma de pago")
+
+    if errors:
+        raise InvoicePayloadError(errors)
+    return data
+
+
 def _send_invoice_to_facturapi(invoice: FacturapiInvoice, data: dict):
-    url = FACTURAPI_BASE_URL + "/invoices"
-    headers = get_headers()
+    validate_invoice_payload(data)
     json_data = json.dumps(data, cls=DecimalEncoder)
-    resp = requests.post(url, headers=headers, data=json_data, timeout=DEFAULT_TIMEOUT)
+    resp = request("POST", "/invoices", data=json_data)
     if resp.status_code != 200:
-        raise Exception(resp.content)
+        raise FacturapiError(resp.content, status_code=resp.status_code)
     s = json.loads(resp.content)
 
     stamp = s.get('stamp') or {}
@@ -0,0 +1,197 @@
+from decimal import Decimal
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.system.enums import JobItemStatus, JobStatus
+from core.system.models import BackgroundJob
+from core.system.services import JobItemSkipped, RateLimiter, finish_job_item, run_job
+
+
+def _finish_invalid_items(job):
+    """
+    Cierra las filas que no se deben procesar (inválidas o repetidas) y regresa las pendientes.
+    """
+    pending = []
+    for item in job.items.filter(status=JobItemStatus.PENDING):
+        payload = item.payload or {}
+        if payload.get("error"):
+            finish_job_item(item, JobItemStatus.FAILED, payload["error"])
+        elif payload.get("duplicate_of"):
+            finish_job_item(item, JobItemStatus.SKIPPED, f"Repetida, se procesa en la fila {payload['duplicate_of']}")
+        elif payload.get("skip"):
+            finish_job_item(item, JobItemStatus.SKIPPED, payload["skip"])
+        else:
+            pending.append(item)
+    return pending
+
+
+def _mark_done(job):
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        status=JobStatus.DONE, finished_at=timezone.now(), updated_at=timezone.now()
+    )
+
+
+@shared_task
+def cancel_invoices_job(job_id):
+    """
+    Cancelación masiva (CM/CMR). Las facturas se buscan en un solo query y se cancelan en paralelo, con
+    FACTURAPI_MAX_CONCURRENCY hilos y a lo más FACTURAPI_RATE_LIMIT peticiones por segundo.
+    Las facturas ya canceladas (o con la cancelación en proceso) se omiten, así que repetir el archivo es seguro.
+    """
+    from apps.facturapi.client import is_transient_error
+    from apps.facturapi.models import FacturapiInvoice
+    from apps.facturapi.services import cancel_invoice
+
+    job = BackgroundJob.objects.get(pk=job_id)
+    items = _finish_invalid_items(job)
+    if not items:
+        _mark_done(job)
+        return str(job.id)
+
+    references = [item.reference for item in items]
+    invoices = {}
+    queryset = FacturapiInvoice.objects.filter(
+        Q(uuid__in=references) | Q(uuid__in=[reference.lower() for reference in references])
+    ).order_by("created_at")
+    for invoice in queryset:
+        invoices[invoice.uuid.upper()] = invoice  # si el UUID se repite gana el registro más reciente
+
+    limiter = RateLimiter(settings.FACTURAPI_RATE_LIMIT)
+
+    def cancel(item):
+        invoice = invoices.get(item.reference)
+        if invoice is None:
+            raise Exception("La factura no existe en el sistema")
+        if invoice.status == "canceled":
+            raise JobItemSkipped("La factura ya estaba cancelada")
+        if invoice.cancellation_status == "pending":
+            raise JobItemSkipped("La cancelación ya estaba en proceso")
+        if not invoice.facturapi_id:
+            raise Exception("La factura no está timbrada en FacturAPI")
+
+        limiter.wait()
+        cancel_invoice(invoice, item.payload["motive"], item.payload.get("substitution"))
+        canceled = invoice.status == "canceled"
+        return {
+            "invoice": str(invoice.pk),
+            "uuid": invoice.uuid,
+            "status": invoice.status,
+            "cancellation_status": invoice.cancellation_status,
+            "message": "Cancelada" if canceled else "Solicitud enviada, pendiente de aceptación del receptor",
+        }
+
+    run_job(job, cancel, max_workers=settings.FACTURAPI_MAX_CONCURRENCY, is_transient=is_transient_error)
+    return str(job.id)
+
+
+def _payment_complement_invoice(item):
+    """
+    Factura tipo P del elemento con sus pagos (uno por fila). La llave de idempotencia es el id del elemento,
+    así que un reintento reutiliza la misma factura y FacturAPI no la timbra dos veces.
+    """
+    from apps.facturapi.models import FacturapiInvoice, FacturapiInvoicePayment
+
+    payload = item.payload
+    with transaction.atomic():
+        invoice = FacturapiInvoice.objects.filter(idempotency_key=str(item.pk)).first()
+        if invoice is not None:
+            return invoice
+        invoice = FacturapiInvoice.objects.create(
+            customer_id=payload["customer"],
+            type="P",
+            use=None,  # FacturAPI asigna CP01 a los complementos de pago
+            payment_form=None,
+            payment_method=payload["payment_form"],
+            currency=payload["currency"],
+            pdf_custom_section=f"Referencia de pago: {payload['reference']}" if payload.get("reference") else None,
+            idempotency_key=str(item.pk),
+            status="pending",
+            is_ready_to_stamp=True,
+        )
+        payments = [
+            FacturapiInvoicePayment(
+                invoice=invoice,
+                uuid=row["uuid"],
+                amount=Decimal(row["amount"]),
+                installment=row["installment"],
+                last_balance=Decimal(row["last_balance"]),
+                payment_day=payload["date"],
+                sheet_row=row["row"],
+                status=JobItemStatus.PENDING,
+            )
+            for row in payload["rows"]
+        ]
+        FacturapiInvoicePayment.objects.bulk_create(payments)
+        Through = FacturapiInvoicePayment.taxes.through
+        Through.objects.bulk_create([
+            Through(facturapiinvoicepayment_id=payment.pk, facturapitax_id=tax_id)
+            for payment, row in zip(payments, payload["rows"])
+            for tax_id in row["taxes"]
+        ])
+    return invoice
+
+
+@shared_task
+def payment_complements_job(job_id):
+    """
+    Complementos de pago (CP). Cada elemento es un pago de un cliente que puede cubrir varias facturas; se timbran
+    en paralelo con los mismos límites que las cancelaciones. El resultado de cada fila queda en su
+    FacturapiInvoicePayment (estatus y mensaje) además del trabajo.
+    """
+    from apps.facturapi.client import is_transient_error
+    from apps.facturapi.models import FacturapiInvoice
+
+    job = BackgroundJob.objects.get(pk=job_id)
+    items = _finish_invalid_items(job)
+    if not items:
+        _mark_done(job)
+        return str(job.id)
+
+    limiter = RateLimiter(settings.FACTURAPI_RATE_LIMIT)
+
+    def stamp(item):
+        invoice = _payment_complement_invoice(item)
+        if invoice.facturapi_id:
+            raise JobItemSkipped("El complemento ya estaba timbrado")
+
+        limiter.wait()
+        try:
+            invoice.bill()
+        except Exception as e:
+            invoice.payments.update(status=JobItemStatus.FAILED, message=str(e), updated_at=timezone.now())
+            raise
+        folio = f"{invoice.series or ''}{invoice.folio_number or ''}"
+        invoice.payments.update(status=JobItemStatus.SUCCESS, message=f"Complemento {folio}",
+                                updated_at=timezone.now())
+
+        # Saldo local de las facturas pagadas, para que el siguiente archivo calcule bien parcialidad y saldo
+        FacturapiInvoice.objects.bulk_update([
+            FacturapiInvoice(pk=row["invoice"], amount_due=Decimal(row["last_balance"]) - Decimal(row["amount"]))
+            for row in item.payload["rows"]
+        ], ["amount_due"])
+        return {
+            "invoice": str(invoice.pk),
+            "uuid": invoice.uuid,
+            "folio": folio,
+            "rows": [row["row"] for row in item.payload["rows"]],
+            "message": f"Complemento {folio} con {len(item.payload['rows'])} documento(s)",
+        }
+
+    run_job(job, stamp, max_workers=settings.FACTURAPI_MAX_CONCURRENCY, is_transient=is_transient_error)
+    return str(job.id)
+
+
+@shared_task
+def process_webhook_event(event_pk):
+    """
+    Aplica un evento del webhook de FacturAPI (fuera de la petición, para responder rápido).
+    """
+    from apps.facturapi.webhooks import apply_event
+
+    result = apply_event(event_pk)
+    print(f"[FACTURAPI WEBHOOK] {event_pk}: {result}")
+    return result
@@ -0,0 +1,406 @@
+import io
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from urllib3 import HTTPResponse
+from urllib3.connectionpool import HTTPConnectionPool
+
+from apps.facturapi import client
+from apps.facturapi.management.commands.load_sat_catalogs import Command as LoadSatCatalogsCommand
+from apps.facturapi.models import (
+    FacturapiInvoice, FacturapiInvoiceItem, FacturapiProduct, FacturapiTax, FacturapiWebhookEvent, SatCatalogEntry,
+)
+from apps.facturapi.services import (
+    InvoicePayloadError, _set_facturapi_invoice_base_data, _set_facturapi_invoice_cfdi_relation,
+    _set_facturapi_invoice_items, present_invoice_fields, validate_invoice_payload,
+)
+from apps.facturapi.webhooks import SIGNATURE_HEADER, apply_event, sign_payload
+from core.operations_panel.models import Client
+from core.operations_panel.models.address import Address
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """
+    FacturAPI local mínima: responde {"ok": true} por HTTP/1.1 sin cerrar la conexión.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.requests += 1
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalFacturapiServer(ThreadingHTTPServer):
+    """
+    Cuenta las conexiones aceptadas (una por socket del cliente) y las peticiones atendidas.
+    """
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), KeepAliveHandler)
+        self.connections = 0
+        self.requests = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class FacturapiClientTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(client, FACTURAPI_API_KEY="sk_test_local", _session=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: client._session and client._session.close())
+
+    def fake_pool(self, responses):
+        """
+        Sustituye la red por respuestas fijas por (método, ruta); regresa la lista de peticiones hechas.
+        Los reintentos y el Retry-After los sigue resolviendo el adaptador real de la sesión.
+        """
+        calls = []
+
+        def make_request(pool, conn, method, url, **kwargs):
+            calls.append((method, url))
+            status, headers = responses[(method, url.split("?")[0])].pop(0)
+            return HTTPResponse(body=io.BytesIO(b'{"ok": true}'), status=status, headers=headers, preload_content=False,
+                                request_method=method, request_url=url)
+
+        patcher = mock.patch.object(HTTPConnectionPool, "_make_request", autospec=True, side_effect=make_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sleep = mock.patch("urllib3.util.retry.time.sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        return calls
+
+    def test_session_is_shared_between_threads(self):
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(client.get_session())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(session) for session in sessions}), 1)
+        adapter = client.get_session().get_adapter(client.FACTURAPI_BASE_URL)
+        self.assertIsInstance(adapter.max_retries, client.JitteredRetry)
+        self.assertEqual(adapter._pool_maxsize, client.POOL_MAXSIZE)
+
+    def test_requests_reuse_one_keep_alive_connection(self):
+        server = LocalFacturapiServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        base_url = f"http://127.0.0.1:{server.server_port}/v2"
+        with mock.patch.object(client, "FACTURAPI_BASE_URL", base_url), \
+                mock.patch.dict(os.environ, {"NO_PROXY": "127.0.0.1", "no_proxy": "127.0.0.1"}):
+            for _ in range(5):
+                self.assertEqual(client.request("GET", "/invoices").json(), {"ok": True})
+        self.assertEqual(server.requests, 5)
+        self.assertEqual(server.connections, 1)
+
+    def test_request_goes_through_the_shared_session(self):
+        session = mock.Mock()
+        with mock.patch.object(client, "get_session", return_value=session):
+            client.request("GET", "/invoices", params={"page": 2})
+            client.request("GET", "https://example.com/absolute")
+        first, second = session.request.call_args_list
+        self.assertEqual(first.args, ("GET", f"{client.FACTURAPI_BASE_URL}/invoices"))
+        self.assertEqual(first.kwargs["params"], {"page": 2})
+        self.assertEqual(first.kwargs["timeout"], client.DEFAULT_TIMEOUT)
+        self.assertEqual(first.kwargs["headers"]["Authorization"], "Bearer sk_test_local")
+        self.assertEqual(second.args, ("GET", "https://example.com/absolute"))
+
+    def test_transient_get_is_retried(self):
+        failures = [(503, {})] * (client.MAX_RETRIES - 1)
+        calls = self.fake_pool({("GET", "/v2/invoices"): failures + [(200, {})]})
+        response = client.request("GET", "/invoices")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), client.MAX_RETRIES)
+
+    def test_retry_after_is_respected(self):
+        self.fake_pool({("GET", "/v2/invoices"): [(429, {"Retry-After": "2"}), (200, {})]})
+        response = client.request("GET", "/invoices")
+        self.assertEqual(response.status_code, 200)
+        self.sleep.assert_any_call(2.0)
+
+    def test_post_is_not_retried(self):
+        calls = self.fake_pool({("POST", "/v2/invoices"): [(503, {}), (200, {})]})
+        response = client.request("POST", "/invoices", data="{}")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(calls), 1)
+
+    def test_retries_give_up_with_the_last_response(self):
+        calls = self.fake_pool({("GET", "/v2/invoices"): [(503, {})] * (client.MAX_RETRIES + 1)})
+        response = client.request("GET", "/invoices")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(calls), client.MAX_RETRIES + 1)
+
+    def test_jittered_backoff_stays_below_the_exponential_backoff(self):
+        retry = client._retry_policy()
+        for _ in range(client.MAX_RETRIES):
+            retry = retry.increment(method="GET", url="/invoices")
+        ceiling = client.BACKOFF_FACTOR * 2 ** (client.MAX_RETRIES - 1)
+        for _ in range(50):
+            self.assertTrue(0 <= retry.get_backoff_time() <= ceiling)
+
+    def test_transient_errors(self):
+        self.assertTrue(client.is_transient_error(requests.exceptions.ConnectionError()))
+        self.assertTrue(client.is_transient_error(requests.exceptions.Timeout()))
+        self.assertTrue(client.is_transient_error(client.FacturapiError("límite", 429)))
+        self.assertFalse(client.is_transient_error(client.FacturapiError("inválida", 400)))
+        self.assertFalse(client.is_transient_error(ValueError("otro")))
+
+
+def create_customer(rfc="XAXX010101000"):
+    address = Address.objects.create(zip_code="06600", state="Ciudad de México")
+    return Client.objects.create(name="Cliente de prueba", business_name="CLIENTE DE PRUEBA", rfc=rfc,
+                                 email="prueba@example.com", phone="0000000000", tax_regime="601", address=address)
+
+
+class InvoicePayloadTests(TestCase):
+    # Cliente y dirección (1), conceptos con su producto (1) e impuestos de todos los productos (1)
+    PAYLOAD_QUERIES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = create_customer()
+        taxes = [
+            FacturapiTax.objects.create(name="IVA 16", type="IVA", rate=Decimal("0.16")),
+            FacturapiTax.objects.create(name="RET IVA 4", type="IVA", rate=Decimal("0.04"), withholding=True),
+        ]
+        cls.products = []
+        for number in range(10):
+            product = FacturapiProduct.objects.create(
+                name=f"Producto {number}", sku=f"PAYLOAD-{number}", description=f"Servicio de prueba {number}",
+                product_key="78101802", unit_key="E48", price=Decimal("100.00"),
+            )
+            product.taxes.set(taxes)
+            cls.products.append(product)
+
+    def create_invoice(self, item_count):
+        invoice = FacturapiInvoice.objects.create(customer=self.customer, type="I", payment_form="PUE",
+                                                  payment_method="03", use="G03")
+        FacturapiInvoiceItem.objects.bulk_create([
+            FacturapiInvoiceItem(
+                invoice=invoice, product=self.products[number % len(self.products)], quantity=Decimal("1"),
+                description="Servicio", product_key="78101802", unit_key="E48", unit_price=Decimal("100.00"),
+                subtotal=Decimal("100.00"), total=Decimal("116.00"),
+            )
+            for number in range(item_count)
+        ])
+        return FacturapiInvoice.objects.get(pk=invoice.pk)  # sin nada en caché, como al timbrar
+
+    def build_payload(self, invoice):
+        data = _set_facturapi_invoice_base_data(invoice)
+        data["payment_form"] = invoice.payment_method
+        data["payment_method"] = invoice.payment_form
+        data["use"] = invoice.use
+        data = _set_facturapi_invoice_cfdi_relation(invoice, data)
+        data["items"] = _set_facturapi_invoice_items(invoice)
+        validate_invoice_payload(data)
+        return data
+
+    def test_query_count_does_not_grow_with_items(self):
+        for item_count in (1, 100):
+            invoice = self.create_invoice(item_count)
+            with self.subTest(items=item_count), self.assertNumQueries(self.PAYLOAD_QUERIES):
+                data = self.build_payload(invoice)
+            self.assertEqual(len(data["items"]), item_count)
+
+    def test_items_get_their_own_copy_of_memoized_taxes(self):
+        data = self.build_payload(self.create_invoice(len(self.products) + 1))
+        first, repeated = data["items"][0]["product"]["taxes"], data["items"][-1]["product"]["taxes"]
+        self.assertEqual(first, repeated)
+        self.assertIsNot(first[0], repeated[0])
+        self.assertEqual({tax["rate"] for tax in first}, {0.16, 0.04})
+
+    def test_incomplete_payload_lists_every_error(self):
+        with self.assertRaises(InvoicePayloadError) as raised:
+            validate_invoice_payload({"type": "I", "customer": {"address": {"zip": "123"}}, "items": []})
+        errors = raised.exception.errors
+        for expected in ("el cliente no tiene RFC", "el cliente no tiene un código postal válido",
+                         "falta forma de pago", "la factura no tiene conceptos"):
+            self.assertIn(expected, errors)
+
+    def test_payment_nodes_need_a_payment_form(self):
+        customer = {"legal_name": "CLIENTE", "tax_id": "XAXX010101000", "tax_system": "601",
+                    "address": {"zip": "06600"}}
+        node = {"date": "2026-10-01", "related_documents": [{"uuid": "0000", "amount": 116}]}
+        data = {"type": "P", "customer": customer, "complements": [{"type": "pago", "data": [dict(node)]}]}
+        with self.assertRaises(InvoicePayloadError) as raised:
+            validate_invoice_payload(data)
+        self.assertEqual(raised.exception.errors, ["pago 1: falta la forma de pago"])
+
+        data["complements"][0]["data"][0]["payment_form"] = "03"
+        self.assertIs(validate_invoice_payload(data), data)
+
+
+class PresentInvoiceFieldsTests(SimpleTestCase):
+    def test_partial_payload_only_returns_its_fields(self):
+        fields = present_invoice_fields({"id": "inv_1", "status": "canceled", "cancellation_status": "accepted"})
+        self.assertEqual(set(fields), {"status", "cancellation_status", "updated_at"})
+        self.assertEqual(fields["status"], "canceled")
+
+    def test_stamp_block_brings_its_fields(self):
+        fields = present_invoice_fields({"stamp": {"date": "2026-10-01T16:00:05.000Z", "sat_cert_number": "0001"}})
+        self.assertEqual(set(fields), {"stamp_date", "sat_cert_number", "sat_signature", "signature", "updated_at"})
+        self.assertEqual(fields["sat_cert_number"], "0001")
+
+
+WEBHOOK_SECRET = "whsec_local_check"
+WEBHOOK_INVOICE_ID = "inv_webhook_check_0001"
+
+
+def recorded_invoice(status, cancellation_status, amount_due):
+    return {
+        "id": WEBHOOK_INVOICE_ID,
+        "status": status,
+        "cancellation_status": cancellation_status,
+        "amount_due": amount_due,
+        "total": 1160,
+        "uuid": "3FA85F64-5717-4562-B3FC-2C963F66AFA6",
+        "series": "A",
+        "folio_number": 101,
+        "date": "2026-10-01T16:00:00.000Z",
+        "livemode": False,
+        "stamp": {"date": "2026-10-01T16:00:05.000Z"},
+    }
+
+
+# Eventos grabados de FacturAPI (solo con los campos que usa la sincronización)
+RECORDED_EVENTS = {
+    "payment": {
+        "id": "evt_check_payment", "type": "invoice.status_updated", "created_at": "2026-10-05T10:00:00.000Z",
+        "data": {"object": recorded_invoice("valid", "none", 500)},
+    },
+    "canceled": {
+        "id": "evt_check_canceled", "type": "invoice.cancellation_status_updated",
+        "created_at": "2026-10-09T10:00:00.000Z", "data": {"object": recorded_invoice("canceled", "accepted", 500)},
+    },
+    "stale": {
+        "id": "evt_check_stale", "type": "invoice.status_updated", "created_at": "2026-10-07T10:00:00.000Z",
+        "data": {"object": recorded_invoice("valid", "pending", 500)},
+    },
+    "partial": {
+        "id": "evt_check_partial", "type": "invoice.status_updated", "created_at": "2026-10-06T10:00:00.000Z",
+        "data": {"object": {"id": WEBHOOK_INVOICE_ID, "status": "valid", "amount_due": 0}},
+    },
+}
+
+
+@override_settings(FACTURAPI_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class FacturapiWebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.invoice = FacturapiInvoice.objects.create(
+            customer=create_customer(), facturapi_id=WEBHOOK_INVOICE_ID, status="valid", amount_due=1160,
+            total=1160, uuid="3FA85F64-5717-4562-B3FC-2C963F66AFA6", series="A",
+        )
+
+    def post(self, event, signature=None):
+        body = json.dumps(event).encode()
+        return self.client.post(reverse("system_panel:facturapi:facturapi_webhook"), data=body,
+                                content_type="application/json",
+                                headers={SIGNATURE_HEADER: signature or sign_payload(body)})
+
+    def deliver(self, event):
+        """
+        Envía el evento y lo aplica en este hilo (dentro de la transacción del test no se ejecutan los on_commit).
+        """
+        response = self.post(event)
+        self.assertEqual(response.status_code, 200)
+        return apply_event(FacturapiWebhookEvent.objects.get(event_id=event["id"]).pk)
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.post(RECORDED_EVENTS["payment"], signature="firma-invalida")
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(FacturapiWebhookEvent.objects.exists())
+
+    def test_payment_event_is_applied(self):
+        self.deliver(RECORDED_EVENTS["payment"])
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.amount_due, 500)
+
+    def test_repeated_event_is_recorded_once(self):
+        self.deliver(RECORDED_EVENTS["canceled"])
+        response = self.post(RECORDED_EVENTS["canceled"])
+        self.assertTrue(response.json()["duplicate"])
+        self.assertEqual(FacturapiWebhookEvent.objects.filter(event_id=RECORDED_EVENTS["canceled"]["id"]).count(), 1)
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.status, self.invoice.cancellation_status), ("canceled", "accepted"))
+
+    def test_stale_event_is_discarded(self):
+        self.deliver(RECORDED_EVENTS["canceled"])
+        result = self.deliver(RECORDED_EVENTS["stale"])
+        self.assertTrue(result.startswith("Descartado"))
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, "canceled")
+
+    def test_partial_event_keeps_missing_fields(self):
+        self.deliver(RECORDED_EVENTS["partial"])
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.amount_due, 0)
+        self.assertEqual(self.invoice.total, 1160)
+        self.assertEqual((self.invoice.uuid, self.invoice.series), ("3FA85F64-5717-4562-B3FC-2C963F66AFA6", "A"))
+
+
+# Primera parte de c_ClaveProdServ (con títulos y encabezado) y su continuación sin encabezado
+PRODUCTS_PART_1 = [
+    ["Catálogo de productos y servicios"],
+    ["c_ClaveProdServ", "Descripción", "Incluir IVA trasladado", "FechaInicioVigencia", "FechaFinVigencia"],
+    ["01010101", "No existe en el catálogo", "Opcional", "01/01/2022", ""],
+    ["10101500", "Animales vivos de granja", "Opcional", "01/01/2022", "01/01/2000"],
+]
+PRODUCTS_PART_2 = [
+    ["78101802", "Transporte de carga por carretera", "Sí", "01/01/2022", ""],
+    ["", "", "", "", ""],
+]
+
+
+class SatCatalogRowsTests(SimpleTestCase):
+    def test_continuation_sheet_uses_the_previous_header(self):
+        command, columns = LoadSatCatalogsCommand(), {}
+        first = list(command.catalog_rows("c_ClaveProdServ", PRODUCTS_PART_1, columns))
+        second = list(command.catalog_rows("c_ClaveProdServ", PRODUCTS_PART_2, columns))
+        self.assertEqual(first, [("01010101", "No existe en el catálogo")])  # la segunda clave ya no está vigente
+        self.assertEqual(second, [("78101802", "Transporte de carga por carretera")])
+
+    def test_missing_header_without_a_previous_part_raises(self):
+        rows = [["sin encabezado"]] * 20
+        with self.assertRaisesMessage(Exception, "NO SE ENCONTRÓ EL ENCABEZADO c_ClaveProdServ"):
+            list(LoadSatCatalogsCommand().catalog_rows("c_ClaveProdServ", rows, {}))
+
+
+class LoadSatCatalogsTests(TestCase):
+    def write_csv(self, directory, name, rows):
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8", newline="") as handle:
+            handle.write("\n".join(",".join(row) for row in rows))
+        return path
+
+    def test_every_part_of_a_catalog_is_kept(self):
+        SatCatalogEntry.objects.create(catalog="c_ClaveProdServ", key="99999999", description="Clave retirada",
+                                       search_text="99999999 clave retirada")
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [self.write_csv(directory, "c_ClaveProdServ_Parte_1.csv", PRODUCTS_PART_1),
+                     self.write_csv(directory, "c_ClaveProdServ_Parte_2.csv", PRODUCTS_PART_2)]
+            call_command("load_sat_catalogs", *paths, stdout=io.StringIO())
+        keys = set(SatCatalogEntry.objects.filter(catalog="c_ClaveProdServ").values_list("key", flat=True))
+        self.assertEqual(keys, {"01010101", "78101802"})
@@ -12,6 +12,9 @@ urlpatterns = [
     path('invoices/<uuid:invoice_id>/download/zip/', views.download_invoice_zip, name='download_invoice_zip'),
     path('invoices/<uuid:invoice_id>/download/acuse/', views.download_invoice_acuse, name='download_invoice_acuse'),
 
+    # Webhook de FacturAPI (cambios de estatus de facturas)
+    path('webhook/', views.facturapi_webhook, name='facturapi_webhook'),
+
     path("taxes/", TaxListView.as_view(), name="facturapi_taxes"),                          # CHECK
     path("invoice/", InvoiceFormView.as_view(), name="facturapi_taxes"),                    # CHECK
     path("invoice/cancels/", CanceledInvoiceListView.as_view(), name="facturapi_taxes"),    # CHECK
@@ -8,17 +8,25 @@ from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponseForbidden, JsonResponse
 
+from django.utils.dateparse import parse_date
 from django.utils.safestring import mark_safe
+from django.utils.text import slugify
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from core.operations_panel.models import Client
+from core.system.services import EXPORT_CHUNK_SIZE, stream_zip_response
 from core.system.views import AdminListView, AdminTemplateView, PopupView
-from . import services
+from .file_cache import INVOICE_FILE_FORMATS, invoice_archive_entries, invoice_file_response
 from .forms import FacturapiTaxForm, FacturapiInvocieForm, SelectItemForm, FacturapiProductForm, \
     FacturapiInvoicePaymentForm, FacturapiCancelInvoiceForm
 from .models import FacturapiInvoice, FacturapiTax, FacturapiInvoicePayment
 from .models import FacturapiProduct, FacturapiInvoiceItem
+from .tasks import process_webhook_event
+from .webhooks import SIGNATURE_HEADER, record_event, verify_signature
 
 PRODUCT_KEY_RE = re.compile(r'^products\[(\d+)\]\[(\w+)\]$')
 PAYMENT_KEY_RE = re.compile(r'^payments\[(\d+)\]\[(\w+)\]$')
@@ -122,63 +130,58 @@ def extract_products_from_post(post):
 
 
 # Invoice Download Views
-@login_required
-def download_invoice_pdf(request, invoice_id):
+def _download_invoice_file(request, invoice_id, file_format, suffix=""):
     invoice = get_object_or_404(FacturapiInvoice, id=invoice_id)
+    extension = INVOICE_FILE_FORMATS[file_format][2]
+    filename = f"{invoice.series}-{invoice.folio_number}{suffix}.{extension}"
+    # Solo se guardan en caché archivos que ya no cambian: factura timbrada, o acuse de una ya cancelada
+    cacheable = invoice.status == "canceled" if file_format == "acuse" else bool(invoice.uuid)
     try:
-        pdf_content = services.download_invoice_pdf(invoice.facturapi_id)
-        response = HttpResponse(pdf_content, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{invoice.series}-{invoice.folio_number}.pdf"'
-        return response
+        return invoice_file_response(request, invoice.facturapi_id, file_format, filename, cacheable=cacheable)
     except Exception as e:
-        print(f"Error downloading invoice PDF: {str(e)}")
+        print(f"Error downloading invoice {file_format.upper()}: {str(e)}")
         return render(request, 'facturapi/error.html', {
-            'error_message': f"Error downloading invoice PDF: {str(e)}"
+            'error_message': f"Error downloading invoice {file_format.upper()}: {str(e)}"
         })
 
+
+@csrf_exempt
+@require_POST
+def facturapi_webhook(request):
+    """
+    Recibe los eventos de FacturAPI: valida la firma, guarda el evento (una sola vez por id) y encola su
+    aplicación. Responde de inmediato; un evento repetido se confirma sin volver a encolarse.
+    """
+    if not verify_signature(request.body, request.headers.get(SIGNATURE_HEADER)):
+        print("[FACTURAPI WEBHOOK] Firma inválida")
+        return HttpResponseForbidden("Invalid signature")
+    try:
+        event, created = record_event(json.loads(request.body))
+    except ValueError as e:
+        return JsonResponse({"status": "rejected", "message": str(e)}, status=400)
+    if created:
+        transaction.on_commit(lambda: process_webhook_event.delay(str(event.pk)))
+    return JsonResponse({"status": "accepted", "duplicate": not created}, status=200)
+
+
+@login_required
+def download_invoice_pdf(request, invoice_id):
+    return _download_invoice_file(request, invoice_id, "pdf")
+
+
 @login_required
 def download_invoice_acuse(request, invoice_id):
-    invoice = get_object_or_404(FacturapiInvoice, id=invoice_id)
-    try:
-        pdf_content = services.download_invoice_cancellation_pdf(invoice.facturapi_id)
-        response = HttpResponse(pdf_content, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{invoice.series}-{invoice.folio_number} - ACUSE CANCELACION.pdf"'
-        return response
-    except Exception as e:
-        print(f"Error downloading invoice PDF: {str(e)}")
-        return render(request, 'facturapi/error.html', {
-            'error_message': f"Error downloading invoice PDF: {str(e)}"
-        })
+    return _download_invoice_file(request, invoice_id, "acuse", " - ACUSE CANCELACION")
 
 
 @login_required
 def download_invoice_xml(request, invoice_id):
-    invoice = get_object_or_404(FacturapiInvoice, id=invoice_id)
-    try:
-        xml_content = services.download_invoice_xml(invoice.facturapi_id)
-        response = HttpResponse(xml_content, content_type='application/xml')
-        response['Content-Disposition'] = f'attachment; filename="{invoice.series}-{invoice.folio_number}.xml"'
-        return response
-    except Exception as e:
-        print(f"Error downloading invoice XML: {str(e)}")
-        return render(request, 'facturapi/error.html', {
-            'error_message': f"Error downloading invoice XML: {str(e)}"
-        })
+    return _download_invoice_file(request, invoice_id, "xml")
 
 
 @login_required
 def download_invoice_zip(request, invoice_id):
-    invoice = get_object_or_404(FacturapiInvoice, id=invoice_id)
-    try:
-        zip_content = services.download_invoice_zip(invoice.facturapi_id)
-        response = HttpResponse(zip_content, content_type='application/zip')
-        response['Content-Disposition'] = f'attachment; filename="{invoice.series}-{invoice.folio_number}.zip"'
-        return response
-    except Exception as e:
-        print(f"Error downloading invoice ZIP: {str(e)}")
-        return render(request, 'facturapi/error.html', {
-            'error_message': f"Error downloading invoice ZIP: {str(e)}"
-        })
+    return _download_invoice_file(request, invoice_id, "zip")
 
 
 class InvoiceFormView(AdminTemplateView):
@@ -356,6 +359,35 @@ class InvoiceListView(AdminListView):
             qs = qs.filter(q)
         return qs
 
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('export') == 'zip':
+            return self.export_zip(request)
+        return super().get(request, *args, **kwargs)
+
+    def export_zip(self, request):
+        """
+        ZIP con los PDF y XML de las facturas de la tabla, con la búsqueda actual y los filtros opcionales
+        ?date_from=&date_to= (fecha de timbrado, YYYY-MM-DD), ?customer=<id> y ?files=pdf,xml,acuse.
+        Se arma en streaming: las facturas se leen con un cursor y cada archivo se agrega al terminar su descarga.
+        """
+        queryset = self.export_queryset(request).filter(facturapi_id__isnull=False, uuid__isnull=False)
+        date_from = parse_date(request.GET.get('date_from', ''))
+        date_to = parse_date(request.GET.get('date_to', ''))
+        if date_from:
+            queryset = queryset.filter(stamp_date__date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(stamp_date__date__lte=date_to)
+        if request.GET.get('customer'):
+            queryset = queryset.filter(customer_id=request.GET['customer'])
+        formats = [f for f in request.GET.get('files', 'pdf,xml').split(',') if f in INVOICE_FILE_FORMATS] \
+            or ['pdf', 'xml']
+
+        invoices = queryset.values('facturapi_id', 'uuid', 'series', 'folio_number').iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        )
+        filename = f"{slugify(self.title)}-{now():%Y%m%d%H%M}.zip"
+        return stream_zip_response(invoice_archive_entries(invoices, formats), filename)
+
     def handle_getcancelinvoice(self, request, data):
         obj_id = request.POST.get('id')
         instance = get_object_or_404(self.model, pk=obj_id)
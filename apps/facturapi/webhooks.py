@@ -0,0 +1,103 @@
+# apps/facturapi/webhooks.py
+import base64
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.facturapi.file_cache import invalidate_invoice_files
+from apps.facturapi.models import FacturapiInvoice, FacturapiWebhookEvent
+from apps.facturapi.services import parse_facturapi_datetime, present_invoice_fields
+
+SIGNATURE_HEADER = "Facturapi-Signature"
+
+
+def sign_payload(body: bytes, secret=None):
+    """
+    Firma HMAC-SHA256 del cuerpo crudo de la petición con el secreto del webhook (hex).
+    """
+    secret = settings.FACTURAPI_WEBHOOK_SECRET if secret is None else secret
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: bytes, signature):
+    """
+    Compara en tiempo constante la firma recibida con la calculada; acepta la firma en hex o en base64.
+    Sin secreto configurado se rechaza todo.
+    """
+    secret = settings.FACTURAPI_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    signature = signature.strip()
+    return (hmac.compare_digest(signature.lower(), digest.hex())
+            or hmac.compare_digest(signature, base64.b64encode(digest).decode()))
+
+
+def record_event(payload: dict):
+    """
+    Guarda el evento si es nuevo. Regresa (evento, creado); un evento repetido regresa creado=False.
+    """
+    event_id = payload.get("id")
+    if not event_id:
+        raise ValueError("El evento no tiene id")
+    data_object = (payload.get("data") or {}).get("object") or {}
+    try:
+        with transaction.atomic():
+            event = FacturapiWebhookEvent.objects.create(
+                event_id=event_id,
+                type=payload.get("type") or "",
+                object_id=data_object.get("id") or "",
+                event_created_at=parse_facturapi_datetime(payload.get("created_at")),
+                payload=payload,
+            )
+    except IntegrityError:
+        return FacturapiWebhookEvent.objects.get(event_id=event_id), False
+    return event, True
+
+
+def apply_event(event_pk):
+    """
+    Aplica el evento a su FacturapiInvoice. Es idempotente: un evento ya procesado no se vuelve a aplicar y
+    uno más viejo que el último aplicado a la misma factura se descarta (los eventos pueden llegar desordenados).
+    """
+    with transaction.atomic():
+        event = FacturapiWebhookEvent.objects.select_for_update().get(pk=event_pk)
+        if event.processed_at:
+            return event.result
+        result = _apply_invoice_event(event)
+        event.processed_at = timezone.now()
+        event.result = result
+        event.save(update_fields=["processed_at", "result", "updated_at"])
+    return result
+
+
+def _apply_invoice_event(event):
+    inv = (event.payload.get("data") or {}).get("object") or {}
+    if not event.type.startswith("invoice.") or not event.object_id or "status" not in inv:
+        return "Evento ignorado"
+
+    # El bloqueo de la factura serializa los eventos de la misma factura antes de comparar fechas
+    invoice = FacturapiInvoice.objects.select_for_update().filter(facturapi_id=event.object_id).first()
+    if invoice is None:
+        return "Sin factura local"
+
+    newer = FacturapiWebhookEvent.objects.filter(
+        object_id=event.object_id, processed_at__isnull=False, event_created_at__gt=event.event_created_at,
+    ) if event.event_created_at else FacturapiWebhookEvent.objects.none()
+    if newer.exists():
+        return "Descartado: ya se aplicó un evento más reciente"
+
+    previous_status = invoice.status
+    # Solo lo que trae el evento: una llave ausente no debe dejar en 0 o None lo que ya se tenía
+    fields = present_invoice_fields(inv)
+    fields["facturapi_response"] = {**(invoice.facturapi_response or {}), **inv}
+    for name, value in fields.items():
+        setattr(invoice, name, value)
+    invoice.save(update_fields=list(fields))
+    if invoice.status != previous_status:
+        # El PDF de una factura cancelada cambia: se descarta el de la caché
+        transaction.on_commit(lambda: invalidate_invoice_files(invoice.facturapi_id))
+    return f"Actualizada: {previous_status} -> {invoice.status}, cancelación {invoice.cancellation_status or '-'}"
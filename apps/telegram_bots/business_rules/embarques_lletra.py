@@ -18,18 +18,13 @@ class EmbarquesLletraRule:
             from core.operations_panel.models.operation import Operation
             from core.operations_panel.choices import OperationStatus
 
-            operations = Operation.objects.filter(
+            # Un solo UPDATE sobre el índice parcial de operaciones listas con packing abierto
+            count = Operation.objects.filter(
                 is_packing_ready=False,
-                invoice__isnull=True,
-                status=OperationStatus.APPROVED
-            )
-
-            count = 0
-            for op in operations:
-                if op.is_ready_for_invoicing():
-                    op.is_packing_ready = True
-                    op.save()
-                    count += 1
+                shipment_invoice__isnull=True,
+                status=OperationStatus.APPROVED,
+                ready_for_invoicing=True,
+            ).update(is_packing_ready=True)
 
             reply = f"✅ Se han cerrado {count} packings." if count else "ℹ️ No hay packings para cerrar."
             api.send_message(chat.telegram_id, reply, reply_to=message.telegram_id)
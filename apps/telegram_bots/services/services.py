@@ -170,19 +170,13 @@ def process_message(bot, message_data):
 
             from core.operations_panel.models.operation import Operation
             from core.operations_panel.choices import OperationStatus
-            operations_to_update = Operation.objects.filter(
+            # Un solo UPDATE sobre el índice parcial de operaciones listas con packing abierto
+            count = Operation.objects.filter(
                 is_packing_ready=False,
-                invoice__isnull=True,
-                status=OperationStatus.APPROVED
-            )
-
-            count = 0
-            for operation in operations_to_update:
-                if operation.is_ready_for_invoicing():
-                    # Assign the folio
-                    operation.is_packing_ready = True
-                    operation.save()
-                    count += 1
+                shipment_invoice__isnull=True,
+                status=OperationStatus.APPROVED,
+                ready_for_invoicing=True,
+            ).update(is_packing_ready=True)
 
             # Reply with the result
             if count > 0:
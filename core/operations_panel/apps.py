@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class OperationsPanelConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'core.operations_panel'
\ No newline at end of file
+    name = 'core.operations_panel'
+
+    def ready(self):
+        import core.operations_panel.signals  # noqa: F401
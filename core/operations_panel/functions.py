@@ -1,6 +1,7 @@
 from django.utils.timezone import localtime
 
 from core.operations_panel.choices import CARTAPORTE_NS, MEXICAN_STATES_KEY
+from core.operations_panel.services import is_hazardous_material
 from xml.etree import ElementTree as ET
 
 
@@ -20,9 +21,13 @@ def _estado_clave(direction, CLAVE_ESTADO):
         return _s(getattr(direction, "state", None), "NLE")
 
 
+def _cp(tag):
+    return f"{{{CARTAPORTE_NS}}}{tag}"
+
+
 def _add_domicilio(parent, location):
-    """location.direction con: street, exterior_number, colony, cp, state"""
-    direction = getattr(location, "direction", None)
+    """location.direction (o location.address) con: street, exterior_number, colony, cp, state"""
+    direction = getattr(location, "direction", None) or getattr(location, "address", None)
     ET.register_namespace("cartaporte31", CARTAPORTE_NS)
     ET.SubElement(
         parent, f"{{{CARTAPORTE_NS}}}Domicilio",
@@ -35,3 +40,94 @@ def _add_domicilio(parent, location):
             "CodigoPostal": _s(getattr(direction, "zip_code", None), "00000"),
         }
     )
+
+
+def build_cartaporte_xml(invoice, operation, stops, products):
+    """
+    Construye el complemento Carta Porte 3.1 como un solo árbol de ElementTree.
+    No hace consultas ni guarda nada: `operation` debe traer route/vehicle/driver ya cargados
+    y `stops` / `products` son listas en memoria.
+    """
+    route, vehicle, driver = operation.route, operation.vehicle, operation.driver
+    missing = [name for name, value in (("ruta", route), ("vehículo", vehicle), ("operador", driver)) if value is None]
+    if missing:
+        raise ValueError(f"La operación no tiene {', '.join(missing)} para generar la carta porte")
+
+    ET.register_namespace("cartaporte31", CARTAPORTE_NS)
+    root = ET.Element(_cp("CartaPorte"), {
+        "Version": "3.1",
+        "TranspInternac": "No",
+        "TotalDistRec": _s(invoice.total_distance_km),
+        "IdCCP": _s(invoice.ccp_id),
+    })
+
+    ubicaciones = ET.SubElement(root, _cp("Ubicaciones"))
+    origin = ET.SubElement(ubicaciones, _cp("Ubicacion"), {
+        "TipoUbicacion": "Origen",
+        "RFCRemitenteDestinatario": _s(route.initial_location.rfc),
+        "FechaHoraSalidaLlegada": _fecha(invoice.departure_at),
+    })
+    _add_domicilio(origin, route.initial_location)
+    for stop in stops:
+        delivery = ET.SubElement(ubicaciones, _cp("Ubicacion"), {
+            "TipoUbicacion": "Destino",
+            "RFCRemitenteDestinatario": _s(stop.rfc),
+            "DistanciaRecorrida": "0",
+            "FechaHoraSalidaLlegada": _fecha(invoice.departure_at),
+        })
+        _add_domicilio(delivery, stop)
+    destination = ET.SubElement(ubicaciones, _cp("Ubicacion"), {
+        "TipoUbicacion": "Destino",
+        "RFCRemitenteDestinatario": _s(route.destination_location.rfc),
+        "FechaHoraSalidaLlegada": _fecha(invoice.scheduled_arrival_at),
+        "DistanciaRecorrida": _s(invoice.total_distance_km),
+    })
+    _add_domicilio(destination, route.destination_location)
+
+    mercancias = ET.SubElement(root, _cp("Mercancias"), {
+        "PesoBrutoTotal": _s(sum(product.weight or 0 for product in products)),
+        "UnidadPeso": "KGM",
+        "NumTotalMercancias": str(len(products)),
+    })
+    for product in products:
+        attributes = {
+            "BienesTransp": _s(product.transported_product_key),
+            "Cantidad": _s(product.amount),
+            "ClaveUnidad": _s(product.unit_key),
+            "Descripcion": _s(product.description),
+            "PesoEnKg": _s(product.weight),
+        }
+        # Claves del catálogo que "pueden ser" material peligroso: el SAT pide declarar el atributo
+        if is_hazardous_material(product.transported_product_key):
+            attributes["MaterialPeligroso"] = "No"
+        ET.SubElement(mercancias, _cp("Mercancia"), attributes)
+
+    autotransporte = ET.SubElement(mercancias, _cp("Autotransporte"), {
+        "NumPermisoSCT": _s(invoice.sct_permit_number),
+        "PermSCT": _s(invoice.sct_permit_type),
+    })
+    ET.SubElement(autotransporte, _cp("IdentificacionVehicular"), {
+        "AnioModeloVM": _s(vehicle.year),
+        "ConfigVehicular": _s(vehicle.vehicle_config),
+        "PlacaVM": _s(vehicle.license_plate),
+        "PesoBrutoVehicular": "500",
+    })
+    ET.SubElement(autotransporte, _cp("Seguros"), {
+        "AseguraRespCivil": _s(vehicle.insurance_company),
+        "PolizaRespCivil": _s(vehicle.insurance_code),
+    })
+    if operation.vehicle_box:
+        remolques = ET.SubElement(autotransporte, _cp("Remolques"))
+        ET.SubElement(remolques, _cp("Remolque"), {
+            "SubTipoRem": _s(operation.vehicle_box.vehicle_config),
+            "Placa": _s(operation.vehicle_box.license_plate),
+        })
+
+    figura = ET.SubElement(root, _cp("FiguraTransporte"))
+    ET.SubElement(figura, _cp("TiposFigura"), {
+        "TipoFigura": "01",
+        "RFCFigura": _s(driver.rfc),
+        "NumLicencia": _s(driver.license_number),
+        "NombreFigura": " ".join(part for part in (driver.name, driver.last_name) if part),
+    })
+    return ET.tostring(root, encoding="unicode")
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:00
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+def populate_route_path(apps, schema_editor):
+    from django.contrib.gis.geos import LineString
+    from polyline import decode as decode_polyline
+
+    Route = apps.get_model('operations_panel', 'Route')
+    routes = Route.objects.filter(path__isnull=True, optimized_route__isnull=False).only('id', 'optimized_route')
+    for route in routes.iterator(chunk_size=500):
+        points = (route.optimized_route or {}).get('overview_polyline', {}).get('points')
+        if not points:
+            continue
+        coords = [(lng, lat) for lat, lng in decode_polyline(points)]
+        if len(coords) < 2:
+            continue
+        Route.objects.filter(pk=route.pk).update(path=LineString(coords, srid=4326))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations_panel', '0009_address_old_id_cargo_old_id_client_old_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326, verbose_name='Ubicación'),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='path',
+            field=django.contrib.gis.db.models.fields.LineStringField(blank=True, geography=True, null=True, srid=4326, verbose_name='Trazo de la ruta'),
+        ),
+        migrations.RunSQL(
+            sql=(
+                "UPDATE operations_panel_address "
+                "SET point = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography "
+                "WHERE latitude IS NOT NULL AND longitude IS NOT NULL;"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(populate_route_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:30
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+def compact_optimized_routes(apps, schema_editor):
+    Route = apps.get_model('operations_panel', 'Route')
+    RoutePayload = apps.get_model('operations_panel', 'RoutePayload')
+
+    routes = Route.objects.filter(optimized_route__isnull=False).only('id', 'optimized_route')
+    for route in routes.iterator(chunk_size=200):
+        data = route.optimized_route or {}
+        legs = [
+            {
+                'distance': leg.get('distance', {}).get('value', 0),
+                'duration': leg.get('duration', {}).get('value', 0),
+            }
+            for leg in data.get('legs', [])
+        ]
+        Route.objects.filter(pk=route.pk).update(
+            overview_polyline=data.get('overview_polyline', {}).get('points'),
+            legs=legs,
+            waypoint_order=list(data.get('waypoint_order', [])),
+        )
+        RoutePayload.objects.update_or_create(route_id=route.pk, defaults={'data': data})
+
+
+def expand_optimized_routes(apps, schema_editor):
+    Route = apps.get_model('operations_panel', 'Route')
+    RoutePayload = apps.get_model('operations_panel', 'RoutePayload')
+
+    for payload in RoutePayload.objects.all().iterator(chunk_size=200):
+        Route.objects.filter(pk=payload.route_id).update(optimized_route=payload.data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations_panel', '0010_address_point_route_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='overview_polyline',
+            field=models.TextField(blank=True, null=True, verbose_name='Polyline de la ruta (codificada)'),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='legs',
+            field=models.JSONField(blank=True, null=True, verbose_name='Tramos (distancia en m / duración en s)'),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='waypoint_order',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(), blank=True, null=True, size=None, verbose_name='Orden optimizado de las paradas'),
+        ),
+        migrations.CreateModel(
+            name='RoutePayload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('data', models.JSONField(verbose_name='Respuesta de Google Directions')),
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payload', to='operations_panel.route', verbose_name='Ruta')),
+            ],
+            options={
+                'verbose_name': 'Respuesta de ruta',
+                'verbose_name_plural': 'Respuestas de rutas',
+            },
+        ),
+        migrations.RunPython(compact_optimized_routes, expand_optimized_routes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations_panel', '0011_route_compact_optimized_route'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='route',
+            name='optimized_route',
+        ),
+    ]
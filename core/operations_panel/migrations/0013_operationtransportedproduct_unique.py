@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+def remove_duplicate_assignments(apps, schema_editor):
+    # Conserva la asignación más reciente por (operación, producto) antes de crear la restricción
+    OperationTransportedProduct = apps.get_model('operations_panel', 'OperationTransportedProduct')
+    seen = set()
+    duplicates = []
+    rows = OperationTransportedProduct.objects.order_by('-created_at').values_list(
+        'id', 'operation_id', 'transported_product_id'
+    )
+    for pk, operation_id, product_id in rows.iterator(chunk_size=2000):
+        key = (operation_id, product_id)
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    for start in range(0, len(duplicates), 1000):
+        OperationTransportedProduct.objects.filter(pk__in=duplicates[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations_panel', '0012_remove_route_optimized_route'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_assignments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='operationtransportedproduct',
+            constraint=models.UniqueConstraint(fields=('operation', 'transported_product'), name='unique_operation_transported_product'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:30
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations_panel', '0013_operationtransportedproduct_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolioCounter',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('series', models.CharField(max_length=50, verbose_name='Serie')),
+                ('year', models.PositiveIntegerField(verbose_name='Año')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Último número asignado')),
+            ],
+            options={
+                'verbose_name': 'Contador de folios',
+                'verbose_name_plural': 'Contadores de folios',
+                'ordering': ['-created_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='foliocounter',
+            constraint=models.UniqueConstraint(fields=('series', 'year'), name='unique_folio_counter_series_year'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:00
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_readiness(apps, schema_editor):
+    from core.operations_panel.services import OPERATION_READINESS_COLUMNS, operation_readiness
+
+    Operation = apps.get_model('operations_panel', 'Operation')
+    rows = (
+        Operation.objects.annotate(products_amount=Count('transported_products'))
+        .values('pk', 'products_amount', *OPERATION_READINESS_COLUMNS)
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        ready, missing = operation_readiness(row)
+        batch.append(Operation(pk=row['pk'], ready_for_invoicing=ready, missing_items=missing))
+        if len(batch) >= 2000:
+            Operation.objects.bulk_update(batch, ['ready_for_invoicing', 'missing_items'])
+            batch = []
+    Operation.objects.bulk_update(batch, ['ready_for_invoicing', 'missing_items'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations_panel', '0014_foliocounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operation',
+            name='ready_for_invoicing',
+            field=models.BooleanField(default=False, editable=False, verbose_name='¿Lista para facturar?'),
+        ),
+        migrations.AddField(
+            model_name='operation',
+            name='missing_items',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=30), blank=True, default=list, editable=False, size=None, verbose_name='Faltantes'),
+        ),
+        migrations.RunPython(populate_readiness, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(condition=models.Q(('folio__isnull', True), ('ready_for_invoicing', True)), fields=['-operation_date'], name='op_ready_without_folio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(condition=models.Q(('is_packing_ready', False), ('ready_for_invoicing', True)), fields=['status'], name='op_ready_packing_open_idx'),
+        ),
+    ]
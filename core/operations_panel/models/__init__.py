@@ -3,8 +3,9 @@ from core.operations_panel.models.cargo import Cargo
 from core.operations_panel.models.client import Client
 from core.operations_panel.models.delivery_location import DeliveryLocation
 from core.operations_panel.models.driver import Driver
+from core.operations_panel.models.folio_counter import FolioCounter
 from core.operations_panel.models.operation import Operation
-from core.operations_panel.models.route import Route
+from core.operations_panel.models.route import Route, RoutePayload
 from core.operations_panel.models.supplier import Supplier
 from core.operations_panel.models.transported_product import TransportedProduct
 from core.operations_panel.models.vehicle import Vehicle
@@ -20,7 +21,9 @@ __all__ = [
     'Driver',
     'Vehicle',
     'Operation',
+    'FolioCounter',
     'TransportedProduct',
     'Cargo',
     'Route',
+    'RoutePayload',
 ]
\ No newline at end of file
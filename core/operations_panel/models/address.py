@@ -1,12 +1,9 @@
-import urllib
-
 import requests
-from django.conf import settings
-from django.db import models
+from django.contrib.gis.db import models
 from geopy.distance import geodesic
 
 from core.operations_panel.choices import MEXICAN_STATES
-from core.operations_panel.services import build_address_string
+from core.operations_panel.services import build_address_string, geocode_address_string, make_point
 from core.system.models import BaseModel
 from ikigai2025.settings import GOOGLE_MAPS_API_KEY
 
@@ -24,30 +21,40 @@ class Address(BaseModel):
     latitude = models.FloatField(null=True, blank=True, verbose_name="Latitud")
     longitude = models.FloatField(null=True, blank=True, verbose_name="Longitud")
 
+    # Se mantiene sincronizado con latitude/longitude en save(); indexado con GiST
+    point = models.PointField(srid=4326, geography=True, null=True, blank=True, verbose_name="Ubicación")
+
+    def save(self, *args, **kwargs):
+        self.point = make_point(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and ({"latitude", "longitude"} & set(update_fields)):
+            kwargs["update_fields"] = set(update_fields) | {"point"}
+        super().save(*args, **kwargs)
+
+    # Columnas que usa __str__; permite formatear direcciones desde .values() sin instanciar
+    DISPLAY_FIELDS = ("street", "exterior_number", "interior_number", "colony", "city", "state", "zip_code")
+
     def __str__(self):
-        parts = [self.street, f"No. {self.exterior_number}"]
-        if self.interior_number:
-            parts.append(f"Int. {self.interior_number}")
-        parts += [self.colony, self.city, self.state, f"C.P. {self.zip_code}"]
+        return Address.format_display(**{field: getattr(self, field) for field in Address.DISPLAY_FIELDS})
+
+    @staticmethod
+    def format_display(street, exterior_number, interior_number, colony, city, state, zip_code):
+        parts = [street, f"No. {exterior_number}"]
+        if interior_number:
+            parts.append(f"Int. {interior_number}")
+        parts += [colony, city, state, f"C.P. {zip_code}"]
         return ", ".join(filter(None, parts))
 
     def get_coords_from_address(self):
         # Construye una dirección completa
         full_address = build_address_string(self)
-        api_key = settings.GOOGLE_MAPS_API_KEY
-        direccion_codificada = urllib.parse.quote(full_address)
-        url = f"https://maps.googleapis.com/maps/api/geocode/json?address={direccion_codificada}&key={api_key}"
-        response = requests.get(url).json()
+        coords = geocode_address_string(full_address)
 
-        if response['status'] == 'OK':
-            location = response['results'][0]['geometry']['location']
-            self.latitude = location['lat']
-            self.longitude = location['lng']
+        if coords:
+            self.latitude, self.longitude = coords
             self.save()
             return (self.latitude, self.longitude)
-        else:
-            print(f"Google Maps error: {response.get('error_message')}")
-            return None
+        return None
 
     def get_coords_from_cp(self):
         # Obtener la API key desde settings o env
@@ -1,3 +1,5 @@
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
 from django.db import models
 
 from core.operations_panel.models.address import Address
@@ -45,6 +47,33 @@ class DeliveryLocation(BaseModel):
             address=address
         )
 
+    @staticmethod
+    def nearest(point, limit=5):
+        """
+        Regresa las `limit` ubicaciones más cercanas a `point`, anotadas con `distance`.
+        El ordenamiento se resuelve en la base de datos usando el índice espacial.
+        """
+        return (
+            DeliveryLocation.objects
+            .filter(address__point__isnull=False)
+            .select_related("address")
+            .annotate(distance=Distance("address__point", point))
+            .order_by("distance")[:limit]
+        )
+
+    @staticmethod
+    def within_km(point, km):
+        """
+        Regresa las ubicaciones a menos de `km` kilómetros de `point`, de la más cercana a la más lejana.
+        """
+        return (
+            DeliveryLocation.objects
+            .filter(address__point__dwithin=(point, D(km=km)))
+            .select_related("address")
+            .annotate(distance=Distance("address__point", point))
+            .order_by("distance")
+        )
+
     def generate_address_cartaporte(self):
         data = {
             'Calle': self.address.street or "Sin calle",
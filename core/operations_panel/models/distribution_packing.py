@@ -4,6 +4,7 @@ from packaging.utils import _
 from core.operations_panel.models.operation import Operation
 
 from core.operations_panel.models.delivery_location import DeliveryLocation
+from core.operations_panel.models.transported_product import TransportedProduct
 
 from core.operations_panel.choices import AsturianoPacking
 from core.system.models import BaseModel
@@ -33,3 +34,92 @@ class DistributionPacking(BaseModel):
     weight = models.FloatField(verbose_name="Peso en Kg")
     amount = models.IntegerField(verbose_name="Cantidad")
 
+
+    DEFAULT_WEIGHT = 300
+    DEFAULT_AMOUNT = 1
+
+    @staticmethod
+    def ensure_for_deliveries(operation, delivery_ids):
+        """
+        Crea (en un solo INSERT) el packing por defecto de las entregas que aún no lo tienen.
+        """
+        existing = set(
+            DistributionPacking.objects.filter(operation=operation).values_list("delivery_shop_id", flat=True)
+        )
+        DistributionPacking.objects.bulk_create([
+            DistributionPacking(
+                operation=operation,
+                delivery_shop_id=delivery_id,
+                distribution=AsturianoPacking.CVZ_AB,
+                weight=DistributionPacking.DEFAULT_WEIGHT,
+                amount=DistributionPacking.DEFAULT_AMOUNT,
+            )
+            for delivery_id in delivery_ids if delivery_id not in existing
+        ])
+
+    @staticmethod
+    def apply_allocations(assignments):
+        """
+        Persiste el resultado de services.split_packing comparándolo con lo que ya existe.
+        `assignments` es una lista de (operación, distribución, [PackingAllocation]).
+        Solo se actualizan las filas que cambiaron, se insertan las nuevas y se borran las sobrantes:
+        una consulta de lectura más un bulk_create, un bulk_update y un delete.
+        """
+        operations = [operation for operation, _distribution, _rows in assignments]
+        current = {}
+        leftovers = []
+        for packing in DistributionPacking.objects.filter(operation__in=operations):
+            key = (packing.operation_id, packing.delivery_shop_id)
+            if key in current:
+                leftovers.append(packing.pk)
+            else:
+                current[key] = packing
+
+        to_create, to_update = [], []
+        for operation, distribution, rows in assignments:
+            for row in rows:
+                packing = current.pop((operation.pk, row.delivery_id), None)
+                if packing is None:
+                    to_create.append(DistributionPacking(
+                        operation=operation,
+                        delivery_shop_id=row.delivery_id,
+                        distribution=distribution,
+                        weight=row.weight,
+                        amount=row.amount,
+                    ))
+                elif (packing.distribution, packing.weight, packing.amount) != (distribution, row.weight, row.amount):
+                    packing.distribution, packing.weight, packing.amount = distribution, row.weight, row.amount
+                    to_update.append(packing)
+
+        leftovers.extend(packing.pk for packing in current.values())
+        if leftovers:
+            DistributionPacking.objects.filter(pk__in=leftovers).delete()
+        DistributionPacking.objects.bulk_create(to_create)
+        DistributionPacking.objects.bulk_update(to_update, ["distribution", "weight", "amount"])
+
+    @staticmethod
+    def rebuild_products(operation, rows, base_product, description=None):
+        """
+        Reemplaza los productos transportados de la operación por una copia de `base_product`
+        por cada asignación, con su peso y cantidad.
+        """
+        products = [
+            TransportedProduct(
+                transported_product_key=base_product.transported_product_key,
+                unit_key=base_product.unit_key,
+                description=description or base_product.description,
+                currency=base_product.currency,
+                is_danger=base_product.is_danger,
+                weight=row.weight,
+                amount=row.amount,
+            )
+            for row in rows
+        ]
+        through = Operation.transported_products.through
+        operation.transported_products.clear()
+        TransportedProduct.objects.bulk_create(products)
+        through.objects.bulk_create(
+            [through(operation_id=operation.pk, transportedproduct_id=product.pk) for product in products]
+        )
+        # bulk_create no dispara m2m_changed
+        Operation.refresh_readiness([operation.pk])
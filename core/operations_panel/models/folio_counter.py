@@ -0,0 +1,56 @@
+from django.db import connection, models
+
+from core.system.models import BaseModel
+
+
+class FolioCounter(BaseModel):
+    """
+    Contador de folios por serie y año. Cada reserva incrementa la fila con un solo UPDATE ... RETURNING,
+    así que Postgres serializa las reservas concurrentes con el bloqueo de la fila y no hay números repetidos.
+    """
+    series = models.CharField(max_length=50, verbose_name="Serie")
+    year = models.PositiveIntegerField(verbose_name="Año")
+    last_number = models.PositiveIntegerField(default=0, verbose_name="Último número asignado")
+
+    def __str__(self):
+        return f"{self.series} {self.year}: {self.last_number}"
+
+    class Meta(BaseModel.Meta):
+        verbose_name = "Contador de folios"
+        verbose_name_plural = "Contadores de folios"
+        constraints = [
+            models.UniqueConstraint(fields=["series", "year"], name="unique_folio_counter_series_year"),
+        ]
+
+    @staticmethod
+    def _increment(series, year, count):
+        opts = FolioCounter._meta
+        last_number = opts.get_field("last_number").column
+        sql = (
+            f'UPDATE "{opts.db_table}" SET "{last_number}" = "{last_number}" + %s, '
+            f'"{opts.get_field("updated_at").column}" = NOW() '
+            f'WHERE "{opts.get_field("series").column}" = %s AND "{opts.get_field("year").column}" = %s '
+            f'RETURNING "{last_number}"'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [count, series, year])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def reserve(series, year, count=1, initial=None):
+        """
+        Reserva `count` números consecutivos de la serie/año en una sola consulta y los regresa en orden.
+        `initial` es un callable opcional que da el último número ya usado cuando la fila aún no existe
+        (por ejemplo, el máximo folio guardado antes de tener contador).
+        """
+        if count < 1:
+            return []
+        last = FolioCounter._increment(series, year, count)
+        if last is None:
+            # Primera reserva de la serie/año: get_or_create resuelve la carrera de dos inserciones simultáneas
+            FolioCounter.objects.get_or_create(
+                series=series, year=year, defaults={"last_number": initial() if initial else 0}
+            )
+            last = FolioCounter._increment(series, year, count)
+        return list(range(last - count + 1, last + 1))
@@ -1,6 +1,9 @@
 import re
+from collections import defaultdict
 from datetime import datetime, time
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.db import models, transaction
+from django.db.models import Count, Q
 from packaging.utils import _
 from core.operations_panel.models.client import Client
 from core.operations_panel.models.supplier import Supplier
@@ -9,8 +12,13 @@ from core.operations_panel.models.vehicle import Vehicle
 from django.utils.timezone import now, make_aware
 from apps.google_drive.models import GoogleDriveFile, GoogleDriveFolder
 from core.operations_panel.choices import UnitType, ShipmentType, OperationStatus
+from core.operations_panel.models.address import Address
 from core.operations_panel.models.route import Route
 from core.operations_panel.models.cargo import Cargo
+from core.operations_panel.models.folio_counter import FolioCounter
+from core.operations_panel.services import (
+    OPERATION_MISSING_ITEMS, OPERATION_READINESS_COLUMNS, operation_readiness,
+)
 from core.operations_panel.models.transported_product import TransportedProduct
 from core.system.models import BaseModel
 
@@ -56,6 +64,11 @@ class Operation(BaseModel):
     is_rent = models.BooleanField(_("¿Es renta?"), default=False)
     is_packing_ready = models.BooleanField(_("¿Esta listo el packing?"), default=False)
 
+    # Valores derivados; los mantiene Operation.refresh_readiness / save()
+    ready_for_invoicing = models.BooleanField(_("¿Lista para facturar?"), default=False, editable=False)
+    missing_items = ArrayField(models.CharField(max_length=30), verbose_name=_("Faltantes"), default=list,
+                               blank=True, editable=False)
+
     cargo_appointment = models.DateTimeField(_("Cita de carga"), null=True, blank=True)
     download_appointment = models.DateTimeField(_("Cita de descarga"), null=True, blank=True)
     scheduled_departure_time = models.DateTimeField(_("Hora estimada de salida"), null=True, blank=True)
@@ -104,8 +117,48 @@ class Operation(BaseModel):
         self.route.route_stops.add(location)
 
     def save(self, *args, **kwargs):
+        products_amount = self.transported_products.count() if self.pk and not self._state.adding else 0
+        self.apply_readiness(products_amount)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "ready_for_invoicing", "missing_items"}
         super().save(*args, **kwargs)  # Primero guarda la operación
 
+    def apply_readiness(self, products_amount):
+        """
+        Calcula en memoria ready_for_invoicing y missing_items a partir de los campos de la instancia.
+        """
+        row = {column: getattr(self, column) for column in OPERATION_READINESS_COLUMNS}
+        row["products_amount"] = products_amount
+        self.ready_for_invoicing, self.missing_items = operation_readiness(row)
+
+    @staticmethod
+    def refresh_readiness(operation_ids):
+        """
+        Recalcula los campos de preparación de las operaciones dadas en un número fijo de consultas
+        (una lectura con .values() + Count y un bulk_update solo de las que cambiaron).
+        Se llama cuando cambia algo que no pasa por save(): productos, conductores, vehículos, rutas.
+        """
+        rows = (
+            Operation.objects.filter(pk__in=list(operation_ids))
+            .annotate(products_amount=Count("transported_products"))
+            .values("pk", "ready_for_invoicing", "missing_items", "products_amount", *OPERATION_READINESS_COLUMNS)
+        )
+        changed = []
+        for row in rows:
+            ready, missing = operation_readiness(row)
+            if (ready, missing) != (row["ready_for_invoicing"], row["missing_items"]):
+                changed.append(Operation(pk=row["pk"], ready_for_invoicing=ready, missing_items=missing))
+        Operation.objects.bulk_update(changed, ["ready_for_invoicing", "missing_items"], batch_size=1000)
+        return len(changed)
+
+    @staticmethod
+    def passing_near(point, km):
+        """
+        Operaciones cuya ruta pasa a menos de `km` kilómetros de `point`.
+        """
+        return Operation.objects.filter(route__in=Route.passing_near(point, km).values("pk"))
+
     def __str__(self):
         return f"Operación {self.folio or self.pre_folio or self.id}"
 
@@ -122,57 +175,88 @@ class Operation(BaseModel):
         result["deliveries"] = ", ".join(str(route) for route in self.route.route_stops.all()) if self.route.route_stops else "[]"
         return result
 
-    def get_operation_missing_items(self):
-        missing_items = {}
+    # Llaves relacionadas de to_operations_view: columnas a proyectar y cómo formatearlas (igual que __str__)
+    OPERATIONS_VIEW_RELATED = {
+        "client": (("client__name",), lambda r: r["client__name"]),
+        "supplier": (("supplier__business_name", "supplier__code"),
+                     lambda r: f"{r['supplier__business_name']} ({r['supplier__code']})"),
+        "driver": (("driver__name", "driver__last_name", "driver__mother_last_name"),
+                   lambda r: f"{r['driver__name']} {r['driver__last_name']} {r['driver__mother_last_name']}"),
+        "vehicle": (("vehicle__econ_number", "vehicle__license_plate"),
+                    lambda r: f"{r['vehicle__econ_number']} - {r['vehicle__license_plate']}"),
+        "vehicle_box": (("vehicle_box__econ_number", "vehicle_box__license_plate"),
+                        lambda r: f"{r['vehicle_box__econ_number']} - {r['vehicle_box__license_plate']}"),
+        "route": (("route__initial_location__name", "route__destination_location__name"),
+                  lambda r: f"{r['route__initial_location__name']} - {r['route__destination_location__name']}"),
+    }
 
-        # Check for missing basic information
-        basic_info = []
-        if not self.client:
-            basic_info.append("Cliente")
-        if not self.operation_date:
-            basic_info.append("Fecha de operación")
-        if not self.shipment_type:
-            basic_info.append("Tipo de embarque")
-
-        if basic_info:
-            missing_items["información_básica"] = basic_info
-
-        # Check for missing logistics information
-        logistics_info = []
-        if not self.supplier:
-            logistics_info.append("Proveedor")
-        if not self.driver:
-            logistics_info.append("Operador")
-        if not self.vehicle:
-            logistics_info.append("Vehículo")
-        if not self.vehicle_type:
-            logistics_info.append("Tipo de unidad")
-
-        if logistics_info:
-            missing_items["información_logística"] = logistics_info
-
-        # Check for missing appointment information
-        appointment_info = []
-        if not self.cargo_appointment:
-            appointment_info.append("Cita de carga")
-        if not self.download_appointment:
-            appointment_info.append("Cita de descarga")
-        if not self.scheduled_departure_time:
-            appointment_info.append("Hora estimada de salida")
-
-        if appointment_info:
-            missing_items["citas"] = appointment_info
-
-        # Check for missing document information
-        document_info = []
-        if self.need_cartaporte and not self.shipment_invoice:
-            document_info.append("Carta porte")
-        if not self.folio:
-            document_info.append("Folio")
+    @staticmethod
+    def to_operations_view_rows(queryset, keys=None):
+        """
+        Equivalente a [op.to_operations_view(keys) for op in queryset] en un número fijo de consultas:
+        una proyección con .values() + Count de productos y otra para las paradas de las rutas.
+        """
+        keys = list(keys or [])
+        concrete = {f.name for f in Operation._meta.concrete_fields if not f.is_relation}
+        origin = [f"route__initial_location__address__{f}" for f in Address.DISPLAY_FIELDS]
+        destination = [f"route__destination_location__address__{f}" for f in Address.DISPLAY_FIELDS]
+
+        fields = {"id", "shipment_invoice_id", "is_packing_ready", "shipment_type", "route__direct_distance",
+                  "route__initial_location__address", "route__destination_location__address",
+                  "products_amount", "ready_for_invoicing", *origin, *destination}
+        for key in keys:
+            if key in concrete:
+                fields.add(key)
+            elif key in Operation.OPERATIONS_VIEW_RELATED:
+                fields.update(Operation.OPERATIONS_VIEW_RELATED[key][0])
+                fields.add(f"{key}_id")
+
+        rows = list(
+            queryset.annotate(products_amount=Count("transported_products", distinct=True)).values(*fields)
+        )
 
-        if document_info:
-            missing_items["documentos"] = document_info
+        stops = defaultdict(list)
+        route_ids = {row["route_id"] for row in rows if row["route_id"]}
+        if route_ids:
+            through = Route.route_stops.through.objects.filter(route_id__in=route_ids).order_by("id")
+            for route_id, name in through.values_list("route_id", "deliverylocation__name"):
+                stops[route_id].append(name)
+
+        def address(row, prefix, fields):
+            if not row[prefix]:
+                return ""
+            return Address.format_display(**{f: row[column] for f, column in zip(Address.DISPLAY_FIELDS, fields)})
+
+        data = []
+        for row in rows:
+            result = {}
+            for key in keys:
+                if key in concrete:
+                    result[key] = row[key]
+                elif key in Operation.OPERATIONS_VIEW_RELATED:
+                    result[key] = Operation.OPERATIONS_VIEW_RELATED[key][1](row) if row[f"{key}_id"] else ""
+            result["id"] = str(row["id"])
+            result["is_invoice_ready"] = str(row["shipment_invoice_id"] is not None)
+            result["is_ready_to_invoice"] = str(row["ready_for_invoicing"])
+            result["is_packing_ready"] = str(row["is_packing_ready"])
+            result["products_amount"] = str(row["products_amount"])
+            result["distance"] = str(row["route__direct_distance"]) if row["route_id"] else "0"
+            result["shipment_type"] = row["shipment_type"]
+            result["origin"] = address(row, "route__initial_location__address", origin)
+            result["destination"] = address(row, "route__destination_location__address", destination)
+            result["deliveries"] = ", ".join(stops[row["route_id"]]) if row["route_id"] else "[]"
+            data.append(result)
+        return data
 
+    def get_operation_missing_items(self):
+        """
+        Faltantes agrupados por categoría, leídos de la columna missing_items (sin consultas).
+        """
+        stored = set(self.missing_items or [])
+        missing_items = {}
+        for code, category, label, _present in OPERATION_MISSING_ITEMS:
+            if code in stored:
+                missing_items.setdefault(category, []).append(label)
         return missing_items
 
     def format_missing_items(self, missing_items):
@@ -208,36 +292,22 @@ class Operation(BaseModel):
     def is_ready_for_invoicing(self):
         """
         Verifica si la operación tiene toda la información necesaria para ser facturada.
+        Lee la columna desnormalizada; ver apply_readiness / refresh_readiness.
         """
-        required_fields = [
-            self.client,
-            self.driver,
-            self.vehicle,
-            self.cargo_appointment,
-            self.download_appointment,
-            self.scheduled_departure_time,
-            self.route,
-        ]
-
-        # Verifica que todos los campos requeridos estén presentes (no sean None o False)
-        if not all(required_fields):
-            return False
-
-        if not self.need_cartaporte:
-            return False
-
-        # Verifica que haya al menos un producto transportado asociado
-        has_products = self.transported_products.exists()
-        if not has_products:
-            return False
+        return self.ready_for_invoicing
 
-        return True
+    FOLIO_SERIES = "OPERATION"
 
     @staticmethod
-    def generate_pre_folio():
-        current_year = now().year
-        prefix = chr(65 + (current_year - 2020))  # 2020 = A, ..., 2025 = F, etc.
+    def folio_prefix(year):
+        return chr(65 + (year - 2020))  # 2020 = A, ..., 2025 = F, etc.
 
+    @staticmethod
+    def max_folio_number(prefix):
+        """
+        Último número usado como folio o pre-folio con el prefijo dado. Solo se usa para inicializar
+        el contador de la serie la primera vez.
+        """
         max_folio = (
             Operation.objects
             .filter(folio__startswith=prefix)
@@ -258,26 +328,70 @@ class Operation(BaseModel):
             match = re.match(r'^[A-Z](\d{4})', value)
             return int(match.group(1)) if match else 0
 
-        folio_number = extract_number(max_folio)
-        prefolio_number = extract_number(max_prefolio)
+        return max(extract_number(max_folio), extract_number(max_prefolio))
 
-        next_number = max(folio_number, prefolio_number) + 1
-        return f"{prefix}{str(next_number).zfill(4)}"
+    @staticmethod
+    def reserve_pre_folios(count):
+        """
+        Reserva `count` pre-folios consecutivos del año en curso en una sola consulta al contador.
+        """
+        year = now().year
+        prefix = Operation.folio_prefix(year)
+        numbers = FolioCounter.reserve(
+            Operation.FOLIO_SERIES, year, count, initial=lambda: Operation.max_folio_number(prefix)
+        )
+        return [f"{prefix}{str(number).zfill(4)}" for number in numbers]
+
+    @staticmethod
+    def generate_pre_folio():
+        return Operation.reserve_pre_folios(1)[0]
 
     def approve(self):
         """
         Approve the operation and assign a pre-folio.
+        La fila se bloquea para que dos aprobaciones simultáneas no consuman dos pre-folios.
         """
-        if not self.pre_folio:
+        with transaction.atomic():
+            current = Operation.objects.select_for_update().values_list("pre_folio", flat=True).get(pk=self.pk)
+            if current:
+                self.pre_folio = current
+                return self.pre_folio
             self.pre_folio = self.generate_pre_folio()
             self.status = OperationStatus.APPROVED
             self.save(update_fields=['pre_folio', 'status'])
         return self.pre_folio
 
+    @staticmethod
+    def approve_many(operations):
+        """
+        Aprueba varias operaciones reservando todos sus pre-folios en una sola consulta.
+        Regresa {id de operación: pre-folio} de las que se aprobaron en esta llamada.
+        """
+        with transaction.atomic():
+            pending = list(
+                Operation.objects.select_for_update()
+                .filter(pk__in=[operation.pk for operation in operations])
+                .filter(Q(pre_folio__isnull=True) | Q(pre_folio=""))
+                .order_by("created_at")
+            )
+            for operation, pre_folio in zip(pending, Operation.reserve_pre_folios(len(pending))):
+                operation.pre_folio = pre_folio
+                operation.status = OperationStatus.APPROVED
+            Operation.objects.bulk_update(pending, ["pre_folio", "status"])
+        return {operation.pk: operation.pre_folio for operation in pending}
+
     def assign_folio(self):
         if self.pre_folio and not self.folio:
+            # Asignación condicional: si otra petición ya puso el folio, esta no hace nada
+            assigned = (
+                Operation.objects.filter(pk=self.pk)
+                .filter(Q(folio__isnull=True) | Q(folio=""))
+                .update(folio=self.pre_folio)
+            )
+            if not assigned:
+                self.refresh_from_db(fields=['folio'])
+                return self.folio
             self.folio = self.pre_folio
-            self.save(update_fields=['folio'])
 
             # Send notification to Telegram group
             try:
@@ -501,3 +615,11 @@ class Operation(BaseModel):
         verbose_name = "Operación"
         verbose_name_plural = "Operaciones"
         ordering = ['-operation_date', '-created_at']
+        indexes = [
+            # Listas para facturar que aún no tienen folio
+            models.Index(fields=["-operation_date"], name="op_ready_without_folio_idx",
+                         condition=Q(ready_for_invoicing=True, folio__isnull=True)),
+            # Cierre de packings desde Telegram (aprobadas, listas y con packing abierto)
+            models.Index(fields=["status"], name="op_ready_packing_open_idx",
+                         condition=Q(ready_for_invoicing=True, is_packing_ready=False)),
+        ]
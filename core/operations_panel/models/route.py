@@ -1,4 +1,9 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.gis.db import models
+from django.contrib.gis.measure import D
+from django.contrib.postgres.fields import ArrayField
+from django.db import transaction
+from django.db.models import Q
 
 from core.operations_panel.models.delivery_location import DeliveryLocation
 
@@ -59,14 +64,39 @@ class Route(BaseModel):
         verbose_name="Publicada"
     )
 
-    optimized_route = models.JSONField(
+    # Representación compacta de la respuesta de Google Directions (routes[0]).
+    # La respuesta completa se guarda aparte en RoutePayload y se consulta sólo bajo demanda.
+    overview_polyline = models.TextField(
         blank=True,
         null=True,
-        verbose_name="Ruta optimizada"
+        verbose_name="Polyline de la ruta (codificada)"
+    )
+
+    legs = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name="Tramos (distancia en m / duración en s)"
+    )
+
+    waypoint_order = ArrayField(
+        models.PositiveSmallIntegerField(),
+        blank=True,
+        null=True,
+        verbose_name="Orden optimizado de las paradas"
+    )
+
+    # Trazo de la ruta (overview polyline) para consultas espaciales; indexado con GiST
+    path = models.LineStringField(
+        srid=4326,
+        geography=True,
+        blank=True,
+        null=True,
+        verbose_name="Trazo de la ruta"
     )
 
     def save(self, *args, **kwargs):
-        from core.operations_panel.services import calculate_optimized_route
+        from core.operations_panel.services import calculate_optimized_route, compact_route_data, \
+            invalidate_route_map, polyline_to_linestring
         super().save(*args, **kwargs)
 
         if self.initial_location and self.destination_location and self.direct_distance == 0:
@@ -76,15 +106,48 @@ class Route(BaseModel):
                 stops=stops,
                 destination=self.destination_location
             )
-            self.optimized_route = route_data
+            compact = compact_route_data(route_data)
+            self.overview_polyline = compact["overview_polyline"]
+            self.legs = compact["legs"]
+            self.waypoint_order = compact["waypoint_order"]
             self.optimized_distance = optimized_distance / 1000
             self.direct_distance = direct_distance / 1000
+            self.path = polyline_to_linestring(self.overview_polyline)
 
-            super().save(update_fields=["optimized_route", "optimized_distance", "direct_distance"])
+            super().save(update_fields=["overview_polyline", "legs", "waypoint_order", "optimized_distance",
+                                        "direct_distance", "path"])
+
+            if settings.ROUTES_STORE_RAW_PAYLOAD:
+                RoutePayload.objects.update_or_create(route=self, defaults={"data": route_data})
+
+        # Se invalida ya con el trazo nuevo guardado; antes, una petición concurrente volvía a cachear el mapa viejo
+        route_id = self.pk
+        transaction.on_commit(lambda: invalidate_route_map(route_id))
 
     def __str__(self):
         return f"{self.initial_location} - {self.destination_location}"
 
+    @property
+    def raw_route(self):
+        """
+        Respuesta completa de Google (routes[0]). Se consulta bajo demanda; None si no se guardó.
+        """
+        return RoutePayload.objects.filter(route_id=self.pk).values_list("data", flat=True).first()
+
+    @staticmethod
+    def passing_near(point, km):
+        """
+        Rutas cuyo trazo pasa a menos de `km` kilómetros de `point`.
+        Las rutas sin trazo calculado se evalúan por su origen, destino y paradas.
+        """
+        distance = (point, D(km=km))
+        return Route.objects.filter(
+            Q(path__dwithin=distance)
+            | Q(path__isnull=True, initial_location__address__point__dwithin=distance)
+            | Q(path__isnull=True, destination_location__address__point__dwithin=distance)
+            | Q(path__isnull=True, route_stops__address__point__dwithin=distance)
+        ).distinct()
+
     def look_for_route(name):
         if not name:
             return None
@@ -106,3 +169,22 @@ class Route(BaseModel):
         verbose_name_plural = "Rutas"
         ordering = ['-created_at']
 
+
+
+
+class RoutePayload(BaseModel):
+    """
+    Almacén frío con la respuesta completa de Google Directions de una ruta.
+    Se mantiene fuera de la tabla de rutas para que los listados no la carguen.
+    """
+    route = models.OneToOneField(
+        Route,
+        on_delete=models.CASCADE,
+        related_name="payload",
+        verbose_name="Ruta"
+    )
+    data = models.JSONField(verbose_name="Respuesta de Google Directions")
+
+    class Meta:
+        verbose_name = "Respuesta de ruta"
+        verbose_name_plural = "Respuestas de rutas"
@@ -1,5 +1,9 @@
+import csv
+import io
+
 from django.db import models
 
+from core.operations_panel.services import is_hazardous_material
 from core.system.models import BaseModel
 
 class TransportedProduct(BaseModel):
@@ -12,9 +16,49 @@ class TransportedProduct(BaseModel):
     weight = models.FloatField(verbose_name="Peso en Kg")
     amount = models.IntegerField(verbose_name="Cantidad")
 
+    CARGO_CSV_COLUMNS = ("BIENES TRANSPORTADOS", "DESCRIPCION DEL BIEN", "CANTIDAD", "CLAVE SAT", "PESO EN KG")
+
     def __str__(self):
         return self.description
 
+    @staticmethod
+    def parse_cargo_csv(file_data):
+        """
+        Convierte el CSV de la plantilla de carga en instancias sin guardar.
+        Valida todas las filas y regresa (productos, errores); si hay errores no se debe guardar nada.
+        """
+        reader = csv.DictReader(io.StringIO(file_data))
+        missing = [column for column in TransportedProduct.CARGO_CSV_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            return [], [f"Faltan columnas en el archivo: {', '.join(missing)}"]
+
+        products, errors = [], []
+        # La fila 1 es el encabezado
+        for line, row in enumerate(reader, start=2):
+            values = {column: (row.get(column) or "").strip() for column in TransportedProduct.CARGO_CSV_COLUMNS}
+            empty = [column for column, value in values.items() if not value]
+            if empty:
+                errors.append(f"Fila {line}: sin valor en {', '.join(empty)}")
+                continue
+            try:
+                amount = int(values["CANTIDAD"])
+                weight = float(values["PESO EN KG"])
+            except ValueError:
+                errors.append(f"Fila {line}: CANTIDAD y PESO EN KG deben ser numéricos")
+                continue
+
+            key = values["BIENES TRANSPORTADOS"]
+            products.append(TransportedProduct(
+                transported_product_key=key,
+                description=values["DESCRIPCION DEL BIEN"],
+                amount=amount,
+                unit_key=values["CLAVE SAT"],
+                currency=(row.get("MONEDA") or "MXN").strip() or "MXN",
+                weight=weight,
+                is_danger=is_hazardous_material(key),
+            ))
+        return products, errors
+
     class Meta:
         verbose_name = "Producto transportado"
         verbose_name_plural = "Productos transportados"
@@ -37,3 +81,11 @@ class OperationTransportedProduct(BaseModel):
 
     def __str__(self):
         return f"{self.transported_product.description} ({self.amount}x) - {self.operation.folio}"
+
+    class Meta(BaseModel.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["operation", "transported_product"],
+                name="unique_operation_transported_product",
+            ),
+        ]
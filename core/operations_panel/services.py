@@ -1,32 +1,187 @@
+import json
+from collections import namedtuple
+from types import MappingProxyType
+
 import requests
-import folium
 from django.conf import settings
+from django.core.cache import cache
+from django.contrib.gis.geos import LineString, Point
 from polyline import decode as decode_polyline
 
+from core.operations_panel.choices import AsturianoPacking
+
 GOOGLE_MAPS_API_KEY = settings.GOOGLE_MAPS_API_KEY
 
 
-def draw_route_on_map(route_data, output_html='route_map.html'):
+ROUTE_MAP_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+ROUTE_MAP_FORMATS = ("html", "svg")
+
+
+def _load_hazardous_materials():
+    with open(settings.BASE_DIR / "static" / "json" / "material_peligroso.json", encoding="utf-8") as file:
+        return MappingProxyType(json.load(file))
+
+
+# Catálogo SAT de material peligroso, cargado una sola vez y de solo lectura
+HAZARDOUS_MATERIALS = _load_hazardous_materials()
+
+
+def is_hazardous_material(transported_product_key):
+    return (transported_product_key or "").strip() in HAZARDOUS_MATERIALS
+
+
+# Faltantes de una operación: (código guardado en Operation.missing_items, categoría, etiqueta, ¿está presente?)
+OPERATION_MISSING_ITEMS = (
+    ("client", "información_básica", "Cliente", lambda row: row["client_id"]),
+    ("operation_date", "información_básica", "Fecha de operación", lambda row: row["operation_date"]),
+    ("shipment_type", "información_básica", "Tipo de embarque", lambda row: row["shipment_type"]),
+    ("supplier", "información_logística", "Proveedor", lambda row: row["supplier_id"]),
+    ("driver", "información_logística", "Operador", lambda row: row["driver_id"]),
+    ("vehicle", "información_logística", "Vehículo", lambda row: row["vehicle_id"]),
+    ("vehicle_type", "información_logística", "Tipo de unidad", lambda row: row["vehicle_type"]),
+    ("cargo_appointment", "citas", "Cita de carga", lambda row: row["cargo_appointment"]),
+    ("download_appointment", "citas", "Cita de descarga", lambda row: row["download_appointment"]),
+    ("scheduled_departure_time", "citas", "Hora estimada de salida", lambda row: row["scheduled_departure_time"]),
+    ("cartaporte", "documentos", "Carta porte", lambda row: not row["need_cartaporte"] or row["shipment_invoice_id"]),
+    ("folio", "documentos", "Folio", lambda row: row["folio"]),
+)
+
+# Columnas que deben tener valor para que la operación esté lista para facturar (además de tener productos)
+OPERATION_READY_FIELDS = ("client_id", "driver_id", "vehicle_id", "cargo_appointment", "download_appointment",
+                          "scheduled_departure_time", "route_id", "need_cartaporte")
+
+# Columnas de Operation que se leen para calcular la preparación
+OPERATION_READINESS_COLUMNS = tuple(sorted(
+    {"client_id", "operation_date", "shipment_type", "supplier_id", "driver_id", "vehicle_id", "vehicle_type",
+     "cargo_appointment", "download_appointment", "scheduled_departure_time", "need_cartaporte",
+     "shipment_invoice_id", "folio", *OPERATION_READY_FIELDS}
+))
+
+
+def operation_readiness(row):
     """
-    Dibuja la ruta en un mapa interactivo usando la polyline de overview.
+    Función pura: a partir de las columnas de OPERATION_READINESS_COLUMNS más "products_amount"
+    regresa (lista para facturar, [códigos faltantes]).
     """
-    overview_polyline = route_data['overview_polyline']['points']
+    missing = [code for code, _category, _label, present in OPERATION_MISSING_ITEMS if not present(row)]
+    ready = all(row[field] for field in OPERATION_READY_FIELDS) and row["products_amount"] > 0
+    return ready, missing
+
+
+PackingAllocation = namedtuple("PackingAllocation", "delivery_id weight amount")
+
+
+def split_packing(rows):
+    """
+    Reparte el packing de una operación por tipo de producto. Función pura: no toca la base de datos.
+
+    `rows` es un iterable de (delivery_id, distribución, peso, cantidad). Una entrega CERVEZA Y ABARROTE
+    genera una asignación con el mismo peso y cantidad en cada tipo; CERVEZA o ABARROTE solo en el suyo.
+    Regresa {AsturianoPacking.AB: [PackingAllocation], AsturianoPacking.CVZ: [PackingAllocation]} respetando
+    el orden de entrada, de modo que por cada tipo la suma de pesos y cantidades es la de sus filas de origen.
+    """
+    targets = {
+        AsturianoPacking.AB: (AsturianoPacking.AB,),
+        AsturianoPacking.CVZ: (AsturianoPacking.CVZ,),
+        AsturianoPacking.CVZ_AB: (AsturianoPacking.AB, AsturianoPacking.CVZ),
+    }
+    allocation = {AsturianoPacking.AB: [], AsturianoPacking.CVZ: []}
+    for delivery_id, distribution, weight, amount in rows:
+        if distribution not in targets:
+            raise ValueError(f"Distribución de packing no válida: {distribution}")
+        for target in targets[distribution]:
+            allocation[target].append(PackingAllocation(delivery_id, weight, amount))
+    return allocation
+
+
+def _route_map_cache_key(route_id, fmt):
+    return f"route_map:{route_id}:{fmt}"
+
+
+def render_route_map_html(overview_polyline, waypoints=None):
+    """
+    Dibuja la ruta en un mapa interactivo (folium) usando la polyline de overview y regresa el HTML.
+    folium se importa aquí para no cargarlo al arrancar los workers.
+    """
+    import folium
+
     coords = decode_polyline(overview_polyline)
 
     # Centrar mapa en el primer punto
-    map_center = coords[0]
-    fmap = folium.Map(location=map_center, zoom_start=13)
+    fmap = folium.Map(location=coords[0], zoom_start=13)
 
     # Añadir línea de ruta
-    folium.PolyLine(coords, color="blue", weight=5, opacity=0.7).add_to(fmap)
+    line = folium.PolyLine(coords, color="blue", weight=5, opacity=0.7).add_to(fmap)
+    fmap.fit_bounds(line.get_bounds())
 
     # Marcadores inicio y fin
     folium.Marker(coords[0], tooltip="Inicio", icon=folium.Icon(color="green")).add_to(fmap)
     folium.Marker(coords[-1], tooltip="Destino", icon=folium.Icon(color="red")).add_to(fmap)
 
-    # Guardar a HTML
-    fmap.save(output_html)
-    print(f"✅ Mapa generado: {output_html}")
+    # Paradas intermedias
+    for waypoint in waypoints or []:
+        if waypoint.get("lat") is None or waypoint.get("lng") is None:
+            continue
+        folium.CircleMarker(
+            (waypoint["lat"], waypoint["lng"]), radius=5, color="orange", fill=True,
+            tooltip=waypoint.get("name", ""),
+        ).add_to(fmap)
+
+    return fmap.get_root().render()
+
+
+def render_route_map_svg(overview_polyline, width=480, height=320, padding=12):
+    """
+    Genera una vista previa estática (SVG) de la ruta, sin dependencias externas.
+    """
+    coords = decode_polyline(overview_polyline)
+    lats = [lat for lat, _ in coords]
+    lngs = [lng for _, lng in coords]
+    min_lat, max_lat = min(lats), max(lats)
+    min_lng, max_lng = min(lngs), max(lngs)
+    span = max(max_lat - min_lat, max_lng - min_lng) or 1e-6
+    scale = min(width - 2 * padding, height - 2 * padding) / span
+
+    def project(lat, lng):
+        return padding + (lng - min_lng) * scale, height - padding - (lat - min_lat) * scale
+
+    points = [project(lat, lng) for lat, lng in coords]
+    path = " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+    (x0, y0), (x1, y1) = points[0], points[-1]
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">'
+        f'<rect width="100%" height="100%" fill="#f8f9fa"/>'
+        f'<polyline points="{path}" fill="none" stroke="#0d6efd" stroke-width="3" '
+        f'stroke-linejoin="round" stroke-linecap="round"/>'
+        f'<circle cx="{x0:.1f}" cy="{y0:.1f}" r="5" fill="#198754"/>'
+        f'<circle cx="{x1:.1f}" cy="{y1:.1f}" r="5" fill="#dc3545"/>'
+        f'</svg>'
+    )
+
+
+def get_route_map(route, fmt="html", waypoints=None):
+    """
+    Regresa el mapa de la ruta en el formato indicado ("html" o "svg"), usando la caché por ruta.
+    """
+    if fmt not in ROUTE_MAP_FORMATS:
+        raise ValueError(f"Formato de mapa no soportado: {fmt}")
+    if not route.overview_polyline:
+        return None
+
+    key = _route_map_cache_key(route.pk, fmt)
+    content = cache.get(key)
+    if content is None:
+        if fmt == "svg":
+            content = render_route_map_svg(route.overview_polyline)
+        else:
+            content = render_route_map_html(route.overview_polyline, waypoints)
+        cache.set(key, content, ROUTE_MAP_CACHE_TIMEOUT)
+    return content
+
+
+def invalidate_route_map(route_id):
+    cache.delete_many([_route_map_cache_key(route_id, fmt) for fmt in ROUTE_MAP_FORMATS])
 
 
 def build_address_string(address):
@@ -34,6 +189,67 @@ def build_address_string(address):
     return ", ".join(filter(None, parts))
 
 
+def geocode_address_string(full_address, timeout=10):
+    """
+    Geocodifica una dirección con la API de Google. Regresa (lat, lng) o None si no hay resultado.
+    """
+    if not GOOGLE_MAPS_API_KEY:
+        raise Exception("Google Maps API key is not set")
+
+    response = requests.get(
+        "https://maps.googleapis.com/maps/api/geocode/json",
+        params={"address": full_address, "key": GOOGLE_MAPS_API_KEY},
+        timeout=timeout,
+    ).json()
+
+    if response.get('status') == 'OK':
+        location = response['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+
+    print(f"Google Maps error ({response.get('status')}): {response.get('error_message')}")
+    return None
+
+
+def make_point(latitude, longitude):
+    """
+    Construye un Point (SRID 4326) a partir de latitud/longitud. Regresa None si falta alguna.
+    """
+    if latitude is None or longitude is None:
+        return None
+    return Point(float(longitude), float(latitude), srid=4326)
+
+
+def polyline_to_linestring(encoded_polyline):
+    """
+    Convierte una polyline codificada de Google en un LineString (SRID 4326).
+    """
+    if not encoded_polyline:
+        return None
+    coords = [(lng, lat) for lat, lng in decode_polyline(encoded_polyline)]
+    if len(coords) < 2:
+        return None
+    return LineString(coords, srid=4326)
+
+
+def compact_route_data(route_data):
+    """
+    Reduce la respuesta de Google (routes[0]) a lo que usa el sistema: polyline de overview,
+    distancia/duración por tramo y orden de las paradas.
+    """
+    route_data = route_data or {}
+    return {
+        "overview_polyline": route_data.get("overview_polyline", {}).get("points"),
+        "legs": [
+            {
+                "distance": leg.get("distance", {}).get("value", 0),
+                "duration": leg.get("duration", {}).get("value", 0),
+            }
+            for leg in route_data.get("legs", [])
+        ],
+        "waypoint_order": list(route_data.get("waypoint_order", [])),
+    }
+
+
 def calculate_optimized_route(origin, stops, destination):
     if not GOOGLE_MAPS_API_KEY:
         raise Exception("Google Maps API key is not set")
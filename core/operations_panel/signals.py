@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from core.operations_panel.models import Driver, Operation, Route, TransportedProduct, Vehicle
+from core.operations_panel.services import invalidate_route_map
+
+
+@receiver(m2m_changed, sender=Operation.transported_products.through)
+def refresh_readiness_on_products(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Agregar o quitar productos cambia si la operación está lista para facturar.
+    Al vaciar desde el producto (product.operations.clear()) pk_set llega vacío, así que las operaciones
+    afectadas se guardan en pre_clear.
+    """
+    if action == "pre_clear" and reverse:
+        instance._readiness_operation_ids = list(
+            Operation.objects.filter(transported_products=instance).values_list("pk", flat=True)
+        )
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        Operation.refresh_readiness([instance.pk])
+    elif action == "post_clear":
+        operation_ids = getattr(instance, "_readiness_operation_ids", [])
+        if operation_ids:
+            Operation.refresh_readiness(operation_ids)
+    elif pk_set:
+        Operation.refresh_readiness(pk_set)
+
+
+def _refresh_after_delete(operation_ids):
+    operation_ids = list(operation_ids)
+    if operation_ids:
+        # El SET_NULL / borrado en cascada ocurre después de pre_delete; se recalcula al confirmar
+        transaction.on_commit(lambda: Operation.refresh_readiness(operation_ids))
+
+
+@receiver(pre_delete, sender=Driver)
+def refresh_readiness_on_driver_delete(sender, instance, **kwargs):
+    _refresh_after_delete(Operation.objects.filter(driver=instance).values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Vehicle)
+def refresh_readiness_on_vehicle_delete(sender, instance, **kwargs):
+    _refresh_after_delete(Operation.objects.filter(vehicle=instance).values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Route)
+def refresh_readiness_on_route_delete(sender, instance, **kwargs):
+    _refresh_after_delete(Operation.objects.filter(route=instance).values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=TransportedProduct)
+def refresh_readiness_on_product_delete(sender, instance, **kwargs):
+    _refresh_after_delete(Operation.objects.filter(transported_products=instance).values_list("pk", flat=True))
+
+
+@receiver(m2m_changed, sender=Route.route_stops.through)
+def invalidate_route_map_on_stops(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Cambiar las paradas cambia el mapa de la ruta. Al vaciar desde la ubicación (reverse clear) pk_set llega
+    vacío, así que las rutas afectadas se guardan en pre_clear.
+    """
+    if action == "pre_clear" and reverse:
+        instance._route_map_stale_ids = list(instance.routes_as_stop.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        route_ids = [instance.pk]
+    elif action == "post_clear":
+        route_ids = getattr(instance, "_route_map_stale_ids", [])
+    else:
+        route_ids = list(pk_set or [])
+    for route_id in route_ids:
+        transaction.on_commit(lambda route_id=route_id: invalidate_route_map(route_id))
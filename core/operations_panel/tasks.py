@@ -0,0 +1,58 @@
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from core.system.enums import JobItemStatus, JobStatus
+from core.system.models import BackgroundJob
+from core.system.services import finish_job_item, run_job
+
+
+@shared_task
+def stamp_cartaporte_job(job_id):
+    """
+    Timbrado masivo de cartaportes. Primero se arman todos los payloads (solo base de datos) y después se
+    envían a FacturAPI en paralelo, con reintentos solo para errores temporales.
+    """
+    from apps.facturapi.client import is_transient_error
+    from apps.facturapi.services import _send_invoice_to_facturapi
+    from core.operations_panel.models.shipment_facturapi_invoice import ShipmentFacturapiInvoice
+
+    job = BackgroundJob.objects.get(pk=job_id)
+    items = list(job.items.filter(status=JobItemStatus.PENDING))
+    invoices = ShipmentFacturapiInvoice.pending_for_operations([item.reference for item in items])
+
+    payloads = {}
+    customer_blocks = {}
+    for item in items:
+        invoice = invoices.get(item.reference)
+        if invoice is None:
+            finish_job_item(item, JobItemStatus.FAILED, "La operación no tiene cartaporte por timbrar")
+            continue
+        if invoice.facturapi_id:
+            finish_job_item(item, JobItemStatus.SKIPPED, "La cartaporte ya estaba timbrada",
+                            {"invoice": str(invoice.pk), "uuid": invoice.uuid})
+            continue
+        try:
+            if not invoice.idempotency_key:
+                invoice.idempotency_key = str(invoice.pk)
+                invoice.save(update_fields=["idempotency_key"])
+            operation = ShipmentFacturapiInvoice.load_operation(item.reference)
+            payloads[item.pk] = (invoice, invoice.facturapi_payload(operation, customer_blocks))
+        except Exception as e:
+            finish_job_item(item, JobItemStatus.FAILED, f"No se pudo armar la cartaporte: {e}")
+
+    def stamp(item):
+        invoice, data = payloads[item.pk]
+        _send_invoice_to_facturapi(invoice, data)
+        invoice.link_to_operation()
+        return {
+            "invoice": str(invoice.pk),
+            "uuid": invoice.uuid,
+            "folio": f"{invoice.series or ''}{invoice.folio_number or ''}",
+        }
+
+    if payloads:
+        run_job(job, stamp, max_workers=settings.FACTURAPI_MAX_CONCURRENCY, is_transient=is_transient_error)
+    else:
+        BackgroundJob.objects.filter(pk=job.pk).update(status=JobStatus.DONE, finished_at=timezone.now())
+    return str(job.id)
@@ -0,0 +1,244 @@
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from core.operations_panel.choices import AsturianoPacking, ShipmentType
+from core.operations_panel.functions import build_cartaporte_xml
+from core.operations_panel.models.address import Address
+from core.operations_panel.models.delivery_location import DeliveryLocation
+from core.operations_panel.models.distribution_packing import DistributionPacking
+from core.operations_panel.models.driver import Driver
+from core.operations_panel.models.folio_counter import FolioCounter
+from core.operations_panel.models.operation import Operation
+from core.operations_panel.models.route import Route
+from core.operations_panel.models.shipment_facturapi_invoice import ShipmentFacturapiInvoice
+from core.operations_panel.models.transported_product import TransportedProduct
+from core.operations_panel.models.vehicle import Vehicle
+from core.operations_panel.services import PackingAllocation, split_packing
+
+TESTDATA_DIR = Path(__file__).resolve().parent / "testdata"
+DISTRIBUTIONS = (AsturianoPacking.AB, AsturianoPacking.CVZ, AsturianoPacking.CVZ_AB)
+GENERATED_CASES = 200
+
+
+def _random_packing_rows(rng, deliveries=None):
+    """
+    Filas (delivery_id, distribución, peso, cantidad) al azar; sin `deliveries` se usan ids sintéticos.
+    """
+    count = rng.randint(0, 25)
+    ids = deliveries or [f"delivery-{index}" for index in range(count)]
+    return [
+        (delivery_id, rng.choice(DISTRIBUTIONS), round(rng.uniform(0, 5000), 2), rng.randint(0, 500))
+        for delivery_id in rng.sample(ids, min(count, len(ids)))
+    ]
+
+
+class SplitPackingTests(SimpleTestCase):
+    def test_generated_rows_keep_weight_amount_and_order(self):
+        rng = random.Random(36)
+        for case in range(GENERATED_CASES):
+            rows = _random_packing_rows(rng)
+            with self.subTest(case=case, rows=rows):
+                allocation = split_packing(rows)
+                self.assertEqual(set(allocation), {AsturianoPacking.AB, AsturianoPacking.CVZ})
+                for target in (AsturianoPacking.AB, AsturianoPacking.CVZ):
+                    expected = [
+                        PackingAllocation(delivery_id, weight, amount)
+                        for delivery_id, distribution, weight, amount in rows
+                        if distribution in (target, AsturianoPacking.CVZ_AB)
+                    ]
+                    # Mismas filas, en el mismo orden: se conservan peso y cantidad por tipo
+                    self.assertEqual(allocation[target], expected)
+                mixed = sum(1 for row in rows if row[1] == AsturianoPacking.CVZ_AB)
+                self.assertEqual(len(allocation[AsturianoPacking.AB]) + len(allocation[AsturianoPacking.CVZ]),
+                                 len(rows) + mixed)
+
+    def test_empty_rows(self):
+        self.assertEqual(split_packing([]), {AsturianoPacking.AB: [], AsturianoPacking.CVZ: []})
+
+    def test_unknown_distribution_raises(self):
+        with self.assertRaises(ValueError):
+            split_packing([("delivery-1", "REFRESCO", 10, 1)])
+
+
+class ApplyAllocationsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operations = [
+            Operation.objects.create(operation_date=date(2026, 1, 1), shipment_type=ShipmentType.ASTURIANO)
+            for _ in range(2)
+        ]
+        address = Address.objects.create(zip_code="76000")
+        cls.deliveries = [
+            DeliveryLocation.objects.create(name=f"Tienda {index}", business_name=f"Tienda {index}",
+                                            rfc="XAXX010101000", address=address)
+            for index in range(8)
+        ]
+
+    def stored(self):
+        return {
+            (packing.operation_id, packing.delivery_shop_id): (packing.distribution, packing.weight, packing.amount)
+            for packing in DistributionPacking.objects.filter(operation__in=self.operations)
+        }
+
+    def test_generated_allocations_are_persisted_by_diff(self):
+        rng = random.Random(3600)
+        delivery_ids = [delivery.pk for delivery in self.deliveries]
+        for case in range(40):
+            assignments, expected = [], {}
+            for operation in self.operations:
+                distribution = rng.choice((AsturianoPacking.AB, AsturianoPacking.CVZ))
+                rows = [PackingAllocation(delivery_id, weight, amount)
+                        for delivery_id, _distribution, weight, amount in _random_packing_rows(rng, delivery_ids)]
+                assignments.append((operation, distribution, rows))
+                expected.update({
+                    (operation.pk, row.delivery_id): (distribution, row.weight, row.amount) for row in rows
+                })
+            with self.subTest(case=case):
+                DistributionPacking.apply_allocations(assignments)
+                self.assertEqual(self.stored(), expected)
+
+                # Repetir la misma asignación no escribe nada: solo la lectura
+                with self.assertNumQueries(1):
+                    DistributionPacking.apply_allocations(assignments)
+                self.assertEqual(self.stored(), expected)
+
+
+class FolioCounterTests(TestCase):
+    def test_batch_reservations_are_consecutive(self):
+        self.assertEqual(FolioCounter.reserve("TEST", 2026, 3), [1, 2, 3])
+        self.assertEqual(FolioCounter.reserve("TEST", 2026, 2), [4, 5])
+        self.assertEqual(FolioCounter.reserve("TEST", 2027), [1])
+        self.assertEqual(FolioCounter.reserve("TEST", 2026, 0), [])
+
+    def test_initial_is_used_only_for_a_new_row(self):
+        self.assertEqual(FolioCounter.reserve("TEST", 2026, 2, initial=lambda: 41), [42, 43])
+        self.assertEqual(FolioCounter.reserve("TEST", 2026, 1, initial=lambda: 900), [44])
+
+    def test_pre_folios_continue_after_existing_folios(self):
+        prefix = Operation.folio_prefix(date.today().year)
+        Operation.objects.create(operation_date=date(2026, 1, 1), shipment_type=ShipmentType.ASTURIANO,
+                                 folio=f"{prefix}0007")
+        first, second = Operation.reserve_pre_folios(2)
+        self.assertTrue(first.startswith(prefix) and second.startswith(prefix))
+        self.assertGreater(first, f"{prefix}0007")
+        self.assertGreater(second, first)
+
+
+class FolioCounterConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    PER_THREAD = 25
+
+    def reserve_concurrently(self, batch):
+        def worker(_):
+            numbers = []
+            try:
+                for _ in range(self.PER_THREAD):
+                    numbers.extend(FolioCounter.reserve("CONCURRENT", 2026, batch))
+            finally:
+                connection.close()
+            return numbers
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            return [number for chunk in executor.map(worker, range(self.THREADS)) for number in chunk]
+
+    def test_concurrent_reservations_never_repeat(self):
+        for batch in (1, 5):
+            FolioCounter.objects.filter(series="CONCURRENT").delete()
+            with self.subTest(batch=batch):
+                numbers = self.reserve_concurrently(batch)
+                expected = self.THREADS * self.PER_THREAD * batch
+                self.assertEqual([number for number, times in Counter(numbers).items() if times > 1], [])
+                self.assertEqual(sorted(numbers), list(range(1, expected + 1)))
+
+
+class ReadinessSignalTests(TestCase):
+    def test_reverse_clear_refreshes_the_affected_operations(self):
+        operations = [
+            Operation.objects.create(operation_date=date(2026, 1, 1), shipment_type=ShipmentType.ASTURIANO)
+            for _ in range(2)
+        ]
+        product = TransportedProduct.objects.create(transported_product_key="01010101", unit_key="H87",
+                                                    description="Producto", weight=10, amount=1)
+        product.operations_transported_products.add(*operations)
+
+        with mock.patch.object(Operation, "refresh_readiness") as refresh:
+            product.operations_transported_products.clear()
+        refresh.assert_called_once()
+        self.assertEqual(set(refresh.call_args.args[0]), {operation.pk for operation in operations})
+
+
+# Datos de la carta porte de referencia (testdata/cartaporte_golden.xml)
+CARTAPORTE_ADDRESSES = {
+    "origin": {"street": "Av. Industrial", "exterior_number": "120", "colony": "Parque Industrial",
+               "state": "Queretaro de Arteaga", "zip_code": "76120"},
+    "stop": {"street": "Calle 5 de Mayo", "exterior_number": "8", "colony": "Centro",
+             "state": "Ciudad de México", "zip_code": "06000"},
+    "destination": {"street": "Av. Constitución", "exterior_number": "400", "colony": "Centro",
+                    "state": "Nuevo Leon", "zip_code": "64000"},
+}
+CARTAPORTE_PRODUCTS = [
+    {"transported_product_key": "50202201", "unit_key": "H87", "description": "CERVEZA LATA 355 ML",
+     "weight": 1250.5, "amount": 120},
+    {"transported_product_key": "10121505", "unit_key": "KGM", "description": "ALIMENTO BALANCEADO",
+     "weight": 300, "amount": 10},
+    {"transported_product_key": "50192100", "unit_key": "XBX", "description": "ABARROTE & BOTANA <MIXTO>",
+     "weight": 80.25, "amount": 4},
+]
+
+
+class CartaPorteXmlTests(SimpleTestCase):
+    """
+    Compara el complemento armado por build_cartaporte_xml con el XML de referencia guardado.
+    Si un cambio del XML es intencional, regenera testdata/cartaporte_golden.xml y revisa el diff.
+    """
+
+    @staticmethod
+    def location(name, address=None):
+        location = DeliveryLocation(name=name, business_name=name, rfc=f"{name[:3].upper()}010101AAA")
+        location.address = Address(**address) if address else None
+        return location
+
+    def build(self):
+        route = Route(name="QRO - MTY", optimized_distance=920)
+        route.initial_location = self.location("Origen", CARTAPORTE_ADDRESSES["origin"])
+        route.destination_location = self.location("Destino", CARTAPORTE_ADDRESSES["destination"])
+        stops = [self.location("Tienda", CARTAPORTE_ADDRESSES["stop"]), self.location("Bodega")]
+
+        operation = Operation(operation_date=date(2026, 3, 2), shipment_type=ShipmentType.ASTURIANO)
+        operation.route = route
+        operation.vehicle = Vehicle(year=2022, vehicle_config="T3S2", license_plate="AB1234C",
+                                    insurance_company="SEGUROS DEL NORTE", insurance_code="POL-778899")
+        operation.vehicle_box = Vehicle(vehicle_config="CTR004", license_plate="9XY8765")
+        operation.driver = Driver(name="Juan", last_name="Pérez", mother_last_name="López", rfc="PELJ800101AB1",
+                                  license_number="QRO123456")
+
+        mexico_city = timezone.get_fixed_timezone(-360)
+        invoice = ShipmentFacturapiInvoice(
+            total_distance_km=920,
+            departure_at=datetime(2026, 3, 2, 6, 30, tzinfo=mexico_city),
+            scheduled_arrival_at=datetime(2026, 3, 2, 18, 45, tzinfo=mexico_city),
+            sct_permit_number="SCT-000123",
+            sct_permit_type="TPAF01",
+            ccp_id="CCCBCD94-870A-4332-A52A-A52AA52AA52A",
+        )
+        products = [TransportedProduct(**product) for product in CARTAPORTE_PRODUCTS]
+        return build_cartaporte_xml(invoice, operation, stops, products)
+
+    def test_matches_golden_file(self):
+        with timezone.override("America/Mexico_City"):
+            xml = self.build()
+        golden = (TESTDATA_DIR / "cartaporte_golden.xml").read_text(encoding="utf-8").strip()
+        self.assertEqual(xml, golden)
+
+    def test_missing_vehicle_is_reported(self):
+        operation = Operation(operation_date=date(2026, 3, 2), shipment_type=ShipmentType.ASTURIANO)
+        with self.assertRaisesMessage(ValueError, "ruta, vehículo, operador"):
+            build_cartaporte_xml(ShipmentFacturapiInvoice(), operation, [], [])
@@ -8,7 +8,7 @@ from core.operations_panel.views.downloads import DownloadShipmentPDF
 from core.operations_panel.views.driver import DriverListView
 from core.operations_panel.views.invoice_facturapi_shipment import InvoiceShipmentIFormView
 from core.operations_panel.views.operation import FolioOperationListView, OperationListView, ShipmentOperationListView
-from core.operations_panel.views.route import RouteListView, RouteMapView
+from core.operations_panel.views.route import RouteListView, RouteMapView, RouteMapRenderView
 from core.operations_panel.views.supplier import SupplierListView
 from core.operations_panel.views.transported_product import TransportedProductListView
 from core.operations_panel.views.vehicle import VehicleListView
@@ -38,6 +38,7 @@ urlpatterns = [
     # Route URLs
     path('routes/', RouteListView.as_view(), name='routes'),
     path('routes/<uuid:route_id>/map/', RouteMapView.as_view(), name='route_map'),
+    path('routes/<uuid:route_id>/map/render/', RouteMapRenderView.as_view(), name='route_map_render'),
 
     # Route URLs
     path('shipments/', ShipmentOperationListView.as_view(), name='shipments'),
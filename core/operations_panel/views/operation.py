@@ -1,5 +1,3 @@
-import csv
-import io
 import json
 from collections import defaultdict
 
@@ -19,9 +17,26 @@ from core.operations_panel.models import Cargo
 from core.operations_panel.models.distribution_packing import DistributionPacking
 from core.operations_panel.models.operation import Operation
 from core.operations_panel.models.route import Route
+from core.operations_panel.models.shipment_facturapi_invoice import ShipmentFacturapiInvoice
 from core.operations_panel.models.transported_product import TransportedProduct, OperationTransportedProduct
+from core.operations_panel.services import split_packing
+from core.system.models import BackgroundJob
 from core.system.views import AdminListView
 
+# Búsqueda y orden de las tablas de operaciones (columnas proyectadas por Operation.to_operations_view_rows)
+OPERATION_SEARCH_FIELDS = ['folio', 'pre_folio', 'client__name', 'driver__name', 'driver__last_name',
+                           'vehicle__econ_number', 'vehicle__license_plate', 'route__name']
+OPERATION_ORDER_FIELDS = {
+    "is_invoice_ready": "shipment_invoice",
+    "is_ready_to_invoice": "ready_for_invoicing",
+    "distance": "route__direct_distance",
+    "origin": "route__initial_location__name",
+    "destination": "route__destination_location__name",
+    "route": "route__initial_location__name",
+    "vehicle": "vehicle__econ_number",
+    "driver": "driver__name",
+}
+
 
 class OperationListView(AdminListView):
     model = Operation
@@ -29,6 +44,8 @@ class OperationListView(AdminListView):
     template_name = 'base/elements/views/datatable_list.html'
     datatable_headers = ["Control vehicular", "Cliente", "Packing", "Lista para fac", "Facturado"]
     datatable_keys = ["folio", "client", "is_packing_ready", "is_ready_to_invoice", "is_invoice_ready"]
+    search_fields = OPERATION_SEARCH_FIELDS
+    datatable_order_fields = OPERATION_ORDER_FIELDS
     datatable_actions = True
     title = model._meta.verbose_name_plural.title()
     form_path = 'base/elements/forms/form.html'
@@ -37,15 +54,8 @@ class OperationListView(AdminListView):
     dropdown_action_path = 'operations_panel/operation/table/actions.js'
     static_path = 'operations_panel/operation/table/base.html'
 
-    def handle_searchdata(self, request, data):
-        """
-        Retorna todos los registros como lista de dicts.
-        """
-        # Obtén los objetos de la tabla (o filtra según tus necesidades)
-        queryset = self.get_queryset()
-        datatable_keys = self.datatable_keys
-        data = [obj.to_operations_view(keys=datatable_keys) for obj in self.get_queryset()]
-        return data
+    def serialize_rows(self, queryset):
+        return Operation.to_operations_view_rows(queryset, keys=self.datatable_keys)
 
     def handle_release(self, request, data):
         pass
@@ -63,6 +73,8 @@ class FolioOperationListView(AdminListView):
                          "Unidad", "Operador", "Status"]
     datatable_keys = ["folio", "operation_date", "need_cartaporte", "client", "route", "deliveries",
                       "vehicle", "driver", "status"]
+    search_fields = OPERATION_SEARCH_FIELDS
+    datatable_order_fields = OPERATION_ORDER_FIELDS
     datatable_actions = True
     title = model._meta.verbose_name_plural.title()
     form_path = 'base/elements/forms/form.html'
@@ -125,15 +137,8 @@ class FolioOperationListView(AdminListView):
             data['error'] = str(e)
         return data
 
-    def handle_searchdata(self, request, data):
-        """
-        Retorna todos los registros como lista de dicts.
-        """
-        # Obtén los objetos de la tabla (o filtra según tus necesidades)
-        queryset = self.get_queryset()
-        datatable_keys = self.datatable_keys
-        data = [obj.to_operations_view(keys=datatable_keys) for obj in self.get_queryset()]
-        return data
+    def serialize_rows(self, queryset):
+        return Operation.to_operations_view_rows(queryset, keys=self.datatable_keys)
 
 
 class ShipmentOperationListView(AdminListView):
@@ -160,6 +165,8 @@ class ShipmentOperationListView(AdminListView):
         "is_ready_to_invoice",
         "is_packing_ready",
     ]
+    search_fields = OPERATION_SEARCH_FIELDS
+    datatable_order_fields = OPERATION_ORDER_FIELDS
     datatable_actions = True
     title = model._meta.verbose_name_plural.title()
     form_path = 'base/elements/forms/form.html'
@@ -189,15 +196,8 @@ class ShipmentOperationListView(AdminListView):
 
         return data
 
-    def handle_searchdata(self, request, data):
-        print(1)
-        """
-        Retorna todos los registros como lista de dicts.
-        """
-        # Obtén los objetos de la tabla (o filtra según tus necesidades)
-        datatable_keys = self.datatable_keys
-        data = [obj.to_operations_view(keys=datatable_keys) for obj in self.get_queryset()]
-        return data
+    def serialize_rows(self, queryset):
+        return Operation.to_operations_view_rows(queryset, keys=self.datatable_keys)
 
     def handle_get_route(self, request, data):
         operation = self.model.objects.get(pk=request.POST.get('id'))
@@ -233,120 +233,89 @@ class ShipmentOperationListView(AdminListView):
                                                products_data)
 
     def handle_update_packing(self, request, data):
-        operation = Operation.objects.get(pk=request.POST.get('id'))
-        querydict = request.POST  # o el QueryDict que compartiste
-        parsed = self.parse_packing_data(querydict)
-        for key, value in parsed.items():
-            dp = DistributionPacking.objects.get(operation=operation, pk=key)
-            dp.weight = value['weight']
-            dp.amount = value['amount']
-            dp.distribution = value['distribution']
-            dp.save()
-        all_packings = DistributionPacking.objects.filter(operation=operation)
-        has_cvz_ab = all_packings.filter(distribution=AsturianoPacking.CVZ_AB).exists()
-        if not has_cvz_ab:
+        operation = get_object_or_404(Operation, pk=request.POST.get('id'))
+        parsed = self.parse_packing_data(request.POST)
+
+        # Valores capturados en el formulario sobre el packing actual (una sola consulta)
+        rows = []
+        for packing in DistributionPacking.objects.filter(operation=operation).order_by("created_at"):
+            values = parsed.get(str(packing.pk))
+            if values:
+                packing.weight = float(values['weight'])
+                packing.amount = int(values['amount'])
+                packing.distribution = values['distribution']
+            rows.append((packing.delivery_shop_id, packing.distribution, packing.weight, packing.amount))
+
+        if not any(distribution == AsturianoPacking.CVZ_AB for _, distribution, _, _ in rows):
             raise Exception("No se puede distribuir el packing si solo se entrega un tipo de producto")
-        # 2.1 Crear una copia de la operación
-        if Operation.objects.filter(folio=operation.folio + "B").exists():
-            pass
-        else:
-            operation.pk = None  # Esto duplica la instancia
-            operation.folio = operation.folio + "B"  # Debes implementar esta función
-            operation.save()
-        cvz_operation = operation
-        ab_operation = Operation.objects.get(pk=request.POST.get('id'))
-        # 3. Reasignar DistributionPacking y TransportedProduct
-        for dp in all_packings:
-            if dp.distribution == AsturianoPacking.CVZ:
-                dp.operation = operation  # Se pasa a la nueva operación
-                dp.save()
-            elif dp.distribution == AsturianoPacking.AB:
-                # Se queda en la original
-                continue
-            elif dp.distribution == AsturianoPacking.CVZ_AB:
-                dp.operation = ab_operation
-                dp.distribution = AsturianoPacking.AB
-                dp.save()
-                dp.pk = None
-                dp.operation = cvz_operation
-                dp.distribution = AsturianoPacking.CVZ
-                dp.save()
-                continue
-        ab_operation = Operation.objects.get(pk=request.POST.get('id'))
-        cvz_operation = Operation.objects.get(folio=ab_operation.folio + "B")
-        ab_packings = DistributionPacking.objects.filter(operation=ab_operation)
-        ab_operation.transported_products.clear()
-        for packing in ab_packings:
-            abarrote_product = TransportedProduct.objects.filter(description="ABARROTES_BASE").first()
-            abarrote_product.pk = None
-            abarrote_product.weight = packing.weight
-            abarrote_product.amount = packing.amount
-            abarrote_product.save()
-            ab_operation.transported_products.add(abarrote_product)
-            ab_operation.save()
-        cvz_packings = DistributionPacking.objects.filter(operation=cvz_operation)
-        cvz_operation.transported_products.clear()
-        for packing in cvz_packings:
-            cerveza_product = TransportedProduct.objects.filter(description="CERVEZA_BASE").first()
-            cerveza_product.pk = None
-            cerveza_product.description = "CERVEZA"
-            cerveza_product.weight = packing.weight
-            cerveza_product.amount = packing.amount
-            cerveza_product.save()
-            cvz_operation.transported_products.add(cerveza_product)
+
+        allocation = split_packing(rows)
+
+        abarrote_product = TransportedProduct.objects.filter(description="ABARROTES_BASE").first()
+        cerveza_product = TransportedProduct.objects.filter(description="CERVEZA_BASE").first()
+        if not abarrote_product or not cerveza_product:
+            raise Exception("No existen los productos base ABARROTES_BASE / CERVEZA_BASE")
+
+        # La cerveza se factura en una copia de la operación con folio terminado en "B"
+        ab_operation = operation
+        cvz_operation = Operation.objects.filter(folio=operation.folio + "B").first()
+        if cvz_operation is None:
+            cvz_operation = Operation.objects.get(pk=operation.pk)
+            cvz_operation.pk = None
+            cvz_operation.folio = operation.folio + "B"
             cvz_operation.save()
 
+        DistributionPacking.apply_allocations([
+            (ab_operation, AsturianoPacking.AB, allocation[AsturianoPacking.AB]),
+            (cvz_operation, AsturianoPacking.CVZ, allocation[AsturianoPacking.CVZ]),
+        ])
+        DistributionPacking.rebuild_products(ab_operation, allocation[AsturianoPacking.AB], abarrote_product)
+        DistributionPacking.rebuild_products(cvz_operation, allocation[AsturianoPacking.CVZ], cerveza_product,
+                                             description="CERVEZA")
+        data['success'] = True
+        return data
+
     def handle_get_packing(self, request, data):
-        context = {}
-        operation = Operation.objects.get(pk=request.POST.get('id'))
-        if not Operation.objects.filter(folio=operation.folio + "B").exists():
-            for delivery in operation.deliveries.all():
-                packing, _ = DistributionPacking.objects.get_or_create(
-                    operation=operation,
-                    delivery_shop=delivery,
-                    defaults={
-                        "distribution": AsturianoPacking.CVZ_AB,
-                        "weight": 300,
-                        "amount": 1,
-                    }
-                )
-        distribution_packings = DistributionPacking.objects.filter(operation=operation)
+        operation = get_object_or_404(Operation, pk=request.POST.get('id'))
+        if operation.route_id and not Operation.objects.filter(folio=operation.folio + "B").exists():
+            DistributionPacking.ensure_for_deliveries(
+                operation, operation.route.route_stops.values_list("pk", flat=True)
+            )
+        distribution_packings = DistributionPacking.objects.filter(operation=operation).select_related("delivery_shop")
         self.form = DistributionPackingForm
         self.form_action = "update_packing"
         data['id'] = str(operation.id)
         data['form'] = self.render_formset(request, distribution_packings, DistributionPackingForm)
 
     def handle_update_cargo(self, request, data):
-        operation = Operation.objects.get(pk=request.POST.get('id'))
+        operation = get_object_or_404(Operation, pk=request.POST.get('id'))
         uploaded_file = request.FILES.get("csv_products")
-        # Decodifica el archivo como texto
-        file_data = uploaded_file.read().decode('utf-8')
-        csv_file = io.StringIO(file_data)
-
-        # Lee el contenido CSV
-        reader = csv.DictReader(csv_file)
-        created = 0
+        if not uploaded_file:
+            data['error'] = "No se recibió el archivo CSV de productos"
+            return data
+
+        # Se valida todo el archivo antes de escribir; los errores de todas las filas se regresan juntos
+        products, errors = TransportedProduct.parse_cargo_csv(uploaded_file.read().decode('utf-8-sig'))
+        if errors:
+            data['error'] = "\n".join(errors)
+            data['errors'] = errors
+            return data
+
+        through = Operation.transported_products.through
         with transaction.atomic():
             operation.transported_products.clear()
-            for row in reader:
-                product = TransportedProduct.objects.create(
-                    transported_product_key=row['BIENES TRANSPORTADOS'].strip(),
-                    description=row['DESCRIPCION DEL BIEN'].strip(),
-                    amount=int(row['CANTIDAD'].strip()),
-                    unit_key=row['CLAVE SAT'].strip(),
-                    currency=row.get('MONEDA', 'MXN').strip(),
-                    weight=float(row['PESO EN KG'].strip()),
-                )
-                with open('static/json/material_peligroso.json') as file:
-                    data = json.load(file)
-                if product.transported_product_key in data:
-                    product.is_danger = True
-                else:
-                    product.is_danger = False
-                product.save()
-                # Enlaza a la operación (asumiendo que recibiste `operation_id` o similar)
-                operation.transported_products.add(product)
-                created += 1
+            TransportedProduct.objects.bulk_create(products, batch_size=1000)
+            through.objects.bulk_create(
+                [through(operation_id=operation.pk, transportedproduct_id=product.pk) for product in products],
+                batch_size=1000,
+            )
+            # bulk_create no dispara m2m_changed
+            Operation.refresh_readiness([operation.pk])
+
+        data['success'] = True
+        data['created'] = len(products)
+        data['message'] = f"{len(products)} productos cargados"
+        return data
 
     def handle_confirm(self, request, data):
         instance = self.model.objects.get(pk=request.POST.get('id'))
@@ -425,31 +394,120 @@ class ShipmentOperationListView(AdminListView):
         return data
 
     def handle_assignproducts(self, request, data):
-        operation_id = request.POST["id"]
-        product_ids = request.POST["transported_product"].split(",")
-        weight = request.POST["weight"].split(",")
-        amount = request.POST["amount"].split(",")
-
-        operation = get_object_or_404(Operation, pk=operation_id)
-        products = TransportedProduct.objects.filter(id__in=product_ids)
+        """
+        Asigna productos del catálogo a la operación con el peso y la cantidad capturados.
+        Como antes, la operación se liga a una copia del producto con esos valores (es lo que leen la carta
+        porte y el packing) y el catálogo no se modifica. Volver a asignar un producto actualiza su copia en
+        lugar de duplicarla. Todo se valida antes de escribir y se guarda en un número fijo de consultas.
+        """
+        operation = get_object_or_404(Operation, pk=request.POST["id"])
+        product_ids = [value.strip() for value in request.POST.get("transported_product", "").split(",") if value.strip()]
+        weights = request.POST.get("weight", "").split(",")
+        amounts = request.POST.get("amount", "").split(",")
+
+        products = TransportedProduct.objects.in_bulk(product_ids)
+        found = {str(pk) for pk in products}
+        errors = [f"Producto {product_id} no existe" for product_id in product_ids if product_id not in found]
+
+        desired = {}
+        for index, product_id in enumerate(product_ids):
+            if product_id not in found:
+                continue
+            product = products[TransportedProduct._meta.pk.to_python(product_id)]
+            weight = weights[index].strip() if index < len(weights) else ""
+            amount = amounts[index].strip() if index < len(amounts) else ""
+            try:
+                # Si no se captura peso o cantidad se usan los del producto
+                desired[product.pk] = (float(weight) if weight else product.weight,
+                                       int(amount) if amount else product.amount)
+            except ValueError:
+                errors.append(f"Producto {product_id}: peso y cantidad deben ser numéricos")
+
+        if errors:
+            data["error"] = "\n".join(errors)
+            data["errors"] = errors
+            return data
+
+        def signature(product):
+            return product.transported_product_key, product.unit_key, product.description
+
+        # Copias ya ligadas a la operación, por clave SAT y descripción del producto base
+        linked = {}
+        for product in operation.transported_products.all():
+            linked.setdefault(signature(product), product)
+        current = {
+            assignment.transported_product_id: assignment
+            for assignment in OperationTransportedProduct.objects.filter(
+                operation=operation, transported_product_id__in=list(desired)
+            )
+        }
 
-        for index in range(0, products.count()):
-            OperationTransportedProduct.objects.create(
-                operation=operation,
-                transported_product=products[index],
-                weight=products[index].weight,
-                amount=products[index].amount
+        copies_to_create, copies_to_update, unlink = [], [], []
+        to_create, to_update = [], []
+        for product_id, (weight, amount) in desired.items():
+            base = products[product_id]
+            copy = linked.get(signature(base))
+            if copy is None or copy.pk == base.pk:
+                if copy is not None:
+                    unlink.append(base.pk)  # la operación apuntaba al producto del catálogo: se cambia por copia
+                copies_to_create.append(TransportedProduct(
+                    transported_product_key=base.transported_product_key,
+                    unit_key=base.unit_key,
+                    description=base.description,
+                    currency=base.currency,
+                    is_danger=base.is_danger,
+                    weight=weight,
+                    amount=amount,
+                ))
+            elif (copy.weight, copy.amount) != (weight, amount):
+                copy.weight, copy.amount = weight, amount
+                copies_to_update.append(copy)
+
+            assignment = current.get(product_id)
+            if assignment is None:
+                to_create.append(OperationTransportedProduct(
+                    operation=operation, transported_product_id=product_id, weight=weight, amount=amount
+                ))
+            elif (assignment.weight, assignment.amount) != (weight, amount):
+                assignment.weight, assignment.amount = weight, amount
+                to_update.append(assignment)
+
+        through = Operation.transported_products.through
+        with transaction.atomic():
+            if unlink:
+                through.objects.filter(operation_id=operation.pk, transportedproduct_id__in=unlink).delete()
+            TransportedProduct.objects.bulk_create(copies_to_create)
+            TransportedProduct.objects.bulk_update(copies_to_update, ["weight", "amount"])
+            through.objects.bulk_create(
+                [through(operation_id=operation.pk, transportedproduct_id=copy.pk) for copy in copies_to_create]
             )
+            OperationTransportedProduct.objects.bulk_create(to_create, ignore_conflicts=True)
+            OperationTransportedProduct.objects.bulk_update(to_update, ["weight", "amount"])
+            # bulk_create no dispara m2m_changed
+            Operation.refresh_readiness([operation.pk])
 
-            products[index].id = None
-            products[index].weight = weight[index]
-            products[index].amount = amount[index]
-            products[index].save()
-            operation.transported_products.add(products[index])
-            operation.save()
+        updated = len(copies_to_update)
+        data["success"] = True
+        data["created"] = len(copies_to_create)
+        data["updated"] = updated
+        data["unchanged"] = len(desired) - len(copies_to_create) - updated
+        data["message"] = f"{operation.folio}: {len(copies_to_create)} productos asignados, {updated} actualizados"
+        return data
 
+    def handle_stamp_batch(self, request, data):
+        """
+        Encola el timbrado masivo de cartaportes de las operaciones seleccionadas (ids separados por coma).
+        """
+        operation_ids = [value.strip() for value in request.POST.get("ids", "").split(",") if value.strip()]
+        job = ShipmentFacturapiInvoice.create_stamp_job(operation_ids, request.user)
         data["success"] = True
-        data["message"] = f"{products.count()} productos asignados a {operation.folio}"
+        data["job"] = str(job.id)
+        data["message"] = f"Timbrado de {job.total} operaciones en proceso"
+        return data
+
+    def handle_stamp_batch_status(self, request, data):
+        job = get_object_or_404(BackgroundJob, pk=request.POST.get("job"), kind=ShipmentFacturapiInvoice.STAMP_JOB_KIND)
+        data.update(job.to_status_dict())
         return data
 
     def handle_get_assign_cargo_form(self, request, data):
@@ -1,11 +1,13 @@
 import json
 
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpResponse, Http404, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 
 from core.operations_panel.forms.route import RouteForm
 from core.operations_panel.models.route import Route
+from core.operations_panel.services import get_route_map, ROUTE_MAP_FORMATS
 from core.system.views import AdminListView
 from polyline import decode
 
@@ -23,10 +25,8 @@ class RouteListView(AdminListView):
     dropdown_action_path = 'operations_panel/route/table/actions.js'
     static_path = 'operations_panel/route/table/base.html'
 
-    def handle_searchdata(self, request, data):
-        queryset = self.get_queryset().exclude(name__contains="OPERATION")
-        data = [obj.to_display_dict(keys=self.datatable_keys) for obj in queryset]
-        return data
+    def get_queryset(self):
+        return super().get_queryset().exclude(name__contains="OPERATION")
 
 
 class RouteMapView(LoginRequiredMixin, TemplateView):
@@ -35,9 +35,7 @@ class RouteMapView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         route = get_object_or_404(Route, pk=self.kwargs['route_id'])
-        data = route.optimized_route
-        coords = []
-        overview_polyline = data.get("overview_polyline", {}).get("points", "")
+        overview_polyline = route.overview_polyline or ""
         coords = [{"lat": lat, "lng": lng} for lat, lng in decode(overview_polyline)]
 
         context["route_coords"] = json.dumps(coords)
@@ -83,3 +81,35 @@ class RouteMapView(LoginRequiredMixin, TemplateView):
         context['waypoints'] = waypoints
 
         return context
+
+
+class RouteMapRenderView(LoginRequiredMixin, View):
+    """
+    Renderiza el mapa de una ruta en memoria a partir de la polyline guardada.
+    ?format=html (folium, por defecto) o ?format=svg (vista previa estática).
+    """
+    content_types = {
+        "html": "text/html; charset=utf-8",
+        "svg": "image/svg+xml",
+    }
+
+    def get(self, request, route_id):
+        fmt = request.GET.get("format", "html")
+        if fmt not in ROUTE_MAP_FORMATS:
+            return HttpResponseBadRequest(f"Formato no soportado: {fmt}")
+
+        route = get_object_or_404(
+            Route.objects.select_related("initial_location__address", "destination_location__address"),
+            pk=route_id,
+        )
+        waypoints = []
+        if fmt == "html":
+            waypoints = [
+                {"name": stop.name, "lat": stop.address.latitude, "lng": stop.address.longitude}
+                for stop in route.route_stops.select_related("address") if stop.address
+            ]
+
+        content = get_route_map(route, fmt, waypoints)
+        if content is None:
+            raise Http404("La ruta no tiene trazo calculado.")
+        return HttpResponse(content, content_type=self.content_types[fmt])
@@ -29,16 +29,3 @@ class TransportedProductListView(AdminListView):
             'placeholder': '',
         },
     ]
-
-    def handle_searchdata(self, request, data):
-        """
-        Retorna todos los registros como lista de dicts.
-        """
-        # Obtén los objetos de la tabla (o filtra según tus necesidades)
-        queryset = self.get_queryset()
-        datatable_keys = self.datatable_keys
-        data = [obj.to_display_dict(keys=datatable_keys) for obj in self.get_queryset()]
-        print(data)
-        return data
-
-
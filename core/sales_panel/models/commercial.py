@@ -12,7 +12,7 @@ from packaging.utils import _
 
 from apps.telegram_bots.models import TelegramUser
 from core.operations_panel.models import Supplier, Client
-from core.operations_panel.services import draw_route_on_map, build_address_string
+from core.operations_panel.services import build_address_string
 from core.system.functions import paragraph_replace_text
 from core.system.models import BaseModel, SystemUser
 from apps.google_drive.models import GoogleDriveFile, GoogleDriveFolder
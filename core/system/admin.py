@@ -8,7 +8,7 @@ from core.sales_panel.models.commercial import LeadCategory, LeadContact, LeadIn
     Quotation
 from core.operations_panel.models import Operation, TransportedProduct, Cargo, Route, DeliveryLocation, Supplier, \
     Client, Driver
-from core.system.models import SystemUser, Category, Section
+from core.system.models import SystemUser, Category, Section, BackgroundJob, BackgroundJobItem
 
 
 class BaseAdmin(admin.ModelAdmin):
@@ -210,6 +210,19 @@ class SystemUserAdmin(UserAdmin):
     raw_id_fields = ('user',)
 
 
+class BackgroundJobItemInline(BaseTabularInline):
+    model = BackgroundJobItem
+    extra = 0
+    fields = ('position', 'reference', 'status', 'attempts', 'message', 'result')
+    readonly_fields = fields
+
+
+class BackgroundJobAdmin(BaseAdmin):
+    list_display = ('kind', 'status', 'total', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    inlines = [BackgroundJobItemInline]
+
+
 # Register models with the admin site
 admin.site.register(SystemUser, SystemUserAdmin)
 admin.site.register(Client)
@@ -224,6 +237,7 @@ admin.site.register(Cargo)
 admin.site.register(Route)
 admin.site.register(DeliveryLocation)
 admin.site.register(DistributionPacking)
+admin.site.register(BackgroundJob, BackgroundJobAdmin)
 
 admin.site.register(LeadCategory)
 admin.site.register(LeadContact)
@@ -10,5 +10,7 @@ class SystemConfig(AppConfig):
         Import signal handlers when the app is ready.
         """
         # Import signal handlers
-        # import apps.system.signals
-        pass
\ No newline at end of file
+        import core.system.signals  # noqa: F401
+        from core.system.serializers import compile_display_serializers
+
+        compile_display_serializers()
\ No newline at end of file
@@ -1,19 +1,38 @@
 import json
 
-import requests
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.generic import FormView
 
-from apps.facturapi.models import FacturapiProduct
-from apps.facturapi.services import get_headers
+from apps.facturapi.choices import SatCatalog
+from apps.facturapi.models import FacturapiProduct, SatCatalogEntry
+from apps.facturapi.client import request as facturapi_request
 from core.operations_panel.models import TransportedProduct
 
 
 def getCatalogProductsURL():
-    return "https://www.facturapi.io/v2/catalogs/products?q="
+    return "/catalogs/products"
 
 def getCatalogUnitsURL():
-    return "https://www.facturapi.io/v2/catalogs/units?q="
+    return "/catalogs/units"
+
+def searchSatCatalog(catalog, url, params):
+    """
+    Busca en la copia local del catálogo del SAT; solo si no hay nada local (catálogo sin cargar) y
+    SAT_CATALOG_REMOTE_FALLBACK está activo se consulta FacturAPI.
+    """
+    rows, more = SatCatalogEntry.search(catalog, params.get('term'), page=params.get('page'))
+    if not rows and settings.SAT_CATALOG_REMOTE_FALLBACK \
+            and not SatCatalogEntry.objects.filter(catalog=catalog).exists():
+        resp = facturapi_request("GET", url, params={"q": params.get('term', '')})
+        if (resp.status_code != 200):
+            raise Exception(resp.content)
+        rows = [(element['key'], element['description']) for element in json.loads(resp.content)["data"]]
+        more = False
+    return {
+        "results": [{'id': key, 'text': key + ": " + description} for key, description in rows],
+        "pagination": {"more": more},
+    }
 
 class CatalogView(FormView):
     def post(self, request, *args, **kwargs):
@@ -30,37 +49,11 @@ class CatalogView(FormView):
                         element['id'] = products[i].id
                         element['text'] = products[i].description + ": " + products[i].unit_key
                         data["results"].append(element)
-                    data["pagination"] = {"more": True}
+                    data["pagination"] = {"more": False}
                 elif catalog == 'ProductAndServiceCatalog':
-                    url = getCatalogProductsURL() + request.POST['term']
-                    headers = get_headers()
-                    resp = requests.get(url, headers=headers)
-                    if (resp.status_code != 200):
-                        raise Exception(resp.content)
-                    s = json.loads(resp.content)
-                    dict_data = s["data"]
-                    data["results"] = []
-                    for i in range(0, len(dict_data)):
-                        element = {}
-                        element['id'] = dict_data[i]['key']
-                        element['text'] = dict_data[i]['key'] + ": " + dict_data[i]['description']
-                        data["results"].append(element)
-                    data["pagination"] = {"more": True}
+                    data.update(searchSatCatalog(SatCatalog.PRODUCTS, getCatalogProductsURL(), request.POST))
                 elif catalog == 'UnitSat':
-                    url = getCatalogUnitsURL() + request.POST['term']
-                    headers = get_headers()
-                    resp = requests.get(url, headers=headers)
-                    if (resp.status_code != 200):
-                        raise Exception(resp.content)
-                    s = json.loads(resp.content)
-                    dict_data = s["data"]
-                    data["results"] = []
-                    for i in range(0, len(dict_data)):
-                        element = {}
-                        element['id'] = dict_data[i]['key']
-                        element['text'] = dict_data[i]['key'] + ": " + dict_data[i]['description']
-                        data["results"].append(element)
-                    data["pagination"] = {"more": True}
+                    data.update(searchSatCatalog(SatCatalog.UNITS, getCatalogUnitsURL(), request.POST))
             elif action == 'SelectProduct':
                 product = FacturapiProduct.objects.get(pk=request.POST['selected'])
                 data["price"] = str(product.price)
@@ -13,4 +13,25 @@ class SystemEnum(models.TextChoices):
     SALE = 'SALE', _('VENTAS')
     RH = 'RH', _('RH')
     ATTENDANCE = 'ATTENDANCE', _('ATTENDANCE')
-    # Add more system types as needed
\ No newline at end of file
+    # Add more system types as needed
+
+class JobStatus(models.TextChoices):
+    """
+    Estados de un trabajo en segundo plano.
+    """
+    PENDING = 'PENDING', _('Pendiente')
+    RUNNING = 'RUNNING', _('En proceso')
+    DONE = 'DONE', _('Terminado')
+    FAILED = 'FAILED', _('Fallido')
+
+
+class JobItemStatus(models.TextChoices):
+    """
+    Estados de cada elemento de un trabajo en segundo plano.
+    """
+    PENDING = 'PENDING', _('Pendiente')
+    RUNNING = 'RUNNING', _('En proceso')
+    RETRYING = 'RETRYING', _('Reintentando')
+    SUCCESS = 'SUCCESS', _('Correcto')
+    SKIPPED = 'SKIPPED', _('Omitido')
+    FAILED = 'FAILED', _('Fallido')
@@ -1,3 +1,4 @@
+import json
 from typing import Type, Optional
 
 import requests
@@ -144,3 +145,16 @@ def extract_best_coincidence_from_field_in_model(
                 return obj
 
     return None
+
+
+def estimated_count(queryset, threshold=10000):
+    """
+    Cuenta los registros de un queryset. Si el planificador de Postgres estima más de `threshold` filas
+    se devuelve la estimación (evita un COUNT(*) completo en tablas grandes); si no, el conteo exacto.
+    """
+    try:
+        plan = queryset.explain(format='json')
+        rows = int(json.loads(plan)[0]['Plan']['Plan Rows'])
+    except Exception:
+        return queryset.count()
+    return rows if rows > threshold else queryset.count()
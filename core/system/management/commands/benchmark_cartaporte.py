@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from core.operations_panel.functions import build_cartaporte_xml
+from core.operations_panel.models.operation import Operation
+from core.operations_panel.models.shipment_facturapi_invoice import ShipmentFacturapiInvoice
+from core.operations_panel.models.transported_product import TransportedProduct
+
+
+class Command(BaseCommand):
+    help = "MIDE LA CARGA Y EL ARMADO DEL XML DE CARTA PORTE DE UNA OPERACIÓN (CONSULTAS Y TIEMPO)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation_id', type=str, help='Operación con ruta, vehículo y operador')
+        parser.add_argument('--products', type=int, default=200,
+                            help='Productos sintéticos en memoria (0 = usar los de la operación)')
+        parser.add_argument('--repeat', type=int, default=20, help='Repeticiones del armado del XML')
+
+    def handle(self, *args, **options):
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                operation = ShipmentFacturapiInvoice.load_operation(options['operation_id'])
+                load_time = time.perf_counter() - start
+        except Operation.DoesNotExist:
+            raise CommandError("La operación no existe")
+        self.stdout.write(f"   CARGA: {load_time * 1000:.1f} ms, {len(queries.captured_queries)} consultas")
+
+        stops = list(operation.route.route_stops.all()) if operation.route else []
+        products = list(operation.transported_products.all())
+        if options['products']:
+            products = [
+                TransportedProduct(transported_product_key="24112700", unit_key="H87", description=f"PRODUCTO {index}",
+                                   weight=10.5, amount=index + 1)
+                for index in range(options['products'])
+            ]
+
+        invoice = ShipmentFacturapiInvoice(
+            operation=operation, total_distance_km=operation.route.optimized_distance if operation.route else 0,
+            departure_at=now(), scheduled_arrival_at=now(), sct_permit_number="BENCH", sct_permit_type="TPAF01",
+            ccp_id="CCC00000-0000-0000-0000-000000000000",
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                xml = build_cartaporte_xml(invoice, operation, stops, products)
+            elapsed = (time.perf_counter() - start) / options['repeat']
+
+        self.stdout.write(
+            f"   XML: {len(products)} productos, {len(stops)} paradas, {elapsed * 1000:.2f} ms por armado, "
+            f"{len(queries.captured_queries)} consultas, {len(xml)} caracteres"
+        )
+        self.stdout.write(self.style.SUCCESS("✅ BENCHMARK TERMINADO"))
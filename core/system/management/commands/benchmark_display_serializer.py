@@ -0,0 +1,51 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.system.serializers import get_display_serializer, reflective_display_dict
+
+
+class Command(BaseCommand):
+    help = "COMPARA EL SERIALIZADOR COMPILADO CONTRA EL to_display_dict POR REFLEXIÓN."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', type=str, help='Modelo en formato app_label.Model (ej. operations_panel.Route)')
+        parser.add_argument('--keys', type=str, default='', help='Llaves separadas por coma (como datatable_keys)')
+        parser.add_argument('--rows', type=int, default=10000, help='Filas a serializar')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        keys = [key.strip() for key in options['keys'].split(',') if key.strip()] or None
+        rows = options['rows']
+        serializer = get_display_serializer(model, keys)
+
+        self.stdout.write(self.style.NOTICE(f"⏱️ {model.__name__}: {rows} FILAS, KEYS={keys or 'TODAS'}"))
+
+        def reflection():
+            return [reflective_display_dict(obj, keys) for obj in model.objects.all()[:rows]]
+
+        def compiled():
+            return serializer.serialize_many(serializer.prepare(model.objects.all())[:rows])
+
+        results = {}
+        for name, run in (("REFLEXIÓN", reflection), ("COMPILADO", compiled)):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                data = run()
+                elapsed = time.perf_counter() - start
+            results[name] = data
+            self.stdout.write(
+                f"   {name}: {len(data)} filas en {elapsed:.3f}s, {len(queries.captured_queries)} consultas"
+            )
+
+        if results["REFLEXIÓN"] != results["COMPILADO"]:
+            self.stdout.write(self.style.WARNING("⚠️ LOS RESULTADOS NO COINCIDEN"))
+        else:
+            self.stdout.write(self.style.SUCCESS("✅ RESULTADOS IDÉNTICOS"))
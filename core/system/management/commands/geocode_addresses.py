@@ -0,0 +1,107 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.operations_panel.models.address import Address
+from core.operations_panel.services import build_address_string, geocode_address_string, make_point
+from core.system.functions import normalize_string
+from core.system.services import RateLimiter
+
+
+class Command(BaseCommand):
+    help = "GEOCODIFICA EN LOTE LAS DIRECCIONES SIN COORDENADAS (REANUDABLE)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Direcciones leídas por lote')
+        parser.add_argument('--workers', type=int, default=4, help='Hilos para consultar la API de Google')
+        parser.add_argument('--qps', type=float, default=10, help='Máximo de consultas por segundo a la API')
+        parser.add_argument('--limit', type=int, default=None, help='Máximo de direcciones a procesar')
+        parser.add_argument('--start-after', type=str, default=None,
+                            help='Reanuda después de este id de Address (se imprime en cada lote)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        limit = options['limit']
+        limiter = RateLimiter(options['qps'])
+
+        queryset = Address.objects.filter(latitude__isnull=True).order_by('pk')
+        if options['start_after']:
+            queryset = queryset.filter(pk__gt=options['start_after'])
+        total_pending = queryset.count()
+        self.stdout.write(self.style.NOTICE(f"📍 {total_pending} DIRECCIONES SIN COORDENADAS."))
+
+        stats = defaultdict(int)
+        # Cache de la corrida: dirección normalizada -> (lat, lng) | None
+        resolved = {}
+        chunk = []
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            fields = ('id', 'street', 'exterior_number', 'colony', 'city', 'state')
+            for address in queryset.only(*fields).iterator(chunk_size=chunk_size):
+                chunk.append(address)
+                if len(chunk) >= chunk_size:
+                    self.process_chunk(chunk, executor, limiter, resolved, stats)
+                    chunk = []
+                if limit and stats['processed'] + len(chunk) >= limit:
+                    break
+            if chunk:
+                self.process_chunk(chunk, executor, limiter, resolved, stats)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ GEOCODIFICACIÓN FINALIZADA: {stats['updated']}/{stats['processed']} DIRECCIONES ACTUALIZADAS | "
+            f"{stats['api_calls']} CONSULTAS A GOOGLE ({stats['api_hits']} CON RESULTADO) | "
+            f"{stats['dedup_hits']} RESUELTAS SIN CONSULTA."
+        ))
+
+    def process_chunk(self, chunk, executor, limiter, resolved, stats):
+        groups = defaultdict(list)
+        full_addresses = {}
+        for address in chunk:
+            full_address = build_address_string(address)
+            key = normalize_string(" ".join(full_address.split()))
+            groups[key].append(address)
+            full_addresses.setdefault(key, full_address)
+
+        pending = [key for key in groups if key not in resolved]
+        stats['dedup_hits'] += len(chunk) - len(pending)
+
+        futures = {executor.submit(self.geocode, full_addresses[key], limiter): key for key in pending}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                resolved[key] = future.result()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"❌ ERROR AL GEOCODIFICAR '{full_addresses[key]}': {e}"))
+                resolved[key] = None
+            stats['api_calls'] += 1
+            if resolved[key]:
+                stats['api_hits'] += 1
+
+        to_update = []
+        for key, addresses in groups.items():
+            coords = resolved.get(key)
+            if not coords:
+                continue
+            for address in addresses:
+                address.latitude, address.longitude = coords
+                address.point = make_point(*coords)
+                to_update.append(address)
+
+        with transaction.atomic():
+            Address.objects.bulk_update(to_update, ['latitude', 'longitude', 'point'], batch_size=500)
+
+        stats['processed'] += len(chunk)
+        stats['updated'] += len(to_update)
+        hit_rate = (stats['api_hits'] / stats['api_calls'] * 100) if stats['api_calls'] else 0
+        self.stdout.write(self.style.NOTICE(
+            f"➡ {stats['processed']} procesadas, {stats['updated']} actualizadas, "
+            f"{hit_rate:.1f}% de aciertos en Google, {stats['dedup_hits']} duplicadas | "
+            f"último id: {chunk[-1].pk}"
+        ))
+
+    @staticmethod
+    def geocode(full_address, limiter):
+        limiter.wait()
+        return geocode_address_string(full_address)
@@ -64,7 +64,6 @@ class Command(BaseCommand):
                             "optimized_distance": kms,
                             "published": False,
                             "notes": None,
-                            "optimized_route": None,
                         },
                     )
                     print(obj, was_created)
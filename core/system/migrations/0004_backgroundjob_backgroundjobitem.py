@@ -0,0 +1,61 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:00
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system', '0003_category_old_id_section_old_id_systemuser_old_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('kind', models.CharField(max_length=50, verbose_name='Tipo de trabajo')),
+                ('status', models.CharField(choices=[('PENDING', 'Pendiente'), ('RUNNING', 'En proceso'), ('DONE', 'Terminado'), ('FAILED', 'Fallido')], default='PENDING', max_length=10, verbose_name='Estatus')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total de elementos')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Inicio')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Fin')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Error')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='background_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Creado por')),
+            ],
+            options={
+                'verbose_name': 'Trabajo en segundo plano',
+                'verbose_name_plural': 'Trabajos en segundo plano',
+                'ordering': ['-created_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='BackgroundJobItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('old_id', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='Posición')),
+                ('reference', models.CharField(max_length=255, verbose_name='Referencia')),
+                ('status', models.CharField(choices=[('PENDING', 'Pendiente'), ('RUNNING', 'En proceso'), ('RETRYING', 'Reintentando'), ('SUCCESS', 'Correcto'), ('SKIPPED', 'Omitido'), ('FAILED', 'Fallido')], default='PENDING', max_length=10, verbose_name='Estatus')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('message', models.TextField(blank=True, default='', verbose_name='Mensaje')),
+                ('payload', models.JSONField(blank=True, null=True, verbose_name='Datos de entrada')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Resultado')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='system.backgroundjob', verbose_name='Trabajo')),
+            ],
+            options={
+                'verbose_name': 'Elemento de trabajo',
+                'verbose_name_plural': 'Elementos de trabajo',
+                'ordering': ['job', 'position'],
+                'indexes': [models.Index(fields=['job', 'status'], name='job_item_status_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
 from .base import BaseModel
 from .users import SystemUser
 from .navigation import Category, Section, UserPermission
+from .jobs import BackgroundJob, BackgroundJobItem
 
 __all__ = [
     'BaseModel',
@@ -8,4 +9,6 @@ __all__ = [
     'Category',
     'Section',
     'UserPermission',
+    'BackgroundJob',
+    'BackgroundJobItem',
 ]
\ No newline at end of file
@@ -31,27 +31,10 @@ class BaseModel(models.Model):
 
 
     def to_display_dict(self, keys=None):
-        from django.db.models.fields.related import ForeignKey, OneToOneField, ManyToManyField
-        from django.db.models.fields.reverse_related import ManyToOneRel, ManyToManyRel
-
-        result = {}
-        # Usar keys, o todos los campos (excluyendo relaciones reversas)
-        all_fields = [f for f in self._meta.get_fields() if not isinstance(f, (ManyToOneRel, ManyToManyRel))]
-        for field in all_fields:
-            name = field.name
-            if keys and name not in keys:
-                continue
-            value = getattr(self, name, None)
-            if isinstance(field, (ForeignKey, OneToOneField)):
-                result[name] = str(value) if value else ""
-            elif isinstance(field, ManyToManyField):
-                result[name] = [str(obj) for obj in value.all()]
-            else:
-                result[name] = value
-        # Siempre agrega el id si está en keys
-        result["id"] = str(self.id)
-
-        return result
+        from core.system.serializers import get_display_serializer
+
+        # El serializador se compila una vez por modelo/keys; aquí solo se aplican sus formateadores
+        return get_display_serializer(type(self), keys).serialize(self)
 
 
 class ActiveModel(BaseModel):
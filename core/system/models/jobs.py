@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db import models
+from django.db.models import Count
+
+from core.system.enums import JobStatus, JobItemStatus
+from core.system.models.base import BaseModel
+
+
+class BackgroundJob(BaseModel):
+    """
+    Trabajo en segundo plano (timbrado masivo, cancelaciones, etc.).
+    El avance se calcula a partir de sus elementos para que la interfaz pueda consultarlo mientras corre.
+    """
+    kind = models.CharField(max_length=50, verbose_name="Tipo de trabajo")
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.PENDING,
+                              verbose_name="Estatus")
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name="background_jobs", verbose_name="Creado por")
+    total = models.PositiveIntegerField(default=0, verbose_name="Total de elementos")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Inicio")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Fin")
+    error = models.TextField(blank=True, default="", verbose_name="Error")
+
+    def __str__(self):
+        return f"{self.kind} ({self.get_status_display()})"
+
+    class Meta(BaseModel.Meta):
+        verbose_name = "Trabajo en segundo plano"
+        verbose_name_plural = "Trabajos en segundo plano"
+
+    def progress(self):
+        """
+        Cuenta los elementos por estatus en una sola consulta.
+        """
+        counts = dict(self.items.values_list("status").annotate(total=Count("id")).order_by())
+        return {status: counts.get(status, 0) for status in JobItemStatus.values}
+
+    def to_status_dict(self, include_items=True):
+        """
+        Resumen del trabajo para la interfaz (se consulta periódicamente mientras el trabajo corre).
+        """
+        data = {
+            "id": str(self.id),
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "progress": self.progress(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+        }
+        if include_items:
+            data["items"] = list(
+                self.items.values("position", "reference", "status", "attempts", "message", "result")
+            )
+        return data
+
+
+class BackgroundJobItem(BaseModel):
+    """
+    Elemento de un trabajo en segundo plano con su propio estatus, intentos y resultado.
+    """
+    job = models.ForeignKey(BackgroundJob, on_delete=models.CASCADE, related_name="items", verbose_name="Trabajo")
+    position = models.PositiveIntegerField(default=0, verbose_name="Posición")
+    reference = models.CharField(max_length=255, verbose_name="Referencia")
+    status = models.CharField(max_length=10, choices=JobItemStatus.choices, default=JobItemStatus.PENDING,
+                              verbose_name="Estatus")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Intentos")
+    message = models.TextField(blank=True, default="", verbose_name="Mensaje")
+    payload = models.JSONField(null=True, blank=True, verbose_name="Datos de entrada")
+    result = models.JSONField(null=True, blank=True, verbose_name="Resultado")
+
+    def __str__(self):
+        return f"{self.reference} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Elemento de trabajo"
+        verbose_name_plural = "Elementos de trabajo"
+        ordering = ["job", "position"]
+        indexes = [
+            models.Index(fields=["job", "status"], name="job_item_status_idx"),
+        ]
@@ -0,0 +1,118 @@
+from functools import lru_cache
+
+from django.apps import apps
+from django.db.models.fields.reverse_related import ForeignObjectRel
+
+
+class DisplaySerializer:
+    """
+    Serializador "compilado" para la vista de tabla de un modelo.
+
+    Se construye una sola vez por (modelo, keys): resuelve los campos, el formateador de cada uno y las
+    rutas de select_related / prefetch_related que necesita, para que serializar una fila sea solo
+    recorrer una lista de funciones sin volver a inspeccionar _meta.
+    """
+
+    def __init__(self, model, keys=None):
+        self.model = model
+        self.keys = tuple(keys) if keys else None
+        self.formatters = []
+        self.select_related = []
+        self.prefetch_related = []
+        self.only_fields = [model._meta.pk.name]
+
+        for field in model._meta.get_fields():
+            if isinstance(field, ForeignObjectRel):
+                continue
+            if self.keys and field.name not in self.keys:
+                continue
+            if field.many_to_many:
+                self.prefetch_related.append(field.name)
+                self.formatters.append((field.name, self._many_to_many(field.name)))
+            elif field.is_relation and field.concrete:
+                self.select_related.append(field.name)
+                self.only_fields.append(field.name)
+                self.formatters.append((field.name, self._related(field.name, field.attname)))
+            elif field.concrete:
+                if field.name != model._meta.pk.name:
+                    self.only_fields.append(field.name)
+                self.formatters.append((field.name, self._value(field.attname)))
+
+    @staticmethod
+    def _value(attname):
+        return lambda obj: getattr(obj, attname)
+
+    @staticmethod
+    def _related(name, attname):
+        # Se revisa la columna *_id antes de tocar la relación para no disparar una consulta cuando es NULL
+        return lambda obj: str(getattr(obj, name)) if getattr(obj, attname) is not None else ""
+
+    @staticmethod
+    def _many_to_many(name):
+        return lambda obj: [str(related) for related in getattr(obj, name).all()]
+
+    def prepare(self, queryset):
+        """
+        Ajusta el queryset a lo que la tabla muestra: solo las columnas usadas y las relaciones precargadas.
+        """
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset.only(*self.only_fields)
+
+    def serialize(self, obj):
+        result = {name: formatter(obj) for name, formatter in self.formatters}
+        result["id"] = str(obj.pk)
+        return result
+
+    def serialize_many(self, objects):
+        return [self.serialize(obj) for obj in objects]
+
+
+@lru_cache(maxsize=None)
+def _get_display_serializer(model, keys):
+    return DisplaySerializer(model, keys)
+
+
+def get_display_serializer(model, keys=None):
+    """
+    Devuelve el serializador compilado para el modelo y las llaves dadas (se construye una vez por proceso).
+    """
+    return _get_display_serializer(model, tuple(keys) if keys else None)
+
+
+def compile_display_serializers():
+    """
+    Precompila el serializador completo de cada modelo concreto que hereda de BaseModel.
+    Se llama desde SystemConfig.ready().
+    """
+    from core.system.models.base import BaseModel
+
+    for model in apps.get_models():
+        if issubclass(model, BaseModel):
+            get_display_serializer(model)
+
+
+def reflective_display_dict(obj, keys=None):
+    """
+    Implementación anterior de to_display_dict (reflexión por fila). Se conserva solo para el benchmark.
+    """
+    from django.db.models.fields.related import ForeignKey, OneToOneField, ManyToManyField
+    from django.db.models.fields.reverse_related import ManyToOneRel, ManyToManyRel
+
+    result = {}
+    all_fields = [f for f in obj._meta.get_fields() if not isinstance(f, (ManyToOneRel, ManyToManyRel))]
+    for field in all_fields:
+        name = field.name
+        if keys and name not in keys:
+            continue
+        value = getattr(obj, name, None)
+        if isinstance(field, (ForeignKey, OneToOneField)):
+            result[name] = str(value) if value else ""
+        elif isinstance(field, ManyToManyField):
+            result[name] = [str(related) for related in value.all()]
+        else:
+            result[name] = value
+    result["id"] = str(obj.id)
+    return result
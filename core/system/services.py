@@ -0,0 +1,378 @@
+import csv
+import datetime
+import random
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch
+from django.http import FileResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from core.system.enums import JobStatus, JobItemStatus
+from core.system.models import BackgroundJob, BackgroundJobItem, Category, Section
+
+NAV_CACHE_TIMEOUT = 60 * 60 * 24
+NAV_VERSION_KEY = "nav:version"
+
+
+def _nav_version():
+    # La versión cambia con cada alta/baja/edición de Category o Section (ver core.system.signals)
+    return cache.get_or_set(NAV_VERSION_KEY, 1, None)
+
+
+def invalidate_nav_cache():
+    """
+    Invalida el árbol de navegación y los menús renderizados de todos los sistemas.
+    """
+    try:
+        cache.incr(NAV_VERSION_KEY)
+    except ValueError:
+        cache.set(NAV_VERSION_KEY, 2, None)
+
+
+def get_nav_tree(system):
+    """
+    Categorías del sistema con sus secciones, en una sola consulta con prefetch y cacheadas por sistema.
+    Se guardan como dicts para que el valor en caché sea ligero de serializar.
+    """
+    key = f"nav:tree:{system}:{_nav_version()}"
+    tree = cache.get(key)
+    if tree is not None:
+        return tree
+
+    sections = Prefetch("sections", queryset=Section.objects.order_by("priority"), to_attr="sections_for_template")
+    categories = Category.objects.filter(system=system).order_by("priority").prefetch_related(sections)
+    tree = [
+        {
+            "name": category.name,
+            "icon": category.icon,
+            "url": category.url,
+            "sections_for_template": [
+                {"name": section.name, "icon": section.icon, "url": section.url}
+                for section in category.sections_for_template
+            ],
+        }
+        for category in categories
+    ]
+    cache.set(key, tree, NAV_CACHE_TIMEOUT)
+    return tree
+
+
+def render_nav_menu(request, system, tree=None):
+    """
+    Renderiza el sidebar y lo memoiza por sistema y ruta activa.
+    Las rutas que no son una URL del menú producen el mismo HTML, así que comparten una sola entrada.
+    """
+    tree = get_nav_tree(system) if tree is None else tree
+    nav_urls = {category["url"] for category in tree}
+    nav_urls.update(section["url"] for category in tree for section in category["sections_for_template"])
+    active_path = request.path if request.path in nav_urls else "-"
+
+    key = f"nav:menu:{system}:{_nav_version()}:{active_path}"
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string("base/elements/sidebar.html", {"navcategories": tree, "request": request})
+        cache.set(key, html, NAV_CACHE_TIMEOUT)
+    return html
+
+
+EXPORT_FORMATS = ("csv", "xlsx")
+EXPORT_CHUNK_SIZE = 2000
+
+
+def chunked(iterable, size):
+    """
+    Agrupa un iterable en listas de `size` elementos sin materializarlo completo.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _export_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value)
+    if isinstance(value, datetime.datetime):
+        # openpyxl no acepta datetimes con zona horaria
+        return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+    if isinstance(value, (str, int, float, bool, Decimal, datetime.date)):
+        return value
+    return str(value)
+
+
+class _Echo:
+    """
+    Pseudo-buffer para csv.writer: devuelve la línea escrita en lugar de guardarla.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv_response(headers, rows, filename):
+    """
+    CSV en streaming: cada fila se escribe y se envía al cliente conforme se genera.
+    """
+    writer = csv.writer(_Echo())
+
+    def content():
+        yield "\ufeff"  # BOM para que Excel respete los acentos
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow([_export_value(value) for value in row])
+
+    response = StreamingHttpResponse(content(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def xlsx_response(headers, rows, filename, title="Datos"):
+    """
+    XLSX con un workbook write-only de openpyxl (memoria constante) volcado a un archivo temporal,
+    que después se envía en bloques con FileResponse.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append(headers)
+    for row in rows:
+        sheet.append([_export_value(value) for value in row])
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=filename,
+        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    )
+
+
+def iter_sheet_rows(uploaded_file):
+    """
+    Recorre la primera hoja de un XLSX una sola vez en modo read-only (memoria constante).
+    Regresa (número de fila, dict {ENCABEZADO: valor}) con los encabezados en mayúsculas; omite filas vacías.
+    """
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    except Exception:
+        raise Exception("El archivo debe ser un Excel .xlsx válido")
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = [str(value or "").strip().upper() for value in next(rows, ())]
+        for number, values in enumerate(rows, start=2):
+            if not any(value not in (None, "") for value in values):
+                continue
+            yield number, dict(zip(headers, values))
+    finally:
+        workbook.close()
+
+
+class _ZipStream:
+    """
+    Archivo de solo escritura para zipfile: guarda lo escrito hasta que el generador lo envía (drain).
+    Al no tener seek(), zipfile escribe cada entrada con descriptor de datos y no necesita regresar.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+# Formatos que ya vienen comprimidos; recomprimirlos solo gasta CPU
+ZIP_STORED_EXTENSIONS = (".pdf", ".zip", ".png", ".jpg", ".jpeg", ".xlsx")
+
+
+def stream_zip_response(entries, filename):
+    """
+    ZIP en streaming con memoria constante. `entries` es un iterable de (nombre, chunks): cada entrada
+    se agrega conforme llega y sus bytes se envían al cliente sin esperar a tener el archivo completo.
+    """
+
+    def content():
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, mode="w") as archive:
+            for name, chunks in entries:
+                info = zipfile.ZipInfo(name, date_time=timezone.localtime().timetuple()[:6])
+                info.compress_type = (zipfile.ZIP_STORED if name.lower().endswith(ZIP_STORED_EXTENSIONS)
+                                      else zipfile.ZIP_DEFLATED)
+                with archive.open(info, mode="w", force_zip64=True) as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                        data = stream.drain()
+                        if data:
+                            yield data
+                data = stream.drain()
+                if data:
+                    yield data
+        yield stream.drain()  # directorio central
+
+    response = StreamingHttpResponse(content(), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+JOB_MAX_WORKERS = 4
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BACKOFF = 2  # segundos; se duplica en cada reintento
+
+
+class RateLimiter:
+    """
+    Limita las llamadas a `rate` por segundo entre todos los hilos de un trabajo (espaciado uniforme).
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate and rate > 0 else 0
+        self.next_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_at, now)
+            self.next_at = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+
+class JobItemSkipped(Exception):
+    """
+    El elemento no necesita procesarse (por ejemplo, ya estaba timbrado); se marca como omitido.
+    """
+
+
+def create_job(kind, references, user=None, payloads=None):
+    """
+    Crea el trabajo y todos sus elementos (un bulk_create). `references` identifica cada elemento y
+    `payloads`, si se da, trae los datos de entrada de cada uno en el mismo orden.
+    """
+    references = list(references)
+    payloads = list(payloads) if payloads is not None else [None] * len(references)
+    job = BackgroundJob.objects.create(
+        kind=kind,
+        created_by=user if user is not None and user.is_authenticated else None,
+        total=len(references),
+    )
+    BackgroundJobItem.objects.bulk_create([
+        BackgroundJobItem(job=job, position=position, reference=str(reference), payload=payload)
+        for position, (reference, payload) in enumerate(zip(references, payloads))
+    ])
+    return job
+
+
+def finish_job_item(item, status, message="", result=None):
+    BackgroundJobItem.objects.filter(pk=item.pk).update(
+        status=status, message=message, result=result, updated_at=timezone.now()
+    )
+
+
+def _process_job_item(item, handler, max_attempts, is_transient, backoff):
+    items = BackgroundJobItem.objects.filter(pk=item.pk)
+    for attempt in range(1, max_attempts + 1):
+        items.update(status=JobItemStatus.RUNNING, attempts=attempt, updated_at=timezone.now())
+        try:
+            result = handler(item)
+        except JobItemSkipped as e:
+            finish_job_item(item, JobItemStatus.SKIPPED, str(e))
+            return
+        except Exception as e:
+            if attempt < max_attempts and is_transient is not None and is_transient(e):
+                items.update(status=JobItemStatus.RETRYING, message=str(e), updated_at=timezone.now())
+                # Espera exponencial con jitter para no reintentar todos los hilos al mismo tiempo
+                time.sleep(backoff * 2 ** (attempt - 1) + random.uniform(0, backoff))
+                continue
+            print(f"[JOB {item.job_id}] {item.reference}: {e}")
+            finish_job_item(item, JobItemStatus.FAILED, str(e))
+            return
+        finish_job_item(item, JobItemStatus.SUCCESS, (result or {}).get("message", ""), result)
+        return
+
+
+def run_job(job, handler, max_workers=JOB_MAX_WORKERS, max_attempts=JOB_MAX_ATTEMPTS, is_transient=None,
+            backoff=JOB_RETRY_BACKOFF):
+    """
+    Procesa los elementos pendientes del trabajo con un pool de `max_workers` hilos.
+
+    `handler(item)` hace el trabajo de un elemento y regresa un dict serializable (se guarda en `result`)
+    o lanza una excepción. Solo se reintentan los errores para los que `is_transient(e)` es verdadero;
+    un elemento fallido no detiene a los demás.
+    """
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        status=JobStatus.RUNNING, started_at=timezone.now(), updated_at=timezone.now()
+    )
+    items = list(job.items.filter(status__in=[JobItemStatus.PENDING, JobItemStatus.RETRYING]))
+
+    def process(item):
+        try:
+            _process_job_item(item, handler, max_attempts, is_transient, backoff)
+        finally:
+            # Cada hilo usa su propia conexión a la base de datos; se cierra al terminar el elemento
+            connection.close()
+
+    status, error = JobStatus.DONE, ""
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            list(pool.map(process, items))
+    except Exception as e:
+        status, error = JobStatus.FAILED, str(e)
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        status=status, error=error, finished_at=timezone.now(), updated_at=timezone.now()
+    )
+
+
+def job_results_response(job):
+    """
+    Excel con el resultado de cada elemento del trabajo (fila del archivo original, estatus y motivo).
+    """
+    headers = ["Fila", "Referencia", "Estatus", "Intentos", "Mensaje"]
+    labels = dict(JobItemStatus.choices)
+
+    def rows():
+        items = job.items.values_list("position", "payload", "reference", "status", "attempts", "message")
+        for position, payload, reference, status, attempts, message in items.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            payload = payload if isinstance(payload, dict) else {}
+            if "rows" in payload:  # elementos que agrupan varias filas del archivo
+                row = ", ".join(str(grouped["row"]) for grouped in payload["rows"])
+            else:
+                row = payload.get("row", position + 1)
+            yield [row, reference, labels.get(status, status), attempts, message]
+
+    filename = f"{job.kind}-{timezone.localtime(job.created_at):%Y%m%d%H%M}.xlsx"
+    return xlsx_response(headers, rows(), filename, title="Resultados")
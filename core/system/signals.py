@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.system.models import Category, Section
+from core.system.services import invalidate_nav_cache
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Section)
+def invalidate_navigation(sender, **kwargs):
+    """
+    Cualquier cambio en categorías o secciones invalida el menú cacheado.
+    """
+    invalidate_nav_cache()
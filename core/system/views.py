@@ -1,14 +1,19 @@
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import FieldDoesNotExist
 from django.db import transaction
 from django.db.models import Q
 from django.http import JsonResponse, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.utils.decorators import method_decorator
+from django.utils.text import slugify
 from django.utils.timezone import now
 from django.views.generic import ListView, TemplateView
 
-from core.system.functions import dispatch_user
-from core.system.models import Category, Section
+from core.system.functions import dispatch_user, estimated_count
+from core.system.serializers import get_display_serializer
+from core.system.services import (
+    EXPORT_CHUNK_SIZE, EXPORT_FORMATS, chunked, get_nav_tree, render_nav_menu, stream_csv_response, xlsx_response,
+)
 
 def log_action(user, instance, action):
     """
@@ -25,15 +30,12 @@ class AdminView:
         """
         system = user.system
 
-        # Obtiene categorías ordenadas por prioridad
-        categories = Category.objects.filter(system=system).order_by("priority").all()
-
-        # Carga secciones relacionadas (evita consultas N+1)
-        for category in categories:
-            category.sections_for_template = list(Section.objects.filter(category=category).order_by("priority"))
-
-
+        # Árbol y menú renderizado cacheados por sistema (se invalidan por señales de Category/Section)
+        categories = get_nav_tree(system)
         context['navcategories'] = categories
+        request = getattr(self, 'request', None)
+        if request is not None:
+            context['nav_menu'] = render_nav_menu(request, system, categories)
         context['user'] = user
         return context
 
@@ -60,6 +62,7 @@ class AdminListView(AdminView, ListView):
     catalogs = []
     callback_js = None
     search_fields = ['name', 'description', 'rfc']
+    datatable_order_fields = {}
 
     @method_decorator(login_required)
     def dispatch(self, request, *args, **kwargs):
@@ -144,10 +147,209 @@ class AdminListView(AdminView, ListView):
             return form.save(), None
         return None, form.errors
 
-    def handle_searchdata(self, request, data):
+    def get_display_serializer(self):
+        """
+        Serializador compilado de la tabla, o None si el modelo define su propio to_display_dict.
+        """
+        if 'to_display_dict' in vars(self.model) or not hasattr(self.model, 'to_display_dict'):
+            return None
+        return get_display_serializer(self.model, self.datatable_keys)
+
+    def prepare_queryset(self, queryset):
+        """
+        Limita el queryset a las columnas y relaciones que muestra la tabla (only + select_related).
+        Solo aplica cuando la vista usa el serialize_rows por defecto.
+        """
+        serializer = self.get_display_serializer()
+        if serializer is None or type(self).serialize_rows is not AdminListView.serialize_rows:
+            return queryset
+        return serializer.prepare(queryset)
+
+    def serialize_rows(self, queryset):
+        """
+        Convierte una página del queryset en la lista de dicts que consume la tabla.
+        Las vistas pueden sobreescribirlo con una proyección más barata.
+        """
+        serializer = self.get_display_serializer()
+        if serializer is None:
+            return [obj.to_display_dict(keys=self.datatable_keys) for obj in queryset]
+        return serializer.serialize_many(queryset)
+
+    def get_search_fields(self):
+        """
+        Devuelve solo los search_fields que existen en el modelo (evita FieldError en modelos sin 'rfc', etc.).
+        """
+        valid = []
+        for field in self.search_fields:
+            opts = self.model._meta
+            try:
+                for part in field.split("__"):
+                    model_field = opts.get_field(part)
+                    if model_field.is_relation:
+                        opts = model_field.related_model._meta
+            except FieldDoesNotExist:
+                continue
+            if not model_field.is_relation:
+                valid.append(field)
+        return valid
+
+    def get_order_field(self, key):
+        """
+        Traduce una llave de la tabla a un campo ordenable del ORM, o None si la columna no es ordenable.
+        Las vistas pueden declarar datatable_order_fields = {"key": "campo__orm"} para columnas calculadas.
+        """
+        if key in self.datatable_order_fields:
+            return self.datatable_order_fields[key]
+        try:
+            field = self.model._meta.get_field(key)
+        except FieldDoesNotExist:
+            return None
+        if field.many_to_many or field.one_to_many:
+            return None
+        if field.is_relation:
+            related_fields = {f.name for f in field.related_model._meta.concrete_fields}
+            return f"{key}__name" if "name" in related_fields else key
+        return key
+
+    def search_queryset(self, queryset, search):
+        """
+        Búsqueda global (icontains) sobre los search_fields válidos del modelo.
+        Si ninguno existe en el modelo no se filtra (la vista debe declarar sus search_fields).
+        """
+        q = Q()
+        for field in self.get_search_fields():
+            q |= Q(**{f"{field}__icontains": search})
+        return queryset.filter(q) if q else queryset
+
+    @staticmethod
+    def order_queryset(queryset, order_field, descending=False):
+        """
+        Ordena por el campo pedido, siempre con desempate por pk para que las páginas sean estables.
+        """
+        prefix = '-' if descending else ''
+        ordering = [f"{prefix}{order_field}"] if order_field else []
+        return queryset.order_by(*ordering, f"{prefix}pk")
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('export')
+        if export_format in EXPORT_FORMATS:
+            return self.export(request, export_format)
+        return super().get(request, *args, **kwargs)
+
+    def export_queryset(self, request):
+        """
+        Queryset de la vista con la búsqueda y el orden de la tabla (?search=&order=&dir=).
+        """
         queryset = self.get_queryset()
-        data = [obj.to_display_dict(keys=self.datatable_keys) for obj in queryset]
-        return data
+        search = request.GET.get('search', '').strip()
+        if search:
+            queryset = self.search_queryset(queryset, search)
+        order_field = self.get_order_field(request.GET.get('order', ''))
+        return self.order_queryset(queryset, order_field, request.GET.get('dir') == 'desc')
+
+    def export(self, request, export_format):
+        """
+        Exporta la tabla con la búsqueda y el orden actuales (?search=&order=&dir=) sin cargarla en memoria:
+        los ids se leen con un cursor en lotes de EXPORT_CHUNK_SIZE y cada lote se serializa con serialize_rows.
+        """
+        base = self.prepare_queryset(self.get_queryset())
+        queryset = self.export_queryset(request)
+
+        keys = list(self.datatable_keys)
+        headers = list(self.datatable_headers[:len(keys)]) + keys[len(self.datatable_headers):]
+
+        def rows():
+            for batch in chunked(queryset.values_list('pk', flat=True).iterator(chunk_size=EXPORT_CHUNK_SIZE),
+                                 EXPORT_CHUNK_SIZE):
+                serialized = {row['id']: row for row in self.serialize_rows(base.filter(pk__in=batch))}
+                for pk in batch:
+                    row = serialized.get(str(pk))
+                    if row is not None:
+                        yield [row.get(key) for key in keys]
+
+        filename = f"{slugify(self.title or self.model._meta.verbose_name_plural)}-{now():%Y%m%d%H%M}"
+        if export_format == 'csv':
+            return stream_csv_response(headers, rows(), f"{filename}.csv")
+        return xlsx_response(headers, rows(), f"{filename}.xlsx", title=str(self.title or '')[:31] or 'Datos')
+
+    def handle_searchdata(self, request, data):
+        """
+        Sin parámetros de DataTables devuelve la lista completa (compatibilidad).
+        Con serverSide devuelve solo la página pedida, ya filtrada y ordenada en la base de datos.
+        """
+        queryset = self.prepare_queryset(self.get_queryset())
+        if 'draw' not in request.POST:
+            return self.serialize_rows(queryset)
+
+        post = request.POST
+        records_total = estimated_count(queryset)
+
+        # Búsqueda global sobre los campos válidos del modelo
+        search = post.get('search[value]', '').strip()
+        if search:
+            queryset = self.search_queryset(queryset, search)
+            records_filtered = estimated_count(queryset)
+        else:
+            records_filtered = records_total
+
+        # Ordenamiento por la columna pedida
+        order_field, descending = None, False
+        column = post.get('order[0][column]')
+        if column is not None:
+            order_field = self.get_order_field(post.get(f'columns[{column}][data]', ''))
+            descending = post.get('order[0][dir]') == 'desc'
+        queryset = self.order_queryset(queryset, order_field, descending)
+
+        start = max(int(post.get('start', 0) or 0), 0)
+        length = int(post.get('length', -1) or -1)
+        if length < 0:
+            page = queryset[start:]
+        else:
+            page = self.paginate_keyset(request, queryset, order_field, descending, search, start, length)
+
+        return {
+            'draw': int(post.get('draw', 0) or 0),
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': self.serialize_rows(page),
+        }
+
+    def paginate_keyset(self, request, queryset, order_field, descending, search, start, length):
+        """
+        Si la petición es la página siguiente a la anterior (mismo orden y búsqueda) continúa desde el último
+        registro visto en lugar de usar OFFSET; en cualquier otro caso usa OFFSET normal.
+        El cursor se guarda en la sesión por vista. Devuelve un queryset rebanado para que serialize_rows
+        pueda seguir proyectando con .values().
+        """
+        session_key = f"datatable_cursor:{request.path}"
+        signature = [order_field, descending, search, length]
+        cursor = request.session.get(session_key)
+        page = queryset[start:start + length]
+
+        if start and cursor and cursor['signature'] == signature and cursor['next_start'] == start:
+            value, pk = cursor['last']
+            lookup = 'lt' if descending else 'gt'
+            if order_field:
+                keyset = Q(**{f"{order_field}__{lookup}": value}) | Q(**{order_field: value, f"pk__{lookup}": pk})
+                if not descending:
+                    # En Postgres los NULL van al final en orden ascendente
+                    keyset |= Q(**{f"{order_field}__isnull": True})
+            else:
+                keyset = Q(**{f"pk__{lookup}": pk})
+            page = queryset.filter(keyset)[:length]
+
+        # Solo se guardan dos columnas de la página para poder continuar desde el último registro
+        last = list(page.values_list(order_field or 'pk', 'pk'))[-1:]
+        if last and last[0][0] is not None:
+            value, pk = last[0]
+            request.session[session_key] = {
+                'signature': signature,
+                'next_start': start + length,
+                'last': [value if isinstance(value, (int, float, str, bool)) else str(value), str(pk)],
+            }
+        else:
+            request.session.pop(session_key, None)
+        return page
 
     def handle_add(self, request, data):
         instance, errors = self.save_form(request)
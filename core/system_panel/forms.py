@@ -58,6 +58,8 @@ class ActionEngineForm(BaseForm):
         ("CMR", "CMR - Cancelación masiva de facturas con relacion"),
         ("CP", "CP - Complementos de pago"),
     ]
+    # El formulario se envía con el campo oculto "action" de las vistas; el prefijo evita el choque con el campo action
+    prefix = "engine"
 
     layout = [
         {
@@ -1,9 +1,14 @@
 import dateutil
 from dateutil.utils import today
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 
-from core.system.models import Category, Section
+from core.system.enums import JobStatus
+from core.system.models import BackgroundJob, Category, Section
+from core.system.services import job_results_response
 from core.system.views import AdminTemplateView, AdminListView
 from core.system_panel.forms import CategoryForm, SectionForm, AssistantForm, ActionEngineForm, ReportEngineForm
 from apps.openai_assistant.models import Assistant
@@ -66,6 +71,57 @@ class ActionEngineView(AdminTemplateView):
     section = "Motor de acciones"
     category = "Facturacion MX"
 
+    def get(self, request, *args, **kwargs):
+        # ?job=<id> descarga el resultado por fila de un trabajo del motor
+        if request.GET.get('job'):
+            job = get_object_or_404(BackgroundJob, pk=request.GET['job'])
+            return job_results_response(job)
+        return super().get(request, *args, **kwargs)
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        data = {}
+        print(request.POST)
+        try:
+            action = request.POST.get('action', '').lower()
+            handler = getattr(self, f'handle_{action}', None)
+            if callable(handler):
+                result = handler(request, data)
+                if result is not None:
+                    data = result
+            else:
+                data['error'] = f'Acción "{action}" no reconocida'
+        except Exception as e:
+            print(e)
+            data['error'] = str(e)
+        return JsonResponse(data, safe=False)
+
+    def handle_executeactionengine(self, request, data):
+        """
+        Valida el archivo y encola el trabajo de la acción elegida; el avance se consulta con actionjobstatus.
+        """
+        from apps.facturapi.bulk_actions import create_cancellation_job, create_payment_complement_job
+
+        form = ActionEngineForm(request.POST, request.FILES)
+        if not form.is_valid():
+            raise Exception("Selecciona una acción y un archivo válido")
+        engine_action = form.cleaned_data['action']
+        if engine_action in ("CM", "CMR"):
+            job = create_cancellation_job(form.cleaned_data['file'], engine_action, request.user)
+        elif engine_action == "CP":
+            job = create_payment_complement_job(form.cleaned_data['file'], request.user)
+        else:
+            raise Exception(f'La acción "{engine_action}" no está disponible')
+        data['success'] = True
+        data['job'] = str(job.id)
+        data['message'] = f"{job.total} filas en proceso"
+        return data
+
+    def handle_actionjobstatus(self, request, data):
+        job = get_object_or_404(BackgroundJob, pk=request.POST.get('job'))
+        # El detalle por fila solo se manda al terminar; mientras corre basta con los contadores
+        return job.to_status_dict(include_items=job.status in (JobStatus.DONE, JobStatus.FAILED))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         form = ActionEngineForm()
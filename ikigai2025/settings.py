@@ -228,6 +228,9 @@ if os.environ.get('USE_S3', 'False').lower() == 'true':
 # Google API configuration
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
 
+# Guarda la respuesta completa de Google Directions en RoutePayload (almacén frío)
+ROUTES_STORE_RAW_PAYLOAD = os.environ.get('ROUTES_STORE_RAW_PAYLOAD', 'True').lower() == 'true'
+
 # Google Drive API configuration
 GOOGLE_SERVICE_ACCOUNT_FILE = os.path.join(BASE_DIR, "services.json")
 
@@ -244,6 +247,18 @@ TELEGRAM_OPERATIONS_GROUP_ID = os.environ.get('TELEGRAM_OPERATIONS_GROUP_ID', '-
 
 # FacturAPI configuration
 FACTURAPI_API_KEY = os.environ.get('FACTURAPI_LIVE_KEY', '')
+# Llamadas simultáneas a FacturAPI en los trabajos masivos (timbrado, cancelaciones)
+FACTURAPI_MAX_CONCURRENCY = int(os.environ.get('FACTURAPI_MAX_CONCURRENCY', 4))
+# Secreto con el que FacturAPI firma los webhooks (header Facturapi-Signature)
+FACTURAPI_WEBHOOK_SECRET = os.environ.get('FACTURAPI_WEBHOOK_SECRET', '')
+# Peticiones por segundo que un trabajo masivo puede hacer a FacturAPI (entre todos sus hilos)
+FACTURAPI_RATE_LIMIT = float(os.environ.get('FACTURAPI_RATE_LIMIT', 5))
+# Caché local de PDF/XML/ZIP de facturas timbradas (son inmutables); se desaloja al rebasar el tamaño máximo
+FACTURAPI_FILE_CACHE_DIR = os.environ.get('FACTURAPI_FILE_CACHE_DIR', os.path.join(BASE_DIR, 'var', 'facturapi_files'))
+FACTURAPI_FILE_CACHE_MAX_BYTES = int(os.environ.get('FACTURAPI_FILE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+# Catálogos del SAT: se buscan en SatCatalogEntry (comando load_sat_catalogs); si no hay resultados locales
+# se consulta FacturAPI mientras esto esté activo
+SAT_CATALOG_REMOTE_FALLBACK = os.environ.get('SAT_CATALOG_REMOTE_FALLBACK', 'True').lower() == 'true'
 
 # Email configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -275,6 +290,21 @@ LOGOUT_REDIRECT_URL = '/'
 
 REDIS_URL = os.environ.get("REDISCLOUD_URL", "redis://localhost:6379/0")
 
+# Cache compartida entre workers (Redis); en local sin Redis se usa memoria del proceso
+if os.environ.get("REDISCLOUD_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
 